@@ -1,13 +1,102 @@
 import base64
+import bisect
+import ctypes
+import ctypes.util
 import hashlib
+import io
 import json
+import mmap
 import os
+import re
+import select
 import shutil
+import socket
+import stat
+import struct
+import subprocess
 import sys
+import zlib
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 class HandleFile:
+    # content objects: magic, format version, codec byte, then the payload.
+    # Legacy objects are plain base64 text and can never start with b'\x00'.
+    OBJECT_MAGIC = b'\x00KOBJ'
+    OBJECT_VERSION = 1
+    CODEC_RAW = 0
+    CODEC_ZLIB = 1
+    # chunked objects hold "<chunk hash> <size>" lines, each chunk an object
+    CODEC_CHUNKED = 2
+    # tree objects hold one directory as zlib-compressed JSON,
+    # {"dirs": {name: tree hash}, "files": {name: content hash}}
+    CODEC_TREE = 3
+    TREE_CACHE_SIZE = 4096
+    # loaded on first use, False where the platform has none
+    syncfs = None
+    # uncompressed objects hold the file bytes verbatim under <hash>.raw,
+    # so they can be hardlinked, reflinked or copied by the kernel
+    RAW_SUFFIX = '.raw'
+    # raw objects can be hardlinked into exports, so they are read-only
+    RAW_MODE = 0o444
+    FICLONE = 0x40049409
+    MATERIALIZE_MODES = ('copy', 'clone', 'link')
+
+    # blobs are streamed in pieces of this size, never read whole
+    CHUNK_SIZE = 1024 * 1024
+    COMPRESSED_EXTENSIONS = {
+        '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+        '.mp3', '.mp4', '.mkv', '.avi', '.mov', '.ogg', '.flac',
+        '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+        '.jar', '.whl', '.apk', '.docx', '.xlsx', '.pptx', '.pdf',
+    }
+
+    # content hash used for object and commit ids, recorded in format.json
+    HASH_ALGORITHMS = ('md5', 'sha256', 'blake2b')
+    DEFAULT_HASH_ALGORITHM = 'md5'
+
+    # a line diff needing more edits than this shows the files replaced whole
+    DIFF_MAX_EDITS = 2000
+
+    # never tracked, neither walked nor watched, whatever .krupsignore says
+    IGNORED_DIRS = ('.krups', '__pycache__', '.git')
+    IGNORED_FILES = ('VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe')
+
+    # files are hashed on this many threads unless --jobs says otherwise
+    DEFAULT_JOBS = os.cpu_count() or 1
+
+    # files of at least chunk_threshold bytes are cut where a gear rolling
+    # hash of the content hits the mask, so an edit only moves nearby cuts.
+    # The chunker hashes byte by byte in Python, a few MB/s, so it is off
+    # unless init --chunk-threshold turns it on
+    DEFAULT_CHUNK_THRESHOLD = 0
+    CHUNK_MIN = 256 * 1024
+    CHUNK_MAX = 4 * 1024 * 1024
+    CHUNK_MASK = ((1 << 20) - 1) << 44
+    GEAR = tuple(int.from_bytes(hashlib.md5(bytes([byte])).digest()[:8], 'big')
+                 for byte in range(256))
+
+    def __init__(self, stat_cache=None, jobs=None, packs=None):
+        self.stat_cache = stat_cache
+        self.packs = packs
+        self.jobs = jobs if jobs else self.DEFAULT_JOBS
+        self.hash_algorithm = self.DEFAULT_HASH_ALGORITHM
+        self.materialize_mode = 'copy'
+        self.chunk_threshold = self.DEFAULT_CHUNK_THRESHOLD
+        self.daemon = None
+        self.ignore_cache = {}
+        self.tree_cache = {}
+        self.index_cache = None
+        self.index_files = {}
+        self.journal_file = None
+
     def create_file(self, file_path):
         try:
             if not os.path.exists(file_path):
@@ -27,12 +116,162 @@ class HandleFile:
             return {}
 
     def write_JSON_file(self, JSON_file, data):
+        # a crash leaves either the old file or the new one, never half
+        self.write_JSON_file_atomic(JSON_file, data)
+
+    def write_JSON_file_atomic(self, JSON_file, data, journal=None):
         try:
-            with open(JSON_file, 'w') as file:
-                json.dump(data, file, indent=4)
+            self.write_file_atomic(JSON_file, json.dumps(
+                data, indent=4).encode('utf-8'), journal)
         except Exception as e:
             print(f"Error writing to {JSON_file}: {e}")
 
+    def write_file_atomic(self, file_path, data, journal=None):
+        # through the journal when the write belongs to a larger update
+        if journal is not None:
+            journal.write(file_path, data)
+            return
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, file_path)
+
+    def journal(self):
+        return Journal(self, self.journal_file)
+
+    def load_syncfs(self):
+        # syncfs(2) flushes a whole file system in one call, Linux only
+        if HandleFile.syncfs is None:
+            try:
+                HandleFile.syncfs = ctypes.CDLL(
+                    ctypes.util.find_library('c'), use_errno=True).syncfs
+            except (OSError, AttributeError, TypeError):
+                HandleFile.syncfs = False
+        return HandleFile.syncfs
+
+    def flush_to_disk(self, file_descriptor, paths=()):
+        # one call for everything written so far: syncfs on the repository's
+        # file system, else sync on all of them. Windows has neither, there
+        # the given file and then each path is flushed on its own
+        syncfs = self.load_syncfs()
+        if syncfs and syncfs(file_descriptor) == 0:
+            return
+        if hasattr(os, 'sync'):
+            os.sync()
+            return
+        os.fsync(file_descriptor)
+        for path in paths:
+            if os.path.isfile(path):
+                with open(path, 'rb+') as file:
+                    os.fsync(file.fileno())
+
+    def read_index(self, index_file):
+        # the staging files are binary IndexFiles; JSON ones from older
+        # versions are converted the first time they are read
+        legacy_file = index_file + '.json'
+        if not os.path.exists(index_file) and os.path.exists(legacy_file):
+            self.write_index(index_file, self.read_JSON_file(legacy_file))
+
+        try:
+            st = os.stat(index_file)
+            index = self.index_files.get(index_file)
+            if index and index.signature == (st.st_ino, st.st_size, st.st_mtime_ns):
+                return index
+            index = IndexFile(index_file)
+            self.index_files[index_file] = index
+            return index
+        except Exception as e:
+            print(f"Error reading from {index_file}: {e}")
+            return IndexFile()
+
+    def create_index(self, index_file):
+        if not os.path.exists(index_file) and not os.path.exists(index_file + '.json'):
+            self.write_index(index_file, {})
+
+    def index_digest(self, file_hash, digest_size):
+        return bytes.fromhex(file_hash) if file_hash else bytes(digest_size)
+
+    def index_block(self, directory_path, names):
+        # names maps encoded file names to digests
+        ordered = sorted(names)
+        return directory_path, b'\x00'.join(ordered), b''.join(names[name] for name in ordered)
+
+    def write_index(self, index_file, files, journal=None):
+        # digests are sized by the hashes themselves, migrate writes
+        # the new algorithm's before format.json names it
+        digest_size = next((len(file_hash) // 2 for file_hash in files.values() if file_hash),
+                           self.new_hash().digest_size)
+        empty = bytes(digest_size)
+        sep = os.sep.encode()
+        directories = {}
+        for path, file_hash in files.items():
+            directory_path, separator, name = path.encode(
+                'utf-8', 'surrogateescape').rpartition(sep)
+            directories.setdefault(directory_path + separator, {})[
+                name] = bytes.fromhex(file_hash) if file_hash else empty
+
+        try:
+            self.write_file_atomic(index_file, IndexFile.encode(
+                [self.index_block(directory_path, directories[directory_path])
+                 for directory_path in sorted(directories)], digest_size), journal)
+            # a JSON file of an older version is superseded, even unread
+            legacy_file = index_file + '.json'
+            if os.path.exists(legacy_file):
+                if journal:
+                    journal.remove(legacy_file)
+                else:
+                    os.remove(legacy_file)
+        except Exception as e:
+            print(f"Error writing to {index_file}: {e}")
+
+    def update_index(self, index_file, base, updates, removals, journal=None):
+        # only directories with changed paths are decoded and re-sorted,
+        # every other one is copied over as it is stored
+        digest_size = base.digest_size if len(base) else next(
+            (len(file_hash) // 2 for file_hash in updates.values() if file_hash),
+            self.new_hash().digest_size)
+        changed = {}
+        for path, file_hash in updates.items():
+            directory_path, name = IndexFile.split_path(path)
+            changed.setdefault(directory_path, {})[
+                name] = self.index_digest(file_hash, digest_size)
+        for path in removals:
+            directory_path, name = IndexFile.split_path(path)
+            changed.setdefault(directory_path, {})[name] = None
+
+        def changed_block(directory_path, names):
+            for name, digest in changed[directory_path].items():
+                if digest is None:
+                    names.pop(name, None)
+                else:
+                    names[name] = digest
+            return self.index_block(directory_path, names)
+
+        def blocks():
+            pending = sorted(changed)
+            i = 0
+            for directory_path, names, digests in base.iter_blocks():
+                while i < len(pending) and pending[i] < directory_path:
+                    yield changed_block(pending[i], {})
+                    i += 1
+                if i < len(pending) and pending[i] == directory_path:
+                    yield changed_block(directory_path, dict(zip(names.split(b'\x00'), (
+                        digests[offset:offset + digest_size] for offset in range(0, len(digests), digest_size)))))
+                    i += 1
+                else:
+                    yield directory_path, names, digests
+            for directory_path in pending[i:]:
+                yield changed_block(directory_path, {})
+
+        try:
+            self.write_file_atomic(index_file, IndexFile.encode(
+                blocks(), digest_size), journal)
+        except Exception as e:
+            print(f"Error writing to {index_file}: {e}")
+
+    def staging_transaction(self, added_file, index_file):
+        return StagingTransaction(self, added_file, index_file)
+
     def add_JSON_data(self, JSON_file, filename, data):
         try:
             file_data = self.read_JSON_file(JSON_file)
@@ -59,40 +298,95 @@ class HandleFile:
             print(f"Error appending user details to {users_file}: {e}")
 
     def get_added_files(self, add_file):
+        return list(self.read_index(add_file))
+
+    def get_untracked_files(self, tracked_files_data, scan=None):
+        scan = scan if scan else self.scan_worktree()
+
+        return [rel_path for rel_path, hash in scan['files'].items()
+                if not (rel_path in tracked_files_data and tracked_files_data[rel_path] == hash)]
+
+    def ignore_rules(self, root=None):
+        # compiled .krupsignore files are reused until they change on disk
+        return IgnoreRules(root if root else os.getcwd(), self.ignore_cache)
+
+    def walk_worktree(self, dir_path=None, root=None, rules=None):
+        # (file_path, rel_path, DirEntry) of every file the repository may
+        # track; ignored directories are pruned before they are listed
+        root = root if root else os.getcwd()
+        rules = rules if rules else self.ignore_rules(root)
+        rel_dir = os.path.relpath(dir_path, root) if dir_path else ''
+        rel_dir = '' if rel_dir == '.' else rel_dir
+        if rel_dir and rules.is_ignored_path(rel_dir, True):
+            return []
+
         try:
-            with open(add_file, 'r') as file:
-                files_data = json.load(file)
-                return list(files_data.keys())
+            return list(rules.walk(rel_dir))
         except Exception as e:
-            print(f"Error getting tracked files from {add_file}: {e}")
+            print(f"Error scanning working directory: {e}")
             return []
 
-    def get_untracked_files(self, tracked_files_data):
-        untracked_files = []
+    def scan_worktree(self, committed_files=None, added_files=None, dir_path=None):
+        committed_files = committed_files if committed_files else {}
+        added_files = added_files if added_files else {}
+
+        # 'new', 'modified', 'unchanged' and 'deleted' are against HEAD,
+        # the 'staged*' lists are against the staging area (added)
+        scan = {
+            'files': {},
+            'new': [],
+            'modified': [],
+            'unchanged': [],
+            'deleted': [],
+            'staged': [],
+            'staged_modified': [],
+            'staged_deleted': [],
+        }
 
-        try:
-            for root, dirs, files in os.walk(os.getcwd()):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
-                # print("dirs: ", dirs)
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    hash = self.compute_MD5_file(file_path)
-                    rel_path = os.path.relpath(file_path, os.getcwd())
+        # a running daemon already knows every file and its hash
+        files = self.daemon.scan(self.hash_algorithm) if self.daemon and not dir_path else None
+        if files is None:
+            entries = self.walk_worktree(dir_path)
+            hashes = self.compute_MD5_files_cached(entries)
+            files = {rel_path: hash for (file_path, rel_path, dir_entry),
+                     hash in zip(entries, hashes)}
+            if self.stat_cache and not dir_path:
+                self.stat_cache.prune(files)
+
+        for rel_path, hash in files.items():
+            scan['files'][rel_path] = hash
+
+            if rel_path not in committed_files:
+                scan['new'].append(rel_path)
+            elif committed_files[rel_path] != hash:
+                scan['modified'].append(rel_path)
+            else:
+                scan['unchanged'].append(rel_path)
+
+            if rel_path in added_files:
+                if added_files[rel_path] == hash:
+                    scan['staged'].append(rel_path)
+                else:
+                    scan['staged_modified'].append(rel_path)
 
-                    if not (rel_path in tracked_files_data and tracked_files_data[rel_path] == hash):
-                        untracked_files.append(rel_path)
-        except Exception as e:
-            print(f"Error getting untracked files: {e}")
-            return []
+        # a partial scan cannot tell deleted files from files outside dir_path
+        if not dir_path:
+            scan['deleted'] = [rel_path for rel_path in committed_files
+                               if rel_path not in scan['files']]
+            scan['staged_deleted'] = [rel_path for rel_path in added_files
+                                      if rel_path not in scan['files']]
+
+        return scan
 
-        return untracked_files
+    def new_hash(self, algorithm=None):
+        algorithm = algorithm if algorithm else self.hash_algorithm
+        if algorithm == 'blake2b':
+            return hashlib.blake2b(digest_size=32)
+        return hashlib.new(algorithm)
 
     def compute_MD5_file(self, file_path):
         BUF_SIZE = 65536
-        md5 = hashlib.md5()
+        md5 = self.new_hash()
 
         try:
             with open(file_path, 'rb') as file:
@@ -107,50 +401,567 @@ class HandleFile:
 
         return md5.hexdigest()
 
-    def compute_MD5_str(self, string):
+    def compute_MD5_cached(self, file_path, rel_path=None):
+        if self.stat_cache is None:
+            return self.compute_MD5_file(file_path)
+
+        rel_path = rel_path if rel_path else os.path.relpath(
+            file_path, os.getcwd())
+        return self.stat_cache.get_hash(file_path, rel_path, self.compute_MD5_file)
+
+    def compute_MD5_files(self, file_paths):
+        if self.jobs <= 1 or len(file_paths) <= 1:
+            return [self.compute_MD5_file(file_path) for file_path in file_paths]
+
+        # hashlib releases the GIL while hashing, map keeps the input order
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(self.compute_MD5_file, file_paths))
+
+    def compute_MD5_files_cached(self, entries):
+        # entries are (file_path, rel_path, DirEntry or None) as walked
+        if self.stat_cache is None:
+            return self.compute_MD5_files([entry[0] for entry in entries])
+
+        hashes = []
+        misses = []
+        for file_path, rel_path, dir_entry in entries:
+            hash, stat_data = self.stat_cache.lookup(
+                file_path, rel_path, dir_entry)
+            hashes.append(hash)
+            if hash is None and stat_data is not None:
+                misses.append((len(hashes) - 1, stat_data))
+
+        computed = self.compute_MD5_files(
+            [entries[i][0] for i, stat_data in misses])
+        for (i, stat_data), hash in zip(misses, computed):
+            hashes[i] = hash
+            self.stat_cache.store(entries[i][1], stat_data, hash)
+
+        return hashes
+
+    def compute_MD5_str(self, string, algorithm=None):
         try:
-            return hashlib.md5(json.dumps(string).encode()).hexdigest()
+            hash = self.new_hash(algorithm)
+            hash.update(json.dumps(string).encode())
+            return hash.hexdigest()
         except Exception as e:
             print(f"Error computing MD5 hash: {e}")
             return None
 
-    def encode_base64_file(self, file_path):
+    def compute_MD5_bytes(self, data):
+        hash = self.new_hash()
+        hash.update(data)
+        return hash.hexdigest()
+
+    def object_header(self, codec):
+        return self.OBJECT_MAGIC + bytes([self.OBJECT_VERSION, codec])
+
+    def is_compressible(self, file_path):
+        return os.path.splitext(file_path)[1].lower() not in self.COMPRESSED_EXTENSIONS
+
+    def object_file_path(self, object_path):
+        if not os.path.exists(object_path) and os.path.exists(object_path + self.RAW_SUFFIX):
+            return object_path + self.RAW_SUFFIX
+        return object_path
+
+    def remove_object_file(self, object_path):
         try:
-            with open(file_path, 'rb') as file:
-                data = file.read()
-                return base64.b64encode(data).decode('utf-8')
+            os.remove(object_path)
+        except PermissionError:
+            # Windows will not remove a read-only file
+            os.chmod(object_path, stat.S_IWRITE)
+            os.remove(object_path)
+
+    def has_loose_object(self, object_path):
+        return os.path.exists(self.object_file_path(object_path))
+
+    def has_object(self, object_path):
+        if self.has_loose_object(object_path):
+            return True
+        object_hash = os.path.basename(object_path)
+        return bool(self.packs) and any(self.packs.contains(object_hash, kind)
+                                        for kind in PackStore.CONTENT_KINDS)
+
+    def open_object(self, object_path):
+        # loose objects first, then packs; returns the file and whether it is raw
+        if os.path.exists(object_path):
+            return open(object_path, 'rb'), False
+        if os.path.exists(object_path + self.RAW_SUFFIX):
+            return open(object_path + self.RAW_SUFFIX, 'rb'), True
+
+        if self.packs:
+            object_hash = os.path.basename(object_path)
+            for kind, raw in ((PackStore.KIND_CONTENT, False), (PackStore.KIND_CONTENT_RAW, True)):
+                object_file = self.packs.open_object(object_hash, kind)
+                if object_file:
+                    return object_file, raw
+            if self.packs.contains(object_hash, PackStore.KIND_CONTENT_DELTA):
+                return io.BytesIO(self.read_delta(object_path)), True
+
+        raise FileNotFoundError(
+            f"object {os.path.basename(object_path)} not found")
+
+    def write_object(self, file_path, object_path, expected_hash=None):
+        # objects are content addressed, an existing one already holds the data
+        if self.has_object(object_path):
+            return True
+
+        if self.chunk_threshold and os.path.getsize(file_path) >= self.chunk_threshold:
+            return self.write_chunked_object(file_path, object_path, expected_hash)
+
+        temp_path = object_path + '.tmp'
+        try:
+            codec = self.CODEC_ZLIB if self.is_compressible(
+                file_path) else self.CODEC_RAW
+            md5 = self.new_hash()
+            raw_size = 0
+            stored_size = 0
+
+            with open(file_path, 'rb') as file, open(temp_path, 'wb') as object_file:
+                if codec == self.CODEC_ZLIB:
+                    object_file.write(self.object_header(codec))
+                compressor = zlib.compressobj() if codec == self.CODEC_ZLIB else None
+
+                while True:
+                    data = file.read(self.CHUNK_SIZE)
+                    if not data:
+                        break
+                    md5.update(data)
+                    raw_size += len(data)
+                    if compressor:
+                        data = compressor.compress(data)
+                    stored_size += len(data)
+                    object_file.write(data)
+
+                if compressor:
+                    data = compressor.flush()
+                    stored_size += len(data)
+                    object_file.write(data)
+
+            if expected_hash and md5.hexdigest() != expected_hash:
+                os.remove(temp_path)
+                print(f"Error storing file {file_path}: file changed while committing")
+                return False
+
+            # incompressible data is stored again uncompressed
+            if codec == self.CODEC_ZLIB and stored_size >= raw_size:
+                codec = self.CODEC_RAW
+                with open(file_path, 'rb') as file, open(temp_path, 'wb') as object_file:
+                    shutil.copyfileobj(file, object_file, self.CHUNK_SIZE)
+
+            if codec == self.CODEC_RAW:
+                os.chmod(temp_path, self.RAW_MODE)
+            os.replace(temp_path, object_path if codec ==
+                       self.CODEC_ZLIB else object_path + self.RAW_SUFFIX)
+            return True
         except Exception as e:
-            print(f"Error encoding file {file_path}: {e}")
-            return None
+            print(f"Error storing file {file_path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def find_chunk_end(self, data):
+        # data holds CHUNK_MAX bytes unless it is the tail of the file.
+        # The hash restarts at every cut, the first CHUNK_MIN bytes are skipped
+        if len(data) <= self.CHUNK_MIN:
+            return len(data)
+
+        gear, mask = self.GEAR, self.CHUNK_MASK
+        fingerprint = 0
+        position = self.CHUNK_MIN
+        for byte in data[self.CHUNK_MIN:self.CHUNK_MAX]:
+            fingerprint = ((fingerprint << 1) + gear[byte]) & 0xFFFFFFFFFFFFFFFF
+            position += 1
+            if not fingerprint & mask:
+                return position
+
+        return min(len(data), self.CHUNK_MAX)
+
+    def write_chunk(self, object_path, data, compressible):
+        if self.has_object(object_path):
+            return
+
+        temp_path = object_path + '.tmp'
+        stored = zlib.compress(data) if compressible else data
+        if compressible and len(stored) < len(data):
+            with open(temp_path, 'wb') as object_file:
+                object_file.write(self.object_header(self.CODEC_ZLIB))
+                object_file.write(stored)
+            os.replace(temp_path, object_path)
+        else:
+            with open(temp_path, 'wb') as object_file:
+                object_file.write(data)
+            os.chmod(temp_path, self.RAW_MODE)
+            os.replace(temp_path, object_path + self.RAW_SUFFIX)
 
-    def decode_base64_file(self, encoded_data):
+    def write_chunked_object(self, file_path, object_path, expected_hash=None):
+        temp_path = object_path + '.tmp'
         try:
-            return base64.b64decode(encoded_data)
+            content_dir = os.path.dirname(object_path)
+            compressible = self.is_compressible(file_path)
+            md5 = self.new_hash()
+            chunks = []
+            data = b''
+            eof = False
+
+            with open(file_path, 'rb') as file:
+                while data or not eof:
+                    while not eof and len(data) < self.CHUNK_MAX:
+                        block = file.read(self.CHUNK_SIZE)
+                        eof = not block
+                        data += block
+                    if not data:
+                        break
+
+                    end = self.find_chunk_end(data)
+                    chunk = data[:end]
+                    data = data[end:]
+                    md5.update(chunk)
+                    chunk_hash = self.compute_MD5_bytes(chunk)
+                    self.write_chunk(os.path.join(
+                        content_dir, chunk_hash), chunk, compressible)
+                    chunks.append(f"{chunk_hash} {len(chunk)}\n")
+
+            if expected_hash and md5.hexdigest() != expected_hash:
+                # chunks already written are left for gc
+                print(f"Error storing file {file_path}: file changed while committing")
+                return False
+
+            # a single chunk has the file's hash, it is already stored as a
+            # plain object and a chunk list there would point at itself
+            if len(chunks) == 1 and chunk_hash == os.path.basename(object_path):
+                return True
+
+            with open(temp_path, 'wb') as object_file:
+                object_file.write(self.object_header(self.CODEC_CHUNKED))
+                object_file.write(''.join(chunks).encode())
+            os.replace(temp_path, object_path)
+            return True
         except Exception as e:
-            print(f"Error decoding base64 data: {e}")
-            return None
+            print(f"Error storing file {file_path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def object_references(self, object_path):
+        # objects an object needs to be read: its chunks or its delta base,
+        # or for a tree the objects it lists
+        object_hash = os.path.basename(object_path)
+        if self.packs and not self.has_loose_object(object_path) and \
+                self.packs.contains(object_hash, PackStore.KIND_CONTENT_DELTA) and \
+                not self.packs.contains(object_hash, PackStore.KIND_CONTENT) and \
+                not self.packs.contains(object_hash, PackStore.KIND_CONTENT_RAW):
+            base_hash, delta = self.packs.parse_delta(
+                self.packs.read(object_hash, PackStore.KIND_CONTENT_DELTA))
+            return [base_hash]
+
+        tree = self.read_tree(os.path.dirname(object_path), object_hash)
+        if tree is not None:
+            files, dirs = tree
+            return list(files.values()) + list(dirs.values())
+
+        chunk_list = self.read_chunk_list(object_path)
+        return [chunk_hash for chunk_hash, size in chunk_list] if chunk_list else []
+
+    def read_chunk_list(self, object_path):
+        # [(chunk hash, size)] for a chunked object, None for any other
+        object_file, raw = self.open_object(object_path)
+        with object_file:
+            if raw:
+                return None
+            header = object_file.read(len(self.OBJECT_MAGIC) + 2)
+            if header != self.object_header(self.CODEC_CHUNKED):
+                return None
+            chunk_list = object_file.read().decode()
+
+        return [(line.split()[0], int(line.split()[1])) for line in chunk_list.splitlines() if line.strip()]
+
+    def tree_listing(self, files, dirs):
+        return json.dumps({"dirs": dirs, "files": files}, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+
+    def cache_tree(self, tree_hash, tree):
+        if len(self.tree_cache) >= self.TREE_CACHE_SIZE:
+            self.tree_cache.clear()
+        self.tree_cache[tree_hash] = tree
+
+    def read_tree(self, content_dir, tree_hash):
+        # (files, dirs) of a tree object, None for any other object
+        if tree_hash in self.tree_cache:
+            return self.tree_cache[tree_hash]
+
+        object_file, raw = self.open_object(
+            os.path.join(content_dir, tree_hash))
+        with object_file:
+            if raw:
+                return None
+            header = object_file.read(len(self.OBJECT_MAGIC) + 2)
+            if header != self.object_header(self.CODEC_TREE):
+                return None
+            listing = json.loads(zlib.decompress(object_file.read()))
+
+        tree = (listing['files'], listing['dirs'])
+        self.cache_tree(tree_hash, tree)
+        return tree
+
+    def write_tree_object(self, content_dir, files, dirs):
+        listing = self.tree_listing(files, dirs)
+        tree_hash = self.compute_MD5_bytes(listing)
+        object_path = os.path.join(content_dir, tree_hash)
+
+        if not self.has_object(object_path):
+            temp_path = object_path + '.tmp'
+            with open(temp_path, 'wb') as object_file:
+                object_file.write(self.object_header(self.CODEC_TREE))
+                object_file.write(zlib.compress(listing))
+            os.replace(temp_path, object_path)
+
+        self.cache_tree(tree_hash, (files, dirs))
+        return tree_hash
+
+    def write_tree(self, content_dir, index):
+        # one tree object per directory, written deepest first. A directory
+        # that did not change hashes to a tree that already exists, so a
+        # commit only adds the trees on the paths to its changed files
+        root = ({}, {})
+        for file_path, file_hash in index.items():
+            names = file_path.split(os.sep)
+            node = root
+            for name in names[:-1]:
+                node = node[1].setdefault(name, ({}, {}))
+            node[0][names[-1]] = file_hash
+
+        def store(node):
+            files, dirs = node
+            return self.write_tree_object(content_dir, files, {
+                name: store(child) for name, child in dirs.items()})
+
+        return store(root)
+
+    def tree_files(self, content_dir, tree_hash, prefix=''):
+        # the flat {path: content hash} index a tree stands for
+        files, dirs = self.read_tree(content_dir, tree_hash)
+        index = {os.path.join(prefix, name): file_hash
+                 for name, file_hash in files.items()}
+        for name, subtree_hash in dirs.items():
+            index.update(self.tree_files(
+                content_dir, subtree_hash, os.path.join(prefix, name)))
+        return index
+
+    def diff_tree_objects(self, content_dir, old_tree, new_tree, paths=None, prefix=''):
+        # like diff_trees but over tree objects, yielding the two content
+        # hashes as well; subtrees with equal hashes are never read
+        if old_tree == new_tree:
+            return
 
-    def is_change_to_commit(self, added_file):
+        old_files, old_dirs = self.read_tree(
+            content_dir, old_tree) if old_tree else ({}, {})
+        new_files, new_dirs = self.read_tree(
+            content_dir, new_tree) if new_tree else ({}, {})
+
+        # a directory sorts as "name/" so paths come out in diff_trees order
+        entries = [(name, False) for name in set(old_files) | set(new_files)]
+        entries.extend((name, True) for name in set(old_dirs) | set(new_dirs))
+        entries.sort(key=lambda entry: entry[0] + os.sep if entry[1] else entry[0])
+
+        for name, is_dir in entries:
+            path = os.path.join(prefix, name)
+            if is_dir:
+                if not paths or any(path == selected or path.startswith(selected + os.sep) or
+                                    selected.startswith(path + os.sep) for selected in paths):
+                    yield from self.diff_tree_objects(
+                        content_dir, old_dirs.get(name), new_dirs.get(name), paths, path)
+                continue
+
+            if paths and not any(path == selected or path.startswith(selected + os.sep) for selected in paths):
+                continue
+            old_hash, new_hash = old_files.get(name), new_files.get(name)
+            if old_hash is None:
+                yield 'A', path, None, new_hash
+            elif new_hash is None:
+                yield 'D', path, old_hash, None
+            elif old_hash != new_hash:
+                yield 'M', path, old_hash, new_hash
+
+    def iter_object(self, object_path):
+        object_file, raw = self.open_object(object_path)
+
+        with object_file:
+            if raw:
+                while True:
+                    data = object_file.read(self.CHUNK_SIZE)
+                    if not data:
+                        return
+                    yield data
+
+            header = object_file.read(len(self.OBJECT_MAGIC) + 2)
+
+            if not header.startswith(self.OBJECT_MAGIC):
+                # legacy base64 text, decoded in whole 4-character groups
+                data = header
+                while True:
+                    chunk = object_file.read(self.CHUNK_SIZE)
+                    data += chunk
+                    if not chunk:
+                        break
+                    cut = len(data) - len(data) % 4
+                    yield base64.b64decode(data[:cut])
+                    data = data[cut:]
+                if data.strip():
+                    yield base64.b64decode(data.strip())
+                return
+
+            version, codec = header[len(self.OBJECT_MAGIC):]
+            if version != self.OBJECT_VERSION:
+                raise ValueError(f"unsupported object version {version}")
+
+            if codec == self.CODEC_CHUNKED:
+                # reassemble chunk by chunk, each streamed from its own object
+                chunk_list = object_file.read().decode()
+                for line in chunk_list.splitlines():
+                    if line.strip():
+                        yield from self.iter_object(os.path.join(
+                            os.path.dirname(object_path), line.split()[0]))
+                return
+
+            decompressor = zlib.decompressobj() if codec in (
+                self.CODEC_ZLIB, self.CODEC_TREE) else None
+            while True:
+                data = object_file.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                if decompressor:
+                    # bound the inflated size of each piece as well
+                    data = decompressor.decompress(data, self.CHUNK_SIZE)
+                    yield data
+                    while decompressor.unconsumed_tail:
+                        yield decompressor.decompress(
+                            decompressor.unconsumed_tail, self.CHUNK_SIZE)
+                else:
+                    yield data
+
+            if decompressor:
+                yield decompressor.flush()
+
+    def read_delta(self, object_path):
+        # rebuild a deltified object; its base may be a delta too
+        object_hash = os.path.basename(object_path)
+        data = self.packs.cached_delta(object_hash)
+        if data is not None:
+            return data
+
+        base_hash, delta = self.packs.parse_delta(
+            self.packs.read(object_hash, PackStore.KIND_CONTENT_DELTA))
+        base = self.packs.cached_delta(base_hash)
+        if base is None:
+            base = b''.join(self.iter_object(
+                os.path.join(os.path.dirname(object_path), base_hash)))
+            self.packs.cache_delta(base_hash, base)
+
+        data = self.packs.apply_delta(base, delta)
+        self.packs.cache_delta(object_hash, data)
+        return data
+
+    def read_object(self, object_path):
         try:
-            with open(added_file, 'r') as file:
-                added_files = json.load(file)
-                return bool(added_files)
+            return b''.join(self.iter_object(object_path))
         except Exception as e:
-            print(f"Error reading file {added_file}: {e}")
+            print(f"Error reading object {object_path}: {e}")
             return None
 
-    def get_last_commit(self, head_file_path):
-        try:
-            head_content = open(head_file_path).read()
-            head_lines = head_content.split('\n')
+    def copy_object_to_file(self, object_path, file_path):
+        # never write through a file that may be hardlinked to an object
+        if os.path.lexists(file_path):
+            os.remove(file_path)
 
-            last_line = None
-            for line in reversed(head_lines):
-                if line.strip():
-                    last_line = line.strip()
-                    break
+        raw_path = object_path + self.RAW_SUFFIX
+        if self.materialize_mode != 'copy' and self.object_file_path(object_path) == raw_path:
+            self.clone_file(raw_path, file_path)
+            return
+
+        with open(file_path, 'wb') as file:
+            for data in self.iter_object(object_path):
+                file.write(data)
+
+    def clone_file(self, source_path, file_path):
+        # link (read-only exports only), then reflink, then kernel-side copies
+        if self.materialize_mode == 'link':
+            try:
+                os.link(source_path, file_path)
+                return
+            except OSError:
+                pass
+
+        with open(source_path, 'rb') as source, open(file_path, 'wb') as file:
+            if fcntl:
+                try:
+                    fcntl.ioctl(file.fileno(), self.FICLONE, source.fileno())
+                    return
+                except OSError:
+                    pass
+
+            size = os.fstat(source.fileno()).st_size
+            for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+                if copy is None:
+                    continue
+                try:
+                    offset = 0
+                    while offset < size:
+                        if copy is os.sendfile:
+                            copied = copy(file.fileno(), source.fileno(),
+                                          offset, size - offset)
+                        else:
+                            copied = copy(source.fileno(), file.fileno(),
+                                          size - offset, offset, offset)
+                        if not copied:
+                            break
+                        offset += copied
+                    if offset == size:
+                        return
+                except OSError:
+                    pass
+                file.seek(0)
+                file.truncate()
+
+            source.seek(0)
+            shutil.copyfileobj(source, file, self.CHUNK_SIZE)
+
+    def materialize_files(self, files, content_dir, dest_dir):
+        # directory skeleton first, so the workers only open and write files
+        for dir_name in sorted({os.path.dirname(rel_path) for rel_path, file_hash in files}):
+            os.makedirs(os.path.join(dest_dir, dir_name), exist_ok=True)
+
+        def write_file(entry):
+            rel_path, file_hash = entry
+            try:
+                self.copy_object_to_file(os.path.join(
+                    content_dir, file_hash), os.path.join(dest_dir, rel_path))
+                return None
+            except Exception as e:
+                return e
 
-            return last_line
+        if self.jobs <= 1 or len(files) <= 1:
+            errors = [write_file(entry) for entry in files]
+        else:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                errors = list(executor.map(write_file, files))
+
+        # errors are reported in path order whatever order the workers finished in
+        written = []
+        for (rel_path, file_hash), error in zip(files, errors):
+            if error:
+                print(f"Error writing file {rel_path}: {error}")
+            else:
+                written.append(rel_path)
+        return written
+
+    def is_change_to_commit(self, added_file):
+        return bool(self.read_index(added_file))
+
+    def get_last_commit(self, head_file_path):
+        # HEAD is an append-only log, its tip is in the last block
+        try:
+            return next(self.read_lines_reversed(head_file_path), None)
         except Exception as e:
             print(f"Error reading file {head_file_path}: {e}")
             return None
@@ -168,130 +979,1828 @@ class HandleFile:
 
     def get_second_last_commit(self, head_file_path):
         try:
-            with open(head_file_path) as file:
-                head_content = file.read()
-                head_lines = head_content.split('\n')
-
-                commit_lines = [line.strip()
-                                for line in reversed(head_lines) if line.strip()]
-
-                if len(commit_lines) >= 2:
-                    return commit_lines[1]
-                else:
-                    return None
+            commit_lines = self.read_lines_reversed(head_file_path)
+            next(commit_lines, None)
+            return next(commit_lines, None)
         except Exception as e:
             print(f"Error reading file {head_file_path}: {e}")
             return None
 
-    def remove_last_line(self, HEAD_path):
+    def remove_last_line(self, HEAD_path, block_size=8192, journal=None):
+        # truncate after the newline that precedes the last non-empty line
         try:
-            with open(HEAD_path, 'r') as file:
-                lines = file.readlines()
-                if lines:
-                    lines = lines[:-1]
-            with open(HEAD_path, 'w') as file:
-                file.writelines(lines)
+            with open(HEAD_path, 'rb+') as file:
+                position = file.seek(0, os.SEEK_END)
+                seen_line = False
+                size = 0
+                while position > 0 and not size:
+                    read_size = min(block_size, position)
+                    position -= read_size
+                    file.seek(position)
+                    block = file.read(read_size)
+                    for idx in range(len(block) - 1, -1, -1):
+                        if block[idx] == ord('\n'):
+                            if seen_line:
+                                size = position + idx + 1
+                                break
+                        elif not chr(block[idx]).isspace():
+                            seen_line = True
+                if journal is None:
+                    file.truncate(size)
+            if journal is not None:
+                journal.truncate(HEAD_path, size)
         except Exception as e:
             print(f"Error removing last line from file {HEAD_path}: {e}")
 
-    def get_committed_files(self, commits_dir, last_commit, key):
+    def read_commit_bytes(self, commits_dir, commit_hash):
+        commit_file_path = os.path.join(commits_dir, commit_hash)
+        if not os.path.exists(commit_file_path) and self.packs:
+            commit_file_encoded_data = self.packs.read(
+                commit_hash, PackStore.KIND_COMMIT)
+            if commit_file_encoded_data is not None:
+                return commit_file_encoded_data
+
+        with open(commit_file_path, 'rb') as commit_file:
+            return commit_file.read()
+
+    def move_commit(self, commits_dir, dest_dir, commit_hash, journal=None):
+        commit_file_path = os.path.join(commits_dir, commit_hash)
+        if journal is not None:
+            # the copy gets a fresh mtime, which gc expires removed commits by
+            journal.write(os.path.join(dest_dir, commit_hash),
+                          self.read_commit_bytes(commits_dir, commit_hash))
+            if os.path.exists(commit_file_path):
+                journal.remove(commit_file_path)
+            return
+
+        if os.path.exists(commit_file_path):
+            shutil.move(commit_file_path, os.path.join(dest_dir, commit_hash))
+            # gc expires removed commits by the time they were removed
+            os.utime(os.path.join(dest_dir, commit_hash))
+            return
+
+        # packed commits are copied out, the pack keeps its copy until repacked
+        commit_file_encoded_data = self.read_commit_bytes(
+            commits_dir, commit_hash)
+        with open(os.path.join(dest_dir, commit_hash), 'wb') as commit_file:
+            commit_file.write(commit_file_encoded_data)
+
+    def read_commit(self, commits_dir, commit_hash):
+        commit_file_encoded_data = self.read_commit_bytes(
+            commits_dir, commit_hash)
+        commit_file_decoded_data = base64.b64decode(
+            commit_file_encoded_data).decode('utf-8')
+        return json.loads(commit_file_decoded_data)
+
+    def write_commit(self, commits_dir, commit_hash, commit_data):
+        commit_data_encoded = base64.b64encode(
+            json.dumps(commit_data).encode('utf-8'))
+        self.write_file_atomic(os.path.join(
+            commits_dir, commit_hash), commit_data_encoded)
+
+    def commit_meta(self, commit_hash, commit_data, parent=None):
+        return {
+            "op": "commit",
+            "hash": commit_hash,
+            "parent": parent,
+            "author": commit_data['author'],
+            "timestamp": commit_data['timestamp'],
+            "branch": commit_data['branch'],
+            "message": commit_data['message'],
+            "changed": len(commit_data['added']),
+        }
+
+    def append_commit_meta(self, meta_file, entries, journal=None):
         try:
-            commit_file_path = os.path.join(commits_dir, last_commit)
-            with open(commit_file_path, 'rb') as commit_file:
-                commit_file_encoded_data = commit_file.read()
-                commit_file_decoded_data = base64.b64decode(
-                    commit_file_encoded_data).decode('utf-8')
-                commit_file_decoded_data = json.loads(commit_file_decoded_data)
-                committed_files = commit_file_decoded_data[key]
+            data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+            if journal is not None:
+                journal.append(meta_file, data.encode('utf-8'))
+                return
+            with open(meta_file, 'a') as file:
+                file.write(data)
+        except Exception as e:
+            print(f"Error appending to {meta_file}: {e}")
+
+    def read_lines_reversed(self, file_path, block_size=8192):
+        # yields non-empty lines newest (last) first, reading blocks from the end
+        with open(file_path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            position = file.tell()
+            remainder = b''
+
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                file.seek(position)
+                lines = (file.read(read_size) + remainder).split(b'\n')
+                remainder = lines[0]
+                for line in reversed(lines[1:]):
+                    if line.strip():
+                        yield line.strip().decode('utf-8')
+
+            if remainder.strip():
+                yield remainder.strip().decode('utf-8')
+
+    def read_committed_files(self, commits_dir, last_commit, key):
+        commit_data = self.read_commit(commits_dir, last_commit)
+        if key == 'index' and 'tree' in commit_data:
+            # commits written with trees keep the index in the content
+            # dir next to the commits; older ones embed it whole
+            return self.commit_tree_files(os.path.join(
+                os.path.dirname(commits_dir), 'content'), commit_data['tree'])
+        return commit_data[key]
 
-                return committed_files
+    def get_committed_files(self, commits_dir, last_commit, key):
+        commit_file_path = os.path.join(commits_dir, last_commit)
+        try:
+            return self.read_committed_files(commits_dir, last_commit, key)
         except Exception as e:
-            print(f"Error reading committed files from {
-                  commit_file_path}: {e}")
-            return []
+            print(f"Error reading committed files from {commit_file_path}: {e}")
+            return {}
 
-    def get_tracked_files(self, branches_dir, branch, commits_dir):
+    def commit_tree_files(self, content_dir, tree_hash):
+        # the last index rebuilt is kept, most commands ask for HEAD's twice
+        if not self.index_cache or self.index_cache[0] != tree_hash:
+            self.index_cache = (
+                tree_hash, self.tree_files(content_dir, tree_hash))
+        return dict(self.index_cache[1])
+
+    def get_head_index(self, branches_dir, branch, commits_dir):
         HEAD_path = os.path.join(branches_dir, branch, 'HEAD')
         last_commit = self.get_last_commit(HEAD_path)
 
         if not last_commit:
-            return {}, {}
+            return {}
 
         committed_files = self.get_committed_files(
             commits_dir, last_commit, 'index')
-        # print(committed_files)
-
-        tracked_files_data = {}
-        try:
-            for root, dirs, files in os.walk(os.getcwd()):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
-                # print("dirs: ", dirs)
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    hash = self.compute_MD5_file(file_path)
-                    rel_path = os.path.relpath(file_path, os.getcwd())
-
-                    if rel_path in committed_files.keys() and committed_files[rel_path] == hash:
-                        tracked_files_data[rel_path] = hash
+        return committed_files if committed_files else {}
+
+    def update_worktree(self, target_files, content_dir):
+        # only paths whose content differs from the target are touched
+        scan = self.scan_worktree(target_files)
+        cwd = os.getcwd()
+        removed_dirs = set()
+
+        for rel_path in scan['new']:
+            try:
+                os.remove(os.path.join(cwd, rel_path))
+                removed_dirs.add(os.path.dirname(rel_path))
+                if self.stat_cache:
+                    self.stat_cache.forget(rel_path)
+            except Exception as e:
+                print(f"Error removing file {rel_path}: {e}")
+
+        # a directory emptied here may be where the target has a file
+        self.remove_empty_dirs(cwd, removed_dirs)
+
+        files = [(rel_path, target_files[rel_path])
+                 for rel_path in sorted(scan['modified'] + scan['deleted'])]
+        written = self.materialize_files(files, content_dir, cwd)
+
+        if self.stat_cache:
+            for rel_path in written:
+                self.stat_cache.record(os.path.join(
+                    cwd, rel_path), rel_path, target_files[rel_path])
+
+        return len(scan['new']), len(scan['modified']) + len(scan['deleted'])
+
+    def is_inside(self, base_dir, path):
+        # both real paths; paths on another drive are never inside
+        try:
+            return os.path.commonpath([base_dir, path]) == base_dir
+        except ValueError:
+            return False
+
+    def remove_empty_dirs(self, base_dir, dir_names):
+        # drop directories emptied by removals, deepest first
+        for dir_name in sorted(dir_names, key=len, reverse=True):
+            while dir_name:
+                dir_path = os.path.join(base_dir, dir_name)
+                if not os.path.isdir(dir_path) or os.listdir(dir_path):
+                    break
+                os.rmdir(dir_path)
+                dir_name = os.path.dirname(dir_name)
+
+    def diff_trees(self, old_files, new_files, paths=None):
+        # merge the two sorted path lists; equal hashes are skipped unread
+        def selected(path):
+            return not paths or any(path == prefix or path.startswith(prefix + os.sep) for prefix in paths)
+
+        old_paths = sorted(path for path in old_files if selected(path))
+        new_paths = sorted(path for path in new_files if selected(path))
+        i = j = 0
+        while i < len(old_paths) or j < len(new_paths):
+            if j == len(new_paths) or (i < len(old_paths) and old_paths[i] < new_paths[j]):
+                yield 'D', old_paths[i]
+                i += 1
+            elif i == len(old_paths) or new_paths[j] < old_paths[i]:
+                yield 'A', new_paths[j]
+                j += 1
+            else:
+                if old_files[old_paths[i]] != new_files[new_paths[j]]:
+                    yield 'M', old_paths[i]
+                i += 1
+                j += 1
+
+    def is_binary(self, data):
+        return b'\x00' in data[:8000]
+
+    def diff_lines(self, a, b):
+        # Myers O(ND) diff of the lines between a common prefix and suffix;
+        # returns (tag, i1, i2, j1, j2) opcodes like difflib
+        prefix = 0
+        while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+            suffix += 1
+        a_mid, b_mid = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+        n, m = len(a_mid), len(b_mid)
+
+        edits = None
+        if n and m and not set(a_mid).isdisjoint(b_mid):
+            v = {1: 0}
+            trace = []
+            for d in range(min(n + m, self.DIFF_MAX_EDITS) + 1):
+                trace.append(dict(v))
+                for k in range(-d, d + 1, 2):
+                    if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                        x = v[k + 1]
+                    else:
+                        x = v[k - 1] + 1
+                    y = x - k
+                    while x < n and y < m and a_mid[x] == b_mid[y]:
+                        x += 1
+                        y += 1
+                    v[k] = x
+                    if x >= n and y >= m:
+                        edits = self.backtrack_edits(trace, n, m)
+                        break
+                if edits is not None:
+                    break
+
+        # too many edits to be worth aligning: the middle is replaced whole
+        if edits is None:
+            edits = ['-'] * n + ['+'] * m
+
+        opcodes = [('equal', 0, prefix, 0, prefix)] if prefix else []
+        i = j = prefix
+        for edit in edits:
+            tag = {'=': 'equal', '-': 'delete', '+': 'insert'}[edit]
+            i2, j2 = i + (edit != '+'), j + (edit != '-')
+            if opcodes and opcodes[-1][0] == tag:
+                opcodes[-1] = (tag, opcodes[-1][1], i2, opcodes[-1][3], j2)
+            else:
+                opcodes.append((tag, i, i2, j, j2))
+            i, j = i2, j2
+        if suffix:
+            opcodes.append(('equal', i, len(a), j, len(b)))
+        return opcodes
+
+    def backtrack_edits(self, trace, x, y):
+        edits = []
+        for d in range(len(trace) - 1, -1, -1):
+            v = trace[d]
+            k = x - y
+            prev_k = k + 1 if k == -d or (k != d and v[k - 1] < v[k + 1]) else k - 1
+            prev_x = v[prev_k]
+            prev_y = prev_x - prev_k
+            while x > prev_x and y > prev_y:
+                edits.append('=')
+                x -= 1
+                y -= 1
+            if d > 0:
+                edits.append('+' if x == prev_x else '-')
+            x, y = prev_x, prev_y
+        edits.reverse()
+        return edits
+
+    def unified_diff(self, a, b, context=3):
+        # hunks of changes with their context lines, as unified diff lines.
+        # a and b keep their line endings, so a last line without one differs
+        # from the same line with one and is marked like diff does
+        def hunk_lines(prefix, lines):
+            for line in lines:
+                text = line.splitlines()[0]
+                yield prefix + text
+                if text == line:
+                    yield '\\ No newline at end of file'
+
+        opcodes = self.diff_lines(a, b)
+        changes = [idx for idx, opcode in enumerate(opcodes) if opcode[0] != 'equal']
+        idx = 0
+        while idx < len(changes):
+            first = last = changes[idx]
+            # changes at most two contexts apart share a hunk
+            while idx + 1 < len(changes) and opcodes[changes[idx + 1]][1] - opcodes[last][2] <= 2 * context:
+                idx += 1
+                last = changes[idx]
+            idx += 1
+
+            # opcodes around a change are equal runs, a and b align there
+            before = min(context, opcodes[first - 1][2] - opcodes[first - 1][1]) if first else 0
+            after = min(context, opcodes[last + 1][2] - opcodes[last + 1][1]) if last + 1 < len(opcodes) else 0
+            i1, j1 = opcodes[first][1] - before, opcodes[first][3] - before
+            i2, j2 = opcodes[last][2] + after, opcodes[last][4] + after
+            yield (f"@@ -{i1 + 1 if i2 > i1 else i1},{i2 - i1} "
+                   f"+{j1 + 1 if j2 > j1 else j1},{j2 - j1} @@")
+
+            yield from hunk_lines(' ', a[i1:opcodes[first][1]])
+            for tag, o_i1, o_i2, o_j1, o_j2 in opcodes[first:last + 1]:
+                if tag == 'equal':
+                    yield from hunk_lines(' ', a[o_i1:o_i2])
+                    continue
+                yield from hunk_lines('-', a[o_i1:o_i2])
+                yield from hunk_lines('+', b[o_j1:o_j2])
+            yield from hunk_lines(' ', a[opcodes[last][2]:i2])
+
+
+class IgnoreRules:
+    # gitignore-style rules: '#' comments, '!' negation, a trailing '/' for
+    # directories only, a '/' elsewhere anchors the pattern to the file's
+    # directory, '*', '?', '[...]' and '**'. Deeper files win over shallower
+    # ones and the last matching line of a file wins.
+    FILE_NAME = '.krupsignore'
+
+    def __init__(self, root, cache):
+        self.root = root
+        self.cache = cache
+        self.dirs = {}
+
+    @staticmethod
+    def translate(pattern):
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        regex = ''
+        idx = 0
+        while idx < len(pattern):
+            if pattern.startswith('**/', idx):
+                regex += '(?:.*/)?'
+                idx += 3
+            elif pattern.startswith('**', idx):
+                regex += '.*'
+                idx += 2
+            elif pattern[idx] == '*':
+                regex += '[^/]*'
+                idx += 1
+            elif pattern[idx] == '?':
+                regex += '[^/]'
+                idx += 1
+            elif pattern[idx] == '[' and pattern.find(']', idx + 2) != -1:
+                end = pattern.find(']', idx + 2)
+                chars = pattern[idx + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex += '[' + chars.replace('\\', '\\\\') + ']'
+                idx = end + 1
+            elif pattern[idx] == '\\' and idx + 1 < len(pattern):
+                regex += re.escape(pattern[idx + 1])
+                idx += 2
+            else:
+                regex += re.escape(pattern[idx])
+                idx += 1
+        return regex if anchored else '(?:.*/)?' + regex
+
+    @classmethod
+    def compile(cls, lines):
+        # one alternation per kind of path, rules in reverse so the first
+        # alternative that matches is the last matching line
+        rules = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate or line.startswith('\\#') or line.startswith('\\!'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if line:
+                rules.append((cls.translate(line), negate, dir_only))
+
+        compiled = {}
+        for is_dir in (True, False):
+            kind_rules = [rule for rule in reversed(rules) if is_dir or not rule[2]]
+            regex = re.compile('|'.join(f'({rule[0]})' for rule in kind_rules)) if kind_rules else None
+            compiled[is_dir] = (regex, [rule[1] for rule in kind_rules])
+        return compiled
+
+    def load(self, rel_dir):
+        file_path = os.path.join(self.root, rel_dir, self.FILE_NAME)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+
+        cached = self.cache.get(file_path)
+        if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+            return cached[1]
+        try:
+            with open(file_path, 'r') as file:
+                compiled = self.compile(file.readlines())
         except Exception as e:
-            print(f"Error getting tracked files: {e}")
-            return {}, {}
+            print(f"Error reading {file_path}: {e}")
+            return None
+        self.cache[file_path] = ((st.st_mtime_ns, st.st_size), compiled)
+        return compiled
+
+    def note_dir(self, rel_dir, has_ignore_file):
+        # walkers already know from the listing whether a directory has rules
+        self.dirs[rel_dir] = self.load(rel_dir) if has_ignore_file else None
+
+    def rules_for(self, rel_dir):
+        if rel_dir not in self.dirs:
+            self.dirs[rel_dir] = self.load(rel_dir)
+        return self.dirs[rel_dir]
+
+    def is_ignored(self, rel_path, is_dir):
+        # rel_path's parent directories are assumed not ignored
+        name = os.path.basename(rel_path)
+        if name in (HandleFile.IGNORED_DIRS if is_dir else HandleFile.IGNORED_FILES):
+            return True
 
-        all_committed_files = self.get_committed_files(
-            commits_dir, last_commit, 'index')
+        parts = rel_path.split(os.sep)
+        for depth in range(len(parts) - 1, -1, -1):
+            compiled = self.rules_for(os.sep.join(parts[:depth]))
+            if not compiled:
+                continue
+            regex, negations = compiled[is_dir]
+            match = regex.fullmatch('/'.join(parts[depth:])) if regex else None
+            if match:
+                return not negations[match.lastindex - 1]
+        return False
+
+    def walk(self, rel_dir='', on_dir=None, files=True):
+        # iterative os.scandir walk yielding (file_path, rel_path, DirEntry);
+        # DirEntry keeps its stat so the caller's stat is the only one.
+        # Symlinks to files are yielded, symlinked directories are never
+        # followed and dangling links are skipped.
+        stack = [rel_dir]
+        while stack:
+            rel_root = stack.pop()
+            dir_path = os.path.join(self.root, rel_root) if rel_root else self.root
+            try:
+                with os.scandir(dir_path) as scanner:
+                    dir_entries = list(scanner)
+            except OSError as e:
+                print(f"Error scanning directory {dir_path}: {e}")
+                continue
+
+            if on_dir and on_dir(rel_root, dir_path) is False:
+                return
+            self.note_dir(rel_root, any(
+                dir_entry.name == self.FILE_NAME for dir_entry in dir_entries))
+
+            prefix = rel_root + os.sep if rel_root else ''
+            subdirs = []
+            for dir_entry in dir_entries:
+                rel_path = prefix + dir_entry.name
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        if not self.is_ignored(rel_path, True):
+                            subdirs.append(rel_path)
+                        continue
+                    if not files or not dir_entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if not self.is_ignored(rel_path, False):
+                    yield dir_entry.path, rel_path, dir_entry
+
+            # top-down and in listing order, like os.walk
+            stack.extend(reversed(subdirs))
+
+    def is_ignored_path(self, rel_path, is_dir):
+        # like is_ignored, but also true inside an ignored directory
+        parts = os.path.normpath(rel_path).split(os.sep)
+        if parts == ['.']:
+            return False
+        for depth in range(1, len(parts)):
+            if self.is_ignored(os.sep.join(parts[:depth]), True):
+                return True
+        return self.is_ignored(os.sep.join(parts), is_dir)
+
+
+class PackSlice:
+    def __init__(self, pack_path, offset, length):
+        self.file = open(pack_path, 'rb')
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class PackStore:
+    # pack: header, then object files back to back, byte for byte.
+    # idx: header, then fixed-width entries sorted by (key, kind) where key
+    # is the binary object hash padded to 32 bytes.
+    PACK_MAGIC = b'KPACK\x00\x00\x01'
+    INDEX_MAGIC = b'KIDX\x00\x00\x00\x01'
+    ENTRY = struct.Struct('>32sBQQ')
+    KEY_SIZE = 33
+    KIND_CONTENT = 0
+    KIND_CONTENT_RAW = 1
+    KIND_COMMIT = 2
+    KIND_CONTENT_DELTA = 3
+    CONTENT_KINDS = (KIND_CONTENT, KIND_CONTENT_RAW, KIND_CONTENT_DELTA)
+
+    # delta: magic, base digest, then zlib-compressed copy/insert ops
+    DELTA_MAGIC = b'KDLT'
+    DELTA_COPY = 0
+    DELTA_INSERT = 1
+    DELTA_BLOCK = 16
+    DELTA_INDEX_LIMIT = 64 * 1024 * 1024
+    DELTA_CACHE_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.indexes = None
+        self.delta_cache = {}
+        self.delta_cache_size = 0
+
+    def load(self):
+        if self.indexes is not None:
+            return self.indexes
+
+        self.indexes = []
+        if not os.path.isdir(self.pack_dir):
+            return self.indexes
+
+        for index_name in sorted(os.listdir(self.pack_dir), reverse=True):
+            if not index_name.endswith('.idx'):
+                continue
+            index_path = os.path.join(self.pack_dir, index_name)
+            try:
+                with open(index_path, 'rb') as index_file:
+                    index = mmap.mmap(index_file.fileno(),
+                                      0, access=mmap.ACCESS_READ)
+                if index[:len(self.INDEX_MAGIC)] != self.INDEX_MAGIC:
+                    index.close()
+                    print(f"Error reading pack index {index_path}: bad header")
+                    continue
+                count = (len(index) - len(self.INDEX_MAGIC)) // self.ENTRY.size
+                self.indexes.append(
+                    (index_path[:-len('.idx')] + '.pack', index, count))
+            except Exception as e:
+                print(f"Error reading pack index {index_path}: {e}")
+
+        return self.indexes
+
+    def close(self):
+        for pack_path, index, count in self.indexes or []:
+            index.close()
+        self.indexes = None
+
+    def make_key(self, object_hash, kind):
+        try:
+            return bytes.fromhex(object_hash).ljust(32, b'\x00') + bytes([kind])
+        except ValueError:
+            return None
+
+    def entries(self, index, count):
+        for idx in range(count):
+            yield self.ENTRY.unpack_from(index, len(self.INDEX_MAGIC) + idx * self.ENTRY.size)
+
+    def find(self, object_hash, kind):
+        key = self.make_key(object_hash, kind)
+        if key is None:
+            return None
+
+        for pack_path, index, count in self.load():
+            low, high = 0, count
+            while low < high:
+                mid = (low + high) // 2
+                start = len(self.INDEX_MAGIC) + mid * self.ENTRY.size
+                entry_key = index[start:start + self.KEY_SIZE]
+                if entry_key < key:
+                    low = mid + 1
+                elif entry_key > key:
+                    high = mid
+                else:
+                    entry = self.ENTRY.unpack_from(index, start)
+                    return pack_path, entry[2], entry[3]
+
+        return None
+
+    def contains(self, object_hash, kind):
+        return self.find(object_hash, kind) is not None
+
+    def open_object(self, object_hash, kind):
+        location = self.find(object_hash, kind)
+        return PackSlice(*location) if location else None
+
+    def read(self, object_hash, kind):
+        object_file = self.open_object(object_hash, kind)
+        if not object_file:
+            return None
+        with object_file:
+            return object_file.read()
+
+    def stored_size(self, object_hash, kind):
+        location = self.find(object_hash, kind)
+        return location[2] if location else None
+
+    def cached_delta(self, object_hash):
+        data = self.delta_cache.pop(object_hash, None)
+        if data is not None:
+            self.delta_cache[object_hash] = data
+        return data
+
+    def cache_delta(self, object_hash, data):
+        if len(data) > self.DELTA_CACHE_SIZE or object_hash in self.delta_cache:
+            return
+        self.delta_cache[object_hash] = data
+        self.delta_cache_size += len(data)
+        # dicts keep insertion order, the first key is the least recently used
+        while self.delta_cache_size > self.DELTA_CACHE_SIZE:
+            oldest = next(iter(self.delta_cache))
+            self.delta_cache_size -= len(self.delta_cache.pop(oldest))
+
+    @staticmethod
+    def match_length(a, a_start, b, b_start, limit):
+        # compare in slices so long matches stay in C
+        length = 0
+        step = 65536
+        while length < limit:
+            size = min(step, limit - length)
+            if a[a_start + length:a_start + length + size] == b[b_start + length:b_start + length + size]:
+                length += size
+                continue
+            if size == 1:
+                break
+            step = max(1, size // 8)
+        return length
+
+    def make_delta(self, base_hash, base, target):
+        ops = bytearray()
+        base_view, target_view = memoryview(base), memoryview(target)
+
+        def copy(offset, length):
+            ops.extend(struct.pack('>BQQ', self.DELTA_COPY, offset, length))
+
+        def insert(data):
+            if data:
+                ops.extend(struct.pack('>BQ', self.DELTA_INSERT, len(data)))
+                ops.extend(data)
+
+        # appends and in-place edits mostly share a prefix and a suffix
+        prefix = self.match_length(base_view, 0, target_view, 0,
+                                   min(len(base), len(target)))
+        suffix = self.match_length(base_view[::-1], 0, target_view[::-1], 0,
+                                   min(len(base), len(target)) - prefix)
+
+        if prefix:
+            copy(0, prefix)
+
+        # index the middle of the base in fixed blocks, first offset wins
+        base_end, target_end = len(base) - suffix, len(target) - suffix
+        blocks = {}
+        if base_end - prefix <= self.DELTA_INDEX_LIMIT:
+            for offset in range(prefix, base_end - self.DELTA_BLOCK + 1, self.DELTA_BLOCK):
+                blocks.setdefault(bytes(base_view[offset:offset + self.DELTA_BLOCK]), offset)
+
+        pending = bytearray()
+        position = prefix
+        while position < target_end:
+            offset = None
+            if blocks and position + self.DELTA_BLOCK <= target_end:
+                offset = blocks.get(
+                    bytes(target_view[position:position + self.DELTA_BLOCK]))
+            if offset is None:
+                pending.append(target[position])
+                position += 1
+                continue
+            length = self.DELTA_BLOCK + self.match_length(
+                base_view, offset + self.DELTA_BLOCK, target_view, position + self.DELTA_BLOCK,
+                min(base_end - offset, target_end - position) - self.DELTA_BLOCK)
+            insert(pending)
+            pending = bytearray()
+            copy(offset, length)
+            position += length
+        insert(pending)
+
+        if suffix:
+            copy(len(base) - suffix, suffix)
+
+        digest = bytes.fromhex(base_hash)
+        return self.DELTA_MAGIC + bytes([len(digest)]) + digest + zlib.compress(bytes(ops))
+
+    def parse_delta(self, payload):
+        if not payload or not payload.startswith(self.DELTA_MAGIC):
+            raise ValueError("bad delta header")
+        digest_size = payload[len(self.DELTA_MAGIC)]
+        start = len(self.DELTA_MAGIC) + 1
+        base_hash = payload[start:start + digest_size].hex()
+        return base_hash, zlib.decompress(payload[start + digest_size:])
+
+    def apply_delta(self, base, delta):
+        data = bytearray()
+        position = 0
+        while position < len(delta):
+            if delta[position] == self.DELTA_COPY:
+                op, offset, length = struct.unpack_from('>BQQ', delta, position)
+                data.extend(base[offset:offset + length])
+                position += 17
+            else:
+                op, length = struct.unpack_from('>BQ', delta, position)
+                position += 9
+                data.extend(delta[position:position + length])
+                position += length
+        return bytes(data)
+
+    def iter_packed(self):
+        for pack_path, index, count in self.load():
+            for key, kind, offset, length in self.entries(index, count):
+                yield key, kind, pack_path, offset, length
+
+    def write_pack(self, loose_objects, name_hash, replacements=None, keep=None):
+        # loose_objects: (object_hash, kind, path); existing packs are merged in
+        # unless keep(key, kind) rejects an entry.
+        # replacements: object_hash -> (kind, bytes) stored instead of any copy
+        sources = {}
+        for key, kind, pack_path, offset, length in self.iter_packed():
+            if keep is None or keep(key, kind):
+                sources.setdefault(key + bytes([kind]),
+                                   (pack_path, offset, length))
+        for object_hash, kind, path in loose_objects:
+            key = self.make_key(object_hash, kind)
+            if key is not None:
+                sources[key] = (path, 0, os.path.getsize(path))
+        for object_hash, (kind, data) in (replacements or {}).items():
+            for content_kind in self.CONTENT_KINDS:
+                sources.pop(self.make_key(object_hash, content_kind), None)
+            sources[self.make_key(object_hash, kind)] = data
+
+        os.makedirs(self.pack_dir, exist_ok=True)
+        keys = sorted(sources)
+        for key in keys:
+            name_hash.update(key)
+        pack_name = 'pack-' + name_hash.hexdigest()
+        pack_path = os.path.join(self.pack_dir, pack_name + '.pack')
+        index_path = os.path.join(self.pack_dir, pack_name + '.idx')
+
+        with open(pack_path + '.tmp', 'wb') as pack_file, open(index_path + '.tmp', 'wb') as index_file:
+            pack_file.write(self.PACK_MAGIC)
+            index_file.write(self.INDEX_MAGIC)
+            for key in keys:
+                pack_offset = pack_file.tell()
+                if isinstance(sources[key], bytes):
+                    pack_file.write(sources[key])
+                    length = len(sources[key])
+                    index_file.write(self.ENTRY.pack(
+                        key[:32], key[32], pack_offset, length))
+                    continue
+                source_path, offset, length = sources[key]
+                with PackSlice(source_path, offset, length) as source:
+                    shutil.copyfileobj(source, pack_file, 1024 * 1024)
+                index_file.write(self.ENTRY.pack(
+                    key[:32], key[32], pack_offset, length))
+
+        # the index is renamed last, a pack without one is never read
+        old_packs = [pack for pack, index, count in self.load()]
+        self.close()
+        os.replace(pack_path + '.tmp', pack_path)
+        os.replace(index_path + '.tmp', index_path)
+
+        for old_pack in old_packs:
+            if old_pack != pack_path:
+                os.remove(old_pack[:-len('.pack')] + '.idx')
+                os.remove(old_pack)
+
+        return pack_name, len(keys)
+
+    def unpack(self, digest_size, content_dir, commits_dir, raw_suffix, read_delta):
+        # write every packed object back as a loose file and drop the packs
+        packs = [pack for pack, index, count in self.load()]
+        count = 0
+        for key, kind, pack_path, offset, length in self.iter_packed():
+            object_hash = key[:digest_size].hex()
+            if kind == self.KIND_COMMIT:
+                object_path = os.path.join(commits_dir, object_hash)
+            elif kind in (self.KIND_CONTENT_RAW, self.KIND_CONTENT_DELTA):
+                object_path = os.path.join(content_dir, object_hash + raw_suffix)
+            else:
+                object_path = os.path.join(content_dir, object_hash)
+            if os.path.exists(object_path):
+                continue
+            if kind == self.KIND_CONTENT_DELTA:
+                with open(object_path, 'wb') as object_file:
+                    object_file.write(read_delta(object_hash))
+                os.chmod(object_path, HandleFile.RAW_MODE)
+                count += 1
+                continue
+            with PackSlice(pack_path, offset, length) as source, open(object_path, 'wb') as object_file:
+                shutil.copyfileobj(source, object_file, 1024 * 1024)
+            if object_path.endswith(raw_suffix):
+                os.chmod(object_path, HandleFile.RAW_MODE)
+            count += 1
+
+        self.close()
+        for pack_path in packs:
+            os.remove(pack_path[:-len('.pack')] + '.idx')
+            os.remove(pack_path)
+        return count
+
+
+class CommitIndexReader:
+    def __init__(self, file_handler, meta_file):
+        self.lines = file_handler.read_lines_reversed(
+            meta_file) if os.path.exists(meta_file) else iter(())
+        self.commits = {}
+        self.removed = []
+        self.exhausted = False
+
+    def read_next(self):
+        line = next(self.lines, None)
+        if line is None:
+            self.exhausted = True
+            return
+
+        entry = json.loads(line)
+        if entry['op'] == 'rmcommit':
+            self.removed.append(entry['hash'])
+        else:
+            self.commits.setdefault(entry['hash'], entry)
+
+    def get(self, commit_hash):
+        # recent commits sit at the end of the index, so lookups stop early
+        while commit_hash not in self.commits and not self.exhausted:
+            self.read_next()
+        return self.commits.get(commit_hash)
+
+    def removed_commits(self):
+        while not self.exhausted:
+            self.read_next()
+        return list(dict.fromkeys(self.removed))
+
+
+class IndexFile(Mapping):
+    # a read-only {path: content hash} map over a binary index file:
+    #   header       magic, version, digest size, entry count, directory count
+    #   directories  fixed-width records sorted by path: the directory path
+    #                (offset, length), its file names joined by NUL (offset,
+    #                length) and the number of the directory's first entry
+    #   digests      one raw digest per entry, by directory then by name
+    #   strings      the directory paths and name lists the records point at
+    #   trailer      crc32 of everything before it
+    # A path is stored as its directory, once, plus its name. Lookups binary
+    # search the directories and decode only the one holding the path.
+    MAGIC = b'KINX'
+    VERSION = 1
+    HEADER = struct.Struct('>4sBBII')
+    DIRECTORY = struct.Struct('>QIQII')
+    TRAILER = struct.Struct('>I')
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.data = b''
+        self.digest_size = 0
+        self.count = 0
+        self.directory_count = 0
+        self.digests_offset = 0
+        self.signature = None
+        if index_path:
+            self.load()
+
+    def load(self):
+        with open(self.index_path, 'rb') as index_file:
+            st = os.fstat(index_file.fileno())
+            self.signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if st.st_size < self.HEADER.size + self.TRAILER.size:
+                raise ValueError(f"{self.index_path} is truncated")
+            # a mapped file cannot be replaced on Windows, read it there
+            data = index_file.read() if os.name == 'nt' else mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.digest_size, self.count, self.directory_count = \
+            self.HEADER.unpack_from(data, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{self.index_path} is not an index file")
+        if version != self.VERSION:
+            raise ValueError(f"unsupported index version {version}")
+        checksum, = self.TRAILER.unpack_from(data, len(data) - self.TRAILER.size)
+        if zlib.crc32(memoryview(data)[:len(data) - self.TRAILER.size]) != checksum:
+            raise ValueError(f"{self.index_path} is corrupt (checksum mismatch)")
+
+        self.digests_offset = self.HEADER.size + \
+            self.directory_count * self.DIRECTORY.size
+        self.data = data
+
+    @staticmethod
+    def encode_path(path):
+        return path.encode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def decode_path(path):
+        return path.decode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def split_path(path):
+        # (directory with its trailing separator, name), encoded
+        directory, sep, name = path.rpartition(os.sep)
+        return IndexFile.encode_path(directory + sep), IndexFile.encode_path(name)
+
+    def decode_hash(self, digest):
+        # an all-zero digest stands for a file that could not be hashed
+        return digest.hex() if digest.strip(b'\x00') else None
+
+    def directory(self, number):
+        # (directory path, NUL-joined names, first entry), still encoded
+        path_offset, path_length, names_offset, names_length, first = self.DIRECTORY.unpack_from(
+            self.data, self.HEADER.size + number * self.DIRECTORY.size)
+        return (self.data[path_offset:path_offset + path_length],
+                self.data[names_offset:names_offset + names_length], first)
+
+    def find(self, path):
+        directory_path, name = self.split_path(path)
+        low, high = 0, self.directory_count
+        while low < high:
+            middle = (low + high) // 2
+            path_offset, path_length = self.DIRECTORY.unpack_from(
+                self.data, self.HEADER.size + middle * self.DIRECTORY.size)[:2]
+            if self.data[path_offset:path_offset + path_length] < directory_path:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.directory_count:
+            return None
+
+        found_path, names, first = self.directory(low)
+        if found_path != directory_path:
+            return None
+        names = names.split(b'\x00')
+        position = bisect.bisect_left(names, name)
+        if position == len(names) or names[position] != name:
+            return None
+        offset = self.digests_offset + (first + position) * self.digest_size
+        return self.data[offset:offset + self.digest_size]
+
+    def iter_blocks(self):
+        # (directory path, NUL-joined names, their digests), all raw
+        for number in range(self.directory_count):
+            directory_path, names, first = self.directory(number)
+            last = self.directory(number + 1)[2] if number + 1 < self.directory_count else self.count
+            yield directory_path, names, self.data[self.digests_offset + first * self.digest_size:
+                                                   self.digests_offset + last * self.digest_size]
+
+    def __getitem__(self, path):
+        digest = self.find(path) if isinstance(path, str) else None
+        if digest is None:
+            raise KeyError(path)
+        return self.decode_hash(digest)
+
+    def __contains__(self, path):
+        return isinstance(path, str) and self.find(path) is not None
+
+    def __iter__(self):
+        for directory_path, names, digests in self.iter_blocks():
+            prefix = self.decode_path(directory_path)
+            for name in self.decode_path(names).split('\x00'):
+                yield prefix + name
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        # one hex conversion for the whole digest table
+        width = 2 * self.digest_size
+        digests = self.data[self.digests_offset:self.digests_offset + self.count * self.digest_size].hex()
+        empty = '0' * width
+        return [file_hash if file_hash != empty else None for file_hash in
+                (digests[offset:offset + width] for offset in range(0, len(digests), width))]
+
+    def items(self):
+        return list(zip(self, self.values()))
+
+    @classmethod
+    def encode(cls, blocks, digest_size):
+        # blocks are (directory path, NUL-joined names, digests) sorted by
+        # directory path, names sorted within each; all encoded
+        blocks = [block for block in blocks if block[1] or block[2]]
+        directories = bytearray()
+        digests = bytearray()
+        strings = bytearray()
+        strings_offset = cls.HEADER.size + len(blocks) * cls.DIRECTORY.size + \
+            sum(len(block[2]) for block in blocks)
+        count = 0
+        for directory_path, names, block_digests in blocks:
+            path_offset = strings_offset + len(strings)
+            strings += directory_path
+            names_offset = strings_offset + len(strings)
+            strings += names
+            directories += cls.DIRECTORY.pack(
+                path_offset, len(directory_path), names_offset, len(names), count)
+            digests += block_digests
+            count += len(block_digests) // digest_size
+
+        data = bytearray(cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, digest_size, count, len(blocks)))
+        data += directories
+        data += digests
+        data += strings
+        data += cls.TRAILER.pack(zlib.crc32(data))
+        return data
+
+
+class StagingTransaction:
+    def __init__(self, file_handler, added_file, index_file):
+        self.file_handler = file_handler
+        self.added_file = added_file
+        self.index_file = index_file
+        # per file: the index read at the start, paths set, paths removed
+        self.bases = {}
+        self.updates = {added_file: {}, index_file: {}}
+        self.removals = {added_file: set(), index_file: set()}
+        self.changed = False
+
+    def __enter__(self):
+        for index_file in (self.added_file, self.index_file):
+            self.bases[index_file] = self.file_handler.read_index(index_file)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # nothing is written if the batch failed half way
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def add(self, file_path_relative, file_path_hash):
+        for index_file in (self.added_file, self.index_file):
+            self.updates[index_file][file_path_relative] = file_path_hash
+            self.removals[index_file].discard(file_path_relative)
+        self.changed = True
+
+    def remove(self, file_path_relative):
+        for index_file in (self.added_file, self.index_file):
+            updates = self.updates[index_file]
+            if file_path_relative in updates:
+                updates.pop(file_path_relative)
+                self.changed = True
+            if file_path_relative in self.bases[index_file] and \
+                    file_path_relative not in self.removals[index_file]:
+                self.removals[index_file].add(file_path_relative)
+                self.changed = True
+
+    def commit(self):
+        if not self.changed:
+            return
 
-        return tracked_files_data, all_committed_files
+        # both staging files change together or not at all
+        with self.file_handler.journal() as journal:
+            for index_file in (self.added_file, self.index_file):
+                self.file_handler.update_index(
+                    index_file, self.bases[index_file], self.updates[index_file],
+                    self.removals[index_file], journal)
+        self.changed = False
+
+
+class Journal:
+    # the metadata writes of one command, made durable as a group: they are
+    # logged, the log is flushed once, the writes are applied, flushed once
+    # more, and the log removed. A log left by a crash is replayed at the
+    # next start if complete, or dropped, so either every write of the
+    # command lands or none does. Each operation can safely be replayed.
+    #   header   magic, version, record count
+    #   records  operation, offset or size, path length, data length,
+    #            then the path and the data
+    #   trailer  crc32 of everything before it
+    MAGIC = b'KJNL'
+    VERSION = 1
+    HEADER = struct.Struct('>4sBI')
+    RECORD = struct.Struct('>BQHI')
+    TRAILER = struct.Struct('>I')
+    OP_WRITE = 0
+    OP_APPEND = 1
+    OP_TRUNCATE = 2
+    OP_REMOVE = 3
+
+    def __init__(self, file_handler, journal_file):
+        self.file_handler = file_handler
+        self.journal_file = journal_file
+        self.operations = []
+        # sizes files will have once the logged operations are applied
+        self.sizes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # nothing is applied if the command failed half way
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def size(self, path):
+        if path not in self.sizes:
+            self.sizes[path] = os.path.getsize(
+                path) if os.path.exists(path) else 0
+        return self.sizes[path]
+
+    def write(self, path, data):
+        self.operations.append((self.OP_WRITE, 0, path, bytes(data)))
+        self.sizes[path] = len(data)
+
+    def append(self, path, data):
+        # logged with the offset it lands at, so a replay rewrites it there
+        offset = self.size(path)
+        self.operations.append((self.OP_APPEND, offset, path, data))
+        self.sizes[path] = offset + len(data)
+
+    def truncate(self, path, size):
+        self.operations.append((self.OP_TRUNCATE, size, path, b''))
+        self.sizes[path] = size
+
+    def remove(self, path):
+        self.operations.append((self.OP_REMOVE, 0, path, b''))
+        self.sizes[path] = 0
+
+    def encode(self):
+        data = bytearray(self.HEADER.pack(
+            self.MAGIC, self.VERSION, len(self.operations)))
+        for operation, offset, path, payload in self.operations:
+            path = os.fsencode(path)
+            data += self.RECORD.pack(operation, offset, len(path), len(payload))
+            data += path
+            data += payload
+        data += self.TRAILER.pack(zlib.crc32(data))
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data):
+        # the logged operations, None for a log that was never completed
+        if len(data) < cls.HEADER.size + cls.TRAILER.size:
+            return None
+        checksum, = cls.TRAILER.unpack_from(data, len(data) - cls.TRAILER.size)
+        if zlib.crc32(data[:len(data) - cls.TRAILER.size]) != checksum:
+            return None
+        magic, version, count = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+
+        operations = []
+        offset = cls.HEADER.size
+        for _ in range(count):
+            operation, position, path_length, data_length = cls.RECORD.unpack_from(
+                data, offset)
+            offset += cls.RECORD.size
+            path = os.fsdecode(data[offset:offset + path_length])
+            offset += path_length
+            operations.append(
+                (operation, position, path, data[offset:offset + data_length]))
+            offset += data_length
+        return operations
+
+    @classmethod
+    def apply(cls, operations):
+        for operation, offset, path, data in operations:
+            if operation != cls.OP_REMOVE and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            if operation == cls.OP_WRITE:
+                temp_path = path + '.tmp'
+                with open(temp_path, 'wb') as file:
+                    file.write(data)
+                os.replace(temp_path, path)
+            elif operation in (cls.OP_APPEND, cls.OP_TRUNCATE):
+                with open(path, 'r+b' if os.path.exists(path) else 'wb') as file:
+                    file.truncate(offset)
+                    file.seek(offset)
+                    file.write(data)
+            elif operation == cls.OP_REMOVE and os.path.exists(path):
+                os.remove(path)
+
+    def commit(self):
+        if not self.operations:
+            return
+
+        paths = list(dict.fromkeys(path for operation, offset, path, data in self.operations))
+        with open(self.journal_file, 'wb') as journal_file:
+            journal_file.write(self.encode())
+            journal_file.flush()
+            # the log, and every object written before it, is on disk
+            self.file_handler.flush_to_disk(journal_file.fileno())
+            self.apply(self.operations)
+            self.file_handler.flush_to_disk(journal_file.fileno(), paths)
+        os.remove(self.journal_file)
+        self.operations = []
+        self.sizes = {}
+
+    def recover(self):
+        # True if an interrupted command was finished from its log
+        if not os.path.exists(self.journal_file):
+            return False
+
+        with open(self.journal_file, 'rb') as journal_file:
+            operations = self.decode(journal_file.read())
+
+        if operations:
+            try:
+                self.apply(operations)
+            except Exception:
+                # it would fail the same way at every start, so it is moved
+                # aside for inspection and reported once
+                os.replace(self.journal_file, self.failed_file())
+                raise
+            with open(self.journal_file, 'rb') as journal_file:
+                self.file_handler.flush_to_disk(journal_file.fileno(), list(dict.fromkeys(
+                    path for operation, offset, path, data in operations)))
+        os.remove(self.journal_file)
+        return bool(operations)
+
+    def failed_file(self):
+        return self.journal_file + '.failed'
+
+
+class StatCache:
+    # stat data and content hash of every file hashed before, so unchanged
+    # files are not read again. The cache file is binary and mapped, laid
+    # out by directory like the index (see IndexFile):
+    #   header       magic, version, digest size, entry count, directory count
+    #   directories  the directory path, its NUL-joined file names and the
+    #                number of its first entry, sorted by path
+    #   entries      size, mtime, inode and ctime of each file
+    #   digests      one raw digest per entry
+    #   strings      the directory paths and name lists
+    #   trailer      crc32 of everything before it
+    # A lookup decodes only its directory's names, and the last directory is
+    # kept since a scan looks up a whole directory at a time.
+    MAGIC = b'KSTC'
+    VERSION = 1
+    HEADER = struct.Struct('>4sBBII')
+    DIRECTORY = IndexFile.DIRECTORY
+    ENTRY = struct.Struct('>QqQq')
+    TRAILER = struct.Struct('>I')
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.unload()
+
+    def unload(self):
+        # drop the mapped file and pending changes, the next use reloads
+        self.data = None
+        self.digest_size = 0
+        self.count = 0
+        self.directory_count = 0
+        self.block = (None, {})
+        self.cache_mtime_ns = 0
+        self.updates = {}
+        self.removed = set()
+        self.seen = set()
+        self.dirty = False
+
+    def load(self):
+        self.unload()
+        self.data = b''
+
+        if not os.path.exists(self.cache_file):
+            # the JSON cache of older versions is dropped, not converted
+            self.dirty = os.path.exists(self.cache_file + '.json')
+            return
 
-    def clear_current_dir(self, dir_path):
         try:
-            for root, dirs, files in os.walk(dir_path):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
+            with open(self.cache_file, 'rb') as cache_file:
+                st = os.fstat(cache_file.fileno())
+                if st.st_size < self.HEADER.size + self.TRAILER.size:
+                    raise ValueError("file is truncated")
+                # a mapped file cannot be replaced on Windows, read it there
+                data = cache_file.read() if os.name == 'nt' else mmap.mmap(
+                    cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, digest_size, count, directory_count = self.HEADER.unpack_from(data, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError("not a stat cache of this version")
+            checksum, = self.TRAILER.unpack_from(data, len(data) - self.TRAILER.size)
+            if zlib.crc32(memoryview(data)[:len(data) - self.TRAILER.size]) != checksum:
+                raise ValueError("checksum mismatch")
+
+            self.data, self.digest_size, self.count = data, digest_size, count
+            self.directory_count = directory_count
+            self.cache_mtime_ns = st.st_mtime_ns
+        except Exception as e:
+            print(f"Error reading stat cache {self.cache_file}: {e}")
+
+    def directory(self, number):
+        # (directory path, NUL-joined names, first entry), still encoded
+        path_offset, path_length, names_offset, names_length, first = self.DIRECTORY.unpack_from(
+            self.data, self.HEADER.size + number * self.DIRECTORY.size)
+        return (self.data[path_offset:path_offset + path_length],
+                self.data[names_offset:names_offset + names_length], first)
+
+    def directory_block(self, directory_path):
+        # {name: entry number} of one directory, the last one is kept
+        if self.block[0] == directory_path:
+            return self.block[1]
+
+        low, high = 0, self.directory_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.directory(middle)[0] < directory_path:
+                low = middle + 1
+            else:
+                high = middle
+        names = {}
+        if low < self.directory_count:
+            found_path, found_names, first = self.directory(low)
+            if found_path == directory_path:
+                names = {name: first + position
+                         for position, name in enumerate(found_names.split(b'\x00'))}
+        self.block = (directory_path, names)
+        return names
+
+    def entry(self, number):
+        # [size, mtime, inode, ctime, hash]
+        entries_offset = self.HEADER.size + self.directory_count * self.DIRECTORY.size
+        digest_offset = entries_offset + self.count * self.ENTRY.size + number * self.digest_size
+        return list(self.ENTRY.unpack_from(self.data, entries_offset + number * self.ENTRY.size)) + \
+            [self.data[digest_offset:digest_offset + self.digest_size].hex()]
+
+    def find(self, rel_path):
+        directory_path, name = IndexFile.split_path(rel_path)
+        number = self.directory_block(directory_path).get(name)
+        return None if number is None else self.entry(number)
+
+    def iter_paths(self):
+        # (path, entry number) of every mapped entry, in file order
+        for number in range(self.directory_count):
+            directory_path, names, first = self.directory(number)
+            prefix = IndexFile.decode_path(directory_path)
+            for position, name in enumerate(IndexFile.decode_path(names).split('\x00')):
+                yield prefix + name, first + position
+
+    def get(self, rel_path):
+        if rel_path in self.updates:
+            return self.updates[rel_path]
+        if rel_path in self.removed:
+            return None
+        entry = self.find(rel_path)
+        if entry:
+            self.seen.add(rel_path)
+        return entry
 
-                for file in files:
-                    file_path_full = os.path.normpath(
-                        os.path.join(root, file))
-                    os.remove(file_path_full)
+    def lookup(self, file_path, rel_path, dir_entry=None):
+        if self.data is None:
+            self.load()
 
-            for root, dirs, files in os.walk(dir_path):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
+        # a walked DirEntry already holds the stat, symlinks are followed
+        # because the hash is of the target's content
+        try:
+            st = dir_entry.stat() if dir_entry else os.stat(file_path)
+        except FileNotFoundError as e:
+            self.forget(rel_path)
+            print(f"Error reading file {file_path}: {e}")
+            return None, None
+        except Exception as e:
+            print(f"Error reading file {file_path}: {e}")
+            return None, None
+
+        stat_data = [st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns]
+        entry = self.get(rel_path)
+
+        # a file modified in the same tick the cache was written may change
+        # again without its stat data changing, so it is hashed again (racy)
+        if entry and entry[:4] == stat_data and st.st_mtime_ns < self.cache_mtime_ns:
+            return entry[4], stat_data
+
+        return None, stat_data
+
+    def store(self, rel_path, stat_data, file_hash):
+        if file_hash is not None:
+            self.updates[rel_path] = stat_data + [file_hash]
+            self.removed.discard(rel_path)
+            self.dirty = True
+
+    def record(self, file_path, rel_path, file_hash):
+        if self.data is None:
+            self.load()
+
+        st = os.stat(file_path)
+        self.store(rel_path, [st.st_size, st.st_mtime_ns,
+                   st.st_ino, st.st_ctime_ns], file_hash)
+
+    def forget(self, rel_path):
+        if self.data is None:
+            self.load()
+
+        if self.get(rel_path) is not None:
+            self.updates.pop(rel_path, None)
+            self.removed.add(rel_path)
+            self.dirty = True
+
+    def prune(self, live_paths):
+        # after a full scan: entries of paths that are gone or now ignored
+        # are dropped. Every live path was looked up, so when each cached
+        # entry was hit there is nothing to drop and nothing is decoded.
+        if self.data is None or len(self.seen) == self.count:
+            return
+
+        for rel_path, number in self.iter_paths():
+            if rel_path not in live_paths and rel_path not in self.updates:
+                self.removed.add(rel_path)
+                self.dirty = True
+
+    def clear(self):
+        # every cached hash is stale (the hash algorithm changed)
+        self.unload()
+        self.data = b''
+        self.dirty = True
+
+    def get_hash(self, file_path, rel_path, compute_hash):
+        file_hash, stat_data = self.lookup(file_path, rel_path)
+        if file_hash is not None or stat_data is None:
+            return file_hash
+
+        file_hash = compute_hash(file_path)
+        self.store(rel_path, stat_data, file_hash)
+        return file_hash
+
+    def entries(self):
+        # every entry, the mapped ones merged with pending changes
+        entries = {}
+        for rel_path, number in self.iter_paths():
+            if rel_path not in self.removed:
+                entries[rel_path] = self.entry(number)
+        entries.update(self.updates)
+        return entries
+
+    @classmethod
+    def encode(cls, entries):
+        digest_size = len(next(iter(entries.values()))[4]) // 2 if entries else 0
+        # digests of another length are from before a migration
+        records = sorted(IndexFile.split_path(rel_path) + (entry,) for rel_path, entry in entries.items()
+                         if len(entry[4]) == 2 * digest_size)
+        blocks = []
+        for directory_path, name, entry in records:
+            if not blocks or blocks[-1][0] != directory_path:
+                blocks.append((directory_path, []))
+            blocks[-1][1].append(name)
+
+        strings_offset = cls.HEADER.size + len(blocks) * cls.DIRECTORY.size + \
+            len(records) * (cls.ENTRY.size + digest_size)
+        data = bytearray(cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, digest_size, len(records), len(blocks)))
+        strings = bytearray()
+        first = 0
+        for directory_path, names in blocks:
+            names = b'\x00'.join(names)
+            path_offset = strings_offset + len(strings)
+            strings += directory_path
+            names_offset = strings_offset + len(strings)
+            strings += names
+            data += cls.DIRECTORY.pack(
+                path_offset, len(directory_path), names_offset, len(names), first)
+            first += names.count(b'\x00') + 1
+        for directory_path, name, entry in records:
+            data += cls.ENTRY.pack(*entry[:4])
+        for directory_path, name, entry in records:
+            data += bytes.fromhex(entry[4])
+        data += strings
+        data += cls.TRAILER.pack(zlib.crc32(data))
+        return data
+
+    def save(self):
+        if not self.dirty or not os.path.isdir(os.path.dirname(self.cache_file)):
+            return
 
-                for dir in dirs:
-                    dir_path_full = os.path.normpath(
-                        os.path.join(root, dir))
-                    shutil.rmtree(dir_path_full)
+        try:
+            data = self.encode(self.entries())
+            temp_file = self.cache_file + '.tmp'
+            with open(temp_file, 'wb') as file:
+                file.write(data)
+            os.replace(temp_file, self.cache_file)
+            if os.path.exists(self.cache_file + '.json'):
+                os.remove(self.cache_file + '.json')
         except Exception as e:
-            print(f"Error removing file(s) or directory: {e}")
+            print(f"Error writing stat cache {self.cache_file}: {e}")
+
+        # reload on next use so the racy check compares against this write
+        self.unload()
+
+
+class InotifyWatcher:
+    # inotify through libc, Linux only; raises OSError where unavailable
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, root, rules):
+        self.root = root
+        self.rules = rules
+        self.watches = {}
+        self.overflow = False
+
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+    def watch_tree(self, rel_dir):
+        # watch a directory and everything below it
+        if rel_dir and self.rules.is_ignored_path(rel_dir, True):
+            return
+
+        def add_watch(rel_root, dir_path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.WATCH_MASK)
+            if wd < 0:
+                # out of watches: nothing here can be trusted any more
+                self.overflow = True
+                return False
+            self.watches[wd] = rel_root
+
+        for entry in self.rules.walk(rel_dir, on_dir=add_watch, files=False):
+            pass
+
+    def unwatch_tree(self, rel_dir):
+        # a directory moved away would keep reporting under its old path
+        prefix = rel_dir + os.sep
+        for wd, rel_root in list(self.watches.items()):
+            if rel_root == rel_dir or rel_root.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read_events(self):
+        # returns the changed file paths and changed directory paths
+        changed_files, changed_dirs = set(), set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            position = 0
+            while position < len(data):
+                wd, mask, cookie, name_size = self.EVENT.unpack_from(data, position)
+                position += self.EVENT.size
+                name = os.fsdecode(data[position:position + name_size].rstrip(b'\x00'))
+                position += name_size
+
+                if mask & self.IN_Q_OVERFLOW:
+                    self.overflow = True
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+
+                rel_path = os.path.join(self.watches[wd], name)
+                if name == IgnoreRules.FILE_NAME:
+                    # the rules changed, what is watched and listed may too
+                    self.overflow = True
+                    continue
+                if mask & self.IN_ISDIR:
+                    if self.rules.is_ignored(rel_path, True):
+                        continue
+                    changed_dirs.add(rel_path)
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        self.watch_tree(rel_path)
+                    elif mask & self.IN_MOVED_FROM:
+                        self.unwatch_tree(rel_path)
+                else:
+                    changed_files.add(rel_path)
+
+        return changed_files, changed_dirs
+
+
+class StatusDaemon:
+    # answers one JSON line per connection on a Unix socket in .krups
+    def __init__(self, socket_path, file_handler):
+        self.socket_path = socket_path
+        self.file_handler = file_handler
+        self.root = os.getcwd()
+        self.files = {}
+        self.watcher = None
+        self.rules = None
+        self.pending_files = set()
+        self.pending_dirs = set()
+
+    def drain(self):
+        # keep the kernel queue short, hashing waits for a query
+        changed_files, changed_dirs = self.watcher.read_events()
+        self.pending_files.update(changed_files)
+        self.pending_dirs.update(changed_dirs)
+
+    def full_scan(self):
+        if self.watcher:
+            self.watcher.close()
+        # watches go in before the walk so no change falls between the two
+        self.rules = self.file_handler.ignore_rules(self.root)
+        self.watcher = InotifyWatcher(self.root, self.rules)
+        self.watcher.watch_tree('')
+        self.pending_files, self.pending_dirs = set(), set()
+        entries = self.file_handler.walk_worktree(root=self.root, rules=self.rules)
+        hashes = self.file_handler.compute_MD5_files_cached(entries)
+        self.files = {rel_path: hash for (file_path, rel_path, dir_entry),
+                      hash in zip(entries, hashes) if hash is not None}
+
+    def refresh(self):
+        self.drain()
+        if self.watcher.overflow:
+            self.full_scan()
             return
 
+        changed_files, changed_dirs = self.pending_files, self.pending_dirs
+        self.pending_files, self.pending_dirs = set(), set()
+
+        for rel_dir in changed_dirs:
+            prefix = rel_dir + os.sep
+            for rel_path in [rel_path for rel_path in self.files if rel_path.startswith(prefix)]:
+                del self.files[rel_path]
+
+        entries = []
+        for rel_dir in changed_dirs:
+            if os.path.isdir(os.path.join(self.root, rel_dir)):
+                entries.extend(self.file_handler.walk_worktree(
+                    os.path.join(self.root, rel_dir), self.root, self.rules))
+        for rel_path in changed_files:
+            self.files.pop(rel_path, None)
+            file_path = os.path.join(self.root, rel_path)
+            if not self.rules.is_ignored(rel_path, False) and os.path.isfile(file_path):
+                entries.append((file_path, rel_path, None))
+
+        for (file_path, rel_path, dir_entry), hash in zip(entries, self.file_handler.compute_MD5_files(
+                [file_path for file_path, rel_path, dir_entry in entries])):
+            if hash is not None:
+                self.files[rel_path] = hash
+
+    def handle(self, connection):
+        with connection:
+            request = b''
+            while not request.endswith(b'\n'):
+                data = connection.recv(65536)
+                if not data:
+                    return True
+                request += data
+            request = json.loads(request)
+
+            if request.get('op') == 'stop':
+                connection.sendall(b'{"ok": true}\n')
+                return False
+            if request.get('op') == 'ping':
+                connection.sendall(json.dumps(
+                    {'ok': True, 'pid': os.getpid(), 'watches': len(self.watcher.watches)}).encode() + b'\n')
+                return True
+
+            if request.get('hash_algorithm', self.file_handler.hash_algorithm) != self.file_handler.hash_algorithm:
+                # the repository was migrated, every hash is stale
+                self.file_handler.hash_algorithm = request['hash_algorithm']
+                self.file_handler.stat_cache.clear()
+                self.full_scan()
+            else:
+                self.refresh()
+            connection.sendall(json.dumps(
+                {'ok': True, 'pid': os.getpid(), 'files': self.files}).encode() + b'\n')
+            return True
+
+    def serve(self):
+        self.full_scan()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(8)
+
+        try:
+            running = True
+            while running:
+                readable, writable, failed = select.select(
+                    [server, self.watcher], [], [])
+                if self.watcher in readable:
+                    self.drain()
+                if server in readable:
+                    connection, address = server.accept()
+                    try:
+                        running = self.handle(connection)
+                    except Exception as e:
+                        print(f"Error answering query: {e}")
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class DaemonClient:
+    TIMEOUT = 30
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def request(self, message, timeout=None):
+        # None whenever no daemon answers, callers then do the work themselves
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.socket_path):
+            return None
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.settimeout(timeout if timeout else self.TIMEOUT)
+                client.connect(self.socket_path)
+                client.sendall(json.dumps(message).encode() + b'\n')
+                response = b''
+                while not response.endswith(b'\n'):
+                    data = client.recv(1024 * 1024)
+                    if not data:
+                        return None
+                    response += data
+            return json.loads(response)
+        except (OSError, ValueError):
+            return None
+
+    def scan(self, hash_algorithm):
+        response = self.request({'op': 'scan', 'hash_algorithm': hash_algorithm})
+        return response['files'] if response else None
+
 
 class VersionControlSystem:
+    REPOSITORY_FORMAT_VERSION = 1
+    DELTA_DEPTH = 10
+    DELTA_MIN_SIZE = 64
+    DELTA_SIZE_RATIO = 4
+    GC_EXPIRE_DAYS = 14
+    PUSH_MANIFEST_NAME = '.krups_push.json'
+
     def __init__(self, vcs_name=".tico"):
         self.vcs_name = vcs_name
         self.branch = "main"
         self.branches_dir = os.path.join(vcs_name, "branches")
         self.objects_dir = os.path.join(vcs_name, "objects")
         self.main_branch = os.path.join(self.branches_dir, "main")
-        self.added_file = os.path.join(vcs_name, "added.json")
-        self.index_file = os.path.join(vcs_name, "index.json")
+        self.added_file = os.path.join(vcs_name, "added")
+        self.index_file = os.path.join(vcs_name, "index")
         self.users_file = os.path.join(vcs_name, "users.txt")
         self.commits_dir = os.path.join(self.objects_dir, "commits")
         self.rmcommits_dir = os.path.join(self.objects_dir, "rmcommits")
         self.content_dir = os.path.join(self.objects_dir, "content")
+        self.pack_dir = os.path.join(self.objects_dir, "pack")
+        self.stat_cache_file = os.path.join(vcs_name, "stat_cache")
+        self.format_file = os.path.join(vcs_name, "format.json")
+        self.commit_index_file = os.path.join(vcs_name, "commit_index.jsonl")
+        self.daemon_socket = os.path.join(vcs_name, "daemon.sock")
+        self.daemon_log = os.path.join(vcs_name, "daemon.log")
+        self.journal_file = os.path.join(vcs_name, "journal")
 
         # initialize helper classes
-        self.file_handler = HandleFile()
+        self.stat_cache = StatCache(self.stat_cache_file)
+        self.packs = PackStore(self.pack_dir)
+        self.file_handler = HandleFile(self.stat_cache, packs=self.packs)
+        self.file_handler.daemon = DaemonClient(self.daemon_socket)
+        self.file_handler.journal_file = self.journal_file
+        self.recover()
 
         # set username
         self.username = self.set_username()
+        self.load_format()
+
+    def recover(self):
+        # finish or drop the metadata writes of a command that was cut off
+        if self.notInitialized('.'):
+            return
+        journal = self.file_handler.journal()
+        try:
+            if journal.recover():
+                print("Recovered the last command's interrupted writes.")
+        except Exception as e:
+            print(f"Error replaying {self.journal_file}: {e}")
+            if not os.path.exists(self.journal_file) and os.path.exists(journal.failed_file()):
+                print(f"The log was moved to {journal.failed_file()}, "
+                      "the last command's metadata writes may be incomplete.")
 
     def set_username(self):
         if self.notInitialized('.'):
@@ -304,13 +2813,52 @@ class VersionControlSystem:
         user = get_last_user.split()[2]
         return user
 
+    def load_format(self):
+        if self.notInitialized('.'):
+            return
+
+        # repositories created before format.json existed use MD5
+        repo_format = {'format_version': 1,
+                       'hash_algorithm': HandleFile.DEFAULT_HASH_ALGORITHM}
+        if os.path.exists(self.format_file):
+            repo_format = self.file_handler.read_JSON_file(self.format_file)
+
+        if repo_format.get('format_version', 1) > self.REPOSITORY_FORMAT_VERSION:
+            print(f"Warning: repository format {repo_format['format_version']} is newer than this tico supports")
+
+        hash_algorithm = repo_format.get(
+            'hash_algorithm', HandleFile.DEFAULT_HASH_ALGORITHM)
+        if hash_algorithm not in HandleFile.HASH_ALGORITHMS:
+            print(f"Error: unknown hash algorithm '{hash_algorithm}' in {self.format_file}")
+            return
+
+        self.file_handler.hash_algorithm = hash_algorithm
+        self.file_handler.chunk_threshold = repo_format.get(
+            'chunk_threshold', HandleFile.DEFAULT_CHUNK_THRESHOLD)
+
+    def write_format(self, hash_algorithm, chunk_threshold=None, journal=None):
+        if chunk_threshold is None:
+            chunk_threshold = self.file_handler.chunk_threshold
+        self.file_handler.write_JSON_file_atomic(self.format_file, {
+            'format_version': self.REPOSITORY_FORMAT_VERSION,
+            'hash_algorithm': hash_algorithm,
+            'chunk_threshold': chunk_threshold,
+        }, journal)
+        self.file_handler.hash_algorithm = hash_algorithm
+        self.file_handler.chunk_threshold = chunk_threshold
+
     def notInitialized(self, dir_path):
         files_and_dirs = os.listdir(dir_path)
         if '.krups' not in files_and_dirs:
             return True
         return False
 
-    def init(self):
+    def init(self, hash_algorithm=None, chunk_threshold=None):
+        hash_algorithm = hash_algorithm if hash_algorithm else HandleFile.DEFAULT_HASH_ALGORITHM
+        if hash_algorithm not in HandleFile.HASH_ALGORITHMS:
+            print(f"Error: hash algorithm must be one of {', '.join(HandleFile.HASH_ALGORITHMS)}")
+            return
+
         username = input("Enter your username: ")
         self.username = username
 
@@ -318,6 +2866,7 @@ class VersionControlSystem:
         try:
             os.makedirs(self.vcs_name, exist_ok=True)
             os.makedirs(self.branches_dir, exist_ok=True)
+            os.makedirs(self.main_branch, exist_ok=True)
             os.makedirs(self.objects_dir, exist_ok=True)
             os.makedirs(self.content_dir, exist_ok=True)
             os.makedirs(self.commits_dir, exist_ok=True)
@@ -328,9 +2877,12 @@ class VersionControlSystem:
 
         # Create files
         try:
-            self.file_handler.create_file(self.added_file)
-            self.file_handler.create_file(self.index_file)
+            self.file_handler.create_index(self.added_file)
+            self.file_handler.create_index(self.index_file)
             self.file_handler.create_file(self.users_file)
+            self.file_handler.create_file(
+                os.path.join(self.main_branch, 'HEAD'))
+            self.write_format(hash_algorithm, chunk_threshold)
         except Exception as e:
             print(f"Error creating files: {e}")
             return
@@ -339,7 +2891,6 @@ class VersionControlSystem:
 
         # Append user details
         self.file_handler.append_user_details(self.users_file, username)
-        self.create_branch("main")
 
     def create_branch(self, branch_name):
         if self.notInitialized('.'):
@@ -367,9 +2918,11 @@ class VersionControlSystem:
 
         try:
             if not last_commit and self.branch != 'main':
-                self.file_handler.clear_current_dir(os.getcwd())
-                self.file_handler.write_JSON_file(self.added_file, {})
-                self.file_handler.write_JSON_file(self.index_file, {})
+                self.file_handler.update_worktree({}, self.content_dir)
+                self.stat_cache.save()
+                with self.file_handler.journal() as journal:
+                    self.file_handler.write_index(self.added_file, {}, journal)
+                    self.file_handler.write_index(self.index_file, {}, journal)
                 return
         except Exception as e:
             print(f"Error in clearing directory: {e}")
@@ -385,61 +2938,50 @@ class VersionControlSystem:
                 print("Run: 'tico init' command to initialize tico repository")
                 return
 
-            added = self.file_handler.read_JSON_file(
-                self.added_file)
-
-            tracked_files_data = None
-            all_committed_files = None
-            tracked_files_data, all_committed_files = self.file_handler.get_tracked_files(
+            added = self.file_handler.read_index(self.added_file)
+            committed_files = self.file_handler.get_head_index(
                 self.branches_dir, self.branch, self.commits_dir)
 
-            untracked_files = self.file_handler.get_untracked_files(
-                tracked_files_data)
+            scan = self.file_handler.scan_worktree(committed_files, added)
 
-            if not untracked_files and tracked_files_data and all_committed_files and tracked_files_data == all_committed_files:
+            if not scan['new'] and not scan['modified'] and not scan['deleted'] and scan['unchanged']:
                 print("Your directory is up to date...")
                 return
 
-            for file_name, file_hash in tracked_files_data.items():
-                tracked_files_data[file_name] = file_hash
+            tracked_files_data = {rel_path: scan['files'][rel_path]
+                                  for rel_path in scan['unchanged']}
             for file_name, file_hash in added.items():
                 tracked_files_data[file_name] = file_hash
 
-            for root, dirs, files in os.walk(os.getcwd()):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
-
-                # print("dirs: ", dirs)
-                for file in files:
-                    # print(file)
-                    file_path = os.path.join(root, file)
-                    hash = self.file_handler.compute_MD5_file(file_path)
-                    rel_path = os.path.relpath(file_path, os.getcwd())
-
-                    if rel_path in tracked_files_data.keys() and tracked_files_data[rel_path] == hash:
-                        status = 'Tracked'
-                    else:
-                        status = 'Untracked'
+            for rel_path, hash in scan['files'].items():
+                if rel_path in tracked_files_data.keys() and tracked_files_data[rel_path] == hash:
+                    status = 'Tracked'
+                else:
+                    status = 'Untracked'
 
-                    print(f"{status}: {rel_path}")
+                print(f"{status}: {rel_path}")
         except Exception as e:
             print(f"Error in status: {e}")
+        finally:
+            self.stat_cache.save()
 
-    def add(self, file_path_full, file_path_relative=None):
+    def add(self, file_path_full, file_path_relative=None, file_path_hash=None, staging=None):
         try:
             if not os.path.exists(file_path_full):
                 print(f"Error: File '{file_path_relative}' does not exist.")
                 return
 
-            file_path_hash = self.file_handler.compute_MD5_file(file_path_full)
-            file_path_relative = file_path_relative if file_path_relative else os.path.normpath(
-                file_path_full)
-            self.file_handler.add_JSON_data(
-                self.added_file, file_path_relative, file_path_hash)
-            self.file_handler.add_JSON_data(
-                self.index_file, file_path_relative, file_path_hash)
+            file_path_relative = file_path_relative if file_path_relative else os.path.relpath(
+                file_path_full, os.getcwd())
+            file_path_hash = file_path_hash if file_path_hash else self.file_handler.compute_MD5_cached(
+                file_path_full, file_path_relative)
+
+            if staging:
+                staging.add(file_path_relative, file_path_hash)
+                return
+
+            with self.file_handler.staging_transaction(self.added_file, self.index_file) as staging:
+                staging.add(file_path_relative, file_path_hash)
         except Exception as e:
             print(f"Error adding file {file_path_relative}: {str(e)}")
 
@@ -450,23 +2992,23 @@ class VersionControlSystem:
             return
 
         if not os.path.isdir(dir_path):
+            if self.file_handler.ignore_rules().is_ignored_path(os.path.relpath(dir_path), False):
+                print(f"{dir_path} is ignored by {IgnoreRules.FILE_NAME}...")
+                return
             self.add(dir_path)
+            self.stat_cache.save()
             return
 
         try:
-            for root, dirs, files in os.walk(dir_path):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
-
-                for file in files:
-                    file_path_full = os.path.normpath(os.path.join(root, file))
-                    file_path_relative = os.path.normpath(
-                        file_path_full)
-                    self.add(file_path_full, file_path_relative)
+            scan = self.file_handler.scan_worktree(dir_path=dir_path)
+            with self.file_handler.staging_transaction(self.added_file, self.index_file) as staging:
+                for file_path_relative, file_path_hash in scan['files'].items():
+                    self.add(file_path_relative, file_path_relative,
+                             file_path_hash, staging)
         except Exception as e:
             print(f"Error adding directory {dir_path}: {e}")
+        finally:
+            self.stat_cache.save()
 
     def commit(self, message="New commit"):
         if self.notInitialized('.'):
@@ -474,23 +3016,23 @@ class VersionControlSystem:
             print("Run: 'tico init' command to initialize tico repository")
             return
 
-        added = self.file_handler.read_JSON_file(self.added_file)
-        # print(added)
-        tracked_files, all_committed_files = self.file_handler.get_tracked_files(
+        added = self.file_handler.read_index(self.added_file)
+        committed_files = self.file_handler.get_head_index(
             self.branches_dir, self.branch, self.commits_dir)
-        # print("1st: ", tracked_files)
-        tracked_files = {file_name: file_hash for file_name, file_hash in tracked_files.items(
-        )} or {file_name: file_hash for file_name, file_hash in added.items()}
-        # print("2nd: ", tracked_files)
+
+        # walk and hash the working directory once for the whole commit
+        scan = self.file_handler.scan_worktree(committed_files, added)
+
+        tracked_files = {rel_path: scan['files'][rel_path] for rel_path in scan['unchanged']} or {
+            file_name: file_hash for file_name, file_hash in added.items()}
 
         untracked_files = self.file_handler.get_untracked_files(
-            tracked_files)
+            tracked_files, scan)
 
-        if not untracked_files and tracked_files and all_committed_files and tracked_files == all_committed_files:
+        if not untracked_files and tracked_files and committed_files and tracked_files == committed_files:
             print("Your directory is up to date...")
             return
 
-        untracked_files = self.file_handler.get_untracked_files(tracked_files)
         untracked_files = [
             file for file in untracked_files if file not in added.keys()]
         # print(untracked_files)
@@ -502,8 +3044,9 @@ class VersionControlSystem:
             print()
             ans = input("Do you want to commit untracked file(s)? (y/n): ")
             if ans.lower() == 'y':
-                for file in untracked_files:
-                    self.add_with_subdirs(file)
+                with self.file_handler.staging_transaction(self.added_file, self.index_file) as staging:
+                    for file in untracked_files:
+                        self.add(file, file, scan['files'][file], staging)
         elif not tracked_files:
             print("No changes to commit")
             return
@@ -511,65 +3054,56 @@ class VersionControlSystem:
         changes = {}
         timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S.%f")[:-6]
 
-        last_commit = self.file_handler.get_last_commit(os.path.join(
-            self.branches_dir, self.branch, 'HEAD'))
-
-        committed_files = None
-
-        if last_commit:
-            committed_files = self.file_handler.get_committed_files(
-                self.commits_dir, last_commit, 'index')
-
-        added = self.file_handler.read_JSON_file(self.added_file)
+        added = self.file_handler.read_index(self.added_file)
 
         for file_path in added:
             if (not committed_files) or (file_path not in committed_files.keys() or committed_files[file_path] != added[file_path]):
-                file_path_full = os.path.normpath(
-                    os.path.join(os.getcwd(), file_path))
-                changes[file_path] = self.file_handler.compute_MD5_file(
-                    file_path_full)
+                changes[file_path] = scan['files'].get(file_path)
 
-        index = self.file_handler.read_JSON_file(self.index_file)
+        index = self.file_handler.read_index(self.index_file)
+        try:
+            tree_hash = self.file_handler.write_tree(self.content_dir, index)
+        except Exception as e:
+            print(f"Error writing tree objects: {e}")
+            return
 
         commit_data = {
             "message": message,
             "timestamp": timestamp,
             "added": changes,
-            "index": index,
+            "tree": tree_hash,
             "branch": self.branch,
             "author": self.username
         }
 
-        try:
-            commit_data_hash = self.file_handler.compute_MD5_str(
-                commit_data)
-            HEAD_path = os.path.join(self.branches_dir, self.branch, 'HEAD')
-            with open(HEAD_path, 'a') as head_file:
-                head_file.write(commit_data_hash + '\n')
-        except Exception as e:
-            print(f"Error writing commit data to HEAD file: {e}")
+        self.ensure_commit_index()
+
+        commit_data_hash = self.file_handler.compute_MD5_str(commit_data)
+        HEAD_path = os.path.join(self.branches_dir, self.branch, 'HEAD')
+        parent = self.file_handler.get_last_commit(HEAD_path)
+
+        # objects first, so HEAD never names a commit that is not stored
+        for file_path, file_hash in changes.items():
+            self.file_handler.write_object(os.path.normpath(
+                os.path.join(os.getcwd(), file_path)), os.path.join(self.content_dir, file_hash), file_hash)
 
         try:
-            commit_data_encoded = base64.b64encode(
-                json.dumps(commit_data).encode('utf-8'))
+            self.file_handler.write_commit(
+                self.commits_dir, commit_data_hash, commit_data)
         except Exception as e:
-            print(f"Error encoding commit data: {e}")
+            print(f"Error writing commit data to file: {e}")
             return
 
+        # HEAD, the commit index and the emptied staging area move together
         try:
-            commit_file_path = os.path.join(self.commits_dir, commit_data_hash)
-            with open(commit_file_path, 'wb') as commit_file:
-                commit_file.write(commit_data_encoded)
+            with self.file_handler.journal() as journal:
+                journal.append(HEAD_path, (commit_data_hash + '\n').encode())
+                self.file_handler.append_commit_meta(self.commit_index_file, [
+                    self.file_handler.commit_meta(commit_data_hash, commit_data, parent)], journal)
+                self.file_handler.write_index(self.added_file, {}, journal)
         except Exception as e:
-            print(f"Error writing commit data to file: {e}")
-
-        for file_path, file_hash in changes.items():
-            file_data_encrypted = self.file_handler.encode_base64_file(os.path.normpath(
-                os.path.join(os.getcwd(), file_path)))
-            with open(os.path.join(self.content_dir, file_hash), 'w') as file:
-                file.write(file_data_encrypted)
-
-        self.file_handler.write_JSON_file(self.added_file, {})
+            print(f"Error writing commit data to HEAD file: {e}")
+        self.stat_cache.save()
 
     def rmcommit(self):
         if self.notInitialized('.'):
@@ -587,107 +3121,78 @@ class VersionControlSystem:
         second_last_commit = self.file_handler.get_second_last_commit(
             HEAD_path)
 
-        # remove every file and directory once
-        self.file_handler.clear_current_dir(os.getcwd())
+        self.ensure_commit_index()
 
-        # if there was only one commit, remove that commit file too and update added.json and index.json
+        # if there was only one commit, remove that commit file too and empty the staging files
         if last_commit and not second_last_commit:
+            self.file_handler.update_worktree({}, self.content_dir)
+            self.stat_cache.save()
+
             try:
-                commit_file_path = os.path.join(
-                    self.commits_dir, last_commit)
-
-                committed_files_last_commit = self.file_handler.get_committed_files(
-                    self.commits_dir, last_commit, 'added')
-                for file_path, file_hash in committed_files_last_commit.items():
-                    os.remove(os.path.join(self.content_dir, file_hash))
-
-                self.file_handler.write_JSON_file(self.added_file, {})
-                self.file_handler.write_JSON_file(self.index_file, {})
-
-                self.file_handler.remove_last_line(HEAD_path)
-                # os.remove(commit_file_path)
-                move_commit_file_path = os.path.join(
-                    self.rmcommits_dir, last_commit)
-                shutil.move(commit_file_path, move_commit_file_path)
+                # blobs may be shared with other commits, gc reclaims them
+                with self.file_handler.journal() as journal:
+                    self.file_handler.write_index(self.added_file, {}, journal)
+                    self.file_handler.write_index(self.index_file, {}, journal)
+
+                    self.file_handler.remove_last_line(HEAD_path, journal=journal)
+                    # os.remove(commit_file_path)
+                    self.file_handler.move_commit(
+                        self.commits_dir, self.rmcommits_dir, last_commit, journal)
+                    self.file_handler.append_commit_meta(self.commit_index_file, [
+                        {"op": "rmcommit", "hash": last_commit}], journal)
             except Exception as e:
                 print(f"Error in rmcommit: {e}")
             return
 
-        # get all the files and directories from 2nd last commit and add them to the current directory
-        committed_files = self.file_handler.get_committed_files(
-            self.commits_dir, second_last_commit, 'index')
-        # print(committed_files)
-
+        # the staging area is the 2nd last commit's once HEAD drops the last;
+        # both are read before the working directory is touched
         try:
-            for file_path, file_hash in committed_files.items():
-                file_path = os.path.join(os.getcwd(), file_path)
-
-                dir_name = os.path.dirname(file_path)
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
+            committed_files = self.file_handler.read_committed_files(
+                self.commits_dir, second_last_commit, 'index')
+            added = self.file_handler.read_committed_files(
+                self.commits_dir, second_last_commit, 'added')
         except Exception as e:
-            print(f"Error in making directories: {e}")
+            print(f"Error reading commit {second_last_commit}: {e}")
             return
 
+        # bring the working directory to the 2nd last commit, touching only what differs
         try:
-            for file_path, file_hash in committed_files.items():
-                file_path_encoded_data = os.path.join(
-                    self.content_dir, file_hash)
-                file_path_decoded_data = os.path.normpath(file_path)
-
-                with open(file_path_encoded_data, 'r') as encoded_file:
-                    file_data_encoded = encoded_file.read()
-                    file_data_decoded = self.file_handler.decode_base64_file(
-                        file_data_encoded)
-
-                with open(file_path_decoded_data, 'wb') as file:
-                    file.write(file_data_decoded)
+            self.file_handler.update_worktree(
+                committed_files, self.content_dir)
+            self.stat_cache.save()
         except Exception as e:
-            print(f"Error decoding and writing file: {e}")
+            print(f"Error in updating working directory: {e}")
             return
 
-        committed_files_last_commit = self.file_handler.get_committed_files(
-            self.commits_dir, last_commit, 'added')
+        # blobs may be shared with other commits, gc reclaims them
         try:
-            for file_path, file_hash in committed_files_last_commit.items():
-                os.remove(os.path.join(self.content_dir, file_hash))
-        except Exception as e:
-            print(f"Error in removing files: {e}")
-
-        try:
-            commit_file_path = os.path.join(
-                self.commits_dir, last_commit)
-            move_commit_file_path = os.path.join(
-                self.rmcommits_dir, last_commit)
-            shutil.move(commit_file_path, move_commit_file_path)
+            with self.file_handler.journal() as journal:
+                self.file_handler.move_commit(
+                    self.commits_dir, self.rmcommits_dir, last_commit, journal)
+                self.file_handler.append_commit_meta(self.commit_index_file, [
+                    {"op": "rmcommit", "hash": last_commit}], journal)
+                self.file_handler.remove_last_line(HEAD_path, journal=journal)
+                self.file_handler.write_index(self.added_file, added, journal)
+                self.file_handler.write_index(
+                    self.index_file, committed_files, journal)
         except Exception as e:
             print(f"Error in moving commit file: {e}")
-        # os.remove(commit_file_path)
-
-        self.file_handler.remove_last_line(HEAD_path)
-
-        # accessing 2nd last line
-        last_commit = self.file_handler.get_last_commit(HEAD_path)
-        added = {} if not last_commit else self.file_handler.get_committed_files(
-            self.commits_dir, last_commit, 'added')
-        index = {} if not last_commit else self.file_handler.get_committed_files(
-            self.commits_dir, last_commit, 'index')
-
-        self.file_handler.write_JSON_file(self.added_file, added)
-        self.file_handler.write_JSON_file(self.index_file, index)
 
-    def rmadd(self, file_path_full, file_path_relative=None):
+    def rmadd(self, file_path_full, file_path_relative=None, staging=None):
         try:
             if not os.path.exists(file_path_full):
                 print(f"Error: File '{file_path_relative}' does not exist.")
                 return
 
-            file_path_relative = file_path_relative if file_path_relative else os.path.normpath(
-                file_path_full)
-            self.file_handler.remove_JSON_data(
-                self.added_file, file_path_relative)
-            self.file_handler.remove_JSON_data(
-                self.index_file, file_path_relative)
+            file_path_relative = file_path_relative if file_path_relative else os.path.relpath(
+                file_path_full, os.getcwd())
+
+            if staging:
+                staging.remove(file_path_relative)
+                return
+
+            with self.file_handler.staging_transaction(self.added_file, self.index_file) as staging:
+                staging.remove(file_path_relative)
         except Exception as e:
             print(f"Error removing {file_path_relative}: {str(e)}")
 
@@ -702,65 +3207,60 @@ class VersionControlSystem:
             return
 
         try:
-            for root, dirs, files in os.walk(dir_path):
-                dirs[:] = [d for d in dirs if d not in [
-                    '.krups', '__pycache__', '.git']]
-                files[:] = [f for f in files if f not in [
-                    'VCS.py', 'HandleFile.py', '.gitignore', 'VCS.exe']]
-
-                for file in files:
-                    file_path_full = os.path.normpath(os.path.join(root, file))
-                    file_path_relative = os.path.normpath(
-                        file_path_full)
-                    self.rmadd(file_path_full, file_path_relative)
+            with self.file_handler.staging_transaction(self.added_file, self.index_file) as staging:
+                for file_path_full, file_path_relative, dir_entry in self.file_handler.walk_worktree(dir_path):
+                    self.rmadd(file_path_full, file_path_relative, staging)
         except Exception as e:
             print(f"Error adding directory {dir_path}: {e}")
 
-    def checkout(self, hash):
+    def is_branch_commit(self, commit_hash):
+        # a commit is on this branch if the branch's HEAD log lists it; a
+        # stored commit the log does not list, like one a crash left behind
+        # before HEAD moved, is not. Only a stored commit that records this
+        # branch is looked for, from the end of the log where recent commits
+        # are, so typos and other branches' commits never read the log
+        if not commit_hash or any(char not in '0123456789abcdef' for char in commit_hash):
+            return False
+        try:
+            commit_data = self.file_handler.read_commit(
+                self.commits_dir, commit_hash)
+        except (OSError, ValueError):
+            return False
+        if commit_data.get('branch') != self.branch:
+            return False
+
         HEAD_path = os.path.join(self.branches_dir, self.branch, 'HEAD')
-        all_commits = self.file_handler.read_all_lines(
-            os.path.normpath(HEAD_path))
+        try:
+            return commit_hash in self.file_handler.read_lines_reversed(HEAD_path)
+        except OSError:
+            return False
 
-        if hash not in all_commits:
+    def checkout(self, hash):
+        if not self.is_branch_commit(hash):
             print("Invalid commit hash...")
             return
 
-        # remove all the files and directories
-        self.file_handler.clear_current_dir(os.getcwd())
-
-        index_files = self.file_handler.get_committed_files(
-            self.commits_dir, hash, 'index')
-        added_files = self.file_handler.get_committed_files(
-            self.commits_dir, hash, 'added')
-
-        # make files and dirs
+        # an unreadable commit must not be mistaken for an empty one, that
+        # would delete every tracked file from the working directory
         try:
-            for file_path, file_hash in index_files.items():
-                file_path = os.path.join(os.getcwd(), file_path)
-
-                dir_name = os.path.dirname(file_path)
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
+            index_files = self.file_handler.read_committed_files(
+                self.commits_dir, hash, 'index')
+            added_files = self.file_handler.read_committed_files(
+                self.commits_dir, hash, 'added')
         except Exception as e:
-            print(f"Error creating directories: {e}")
+            print(f"Error reading commit {hash}: {e}")
+            return
 
+        # remove, create or rewrite only the paths that differ from the commit
         try:
-            for file_path, file_hash in index_files.items():
-                file_path_encoded_data = os.path.join(
-                    self.content_dir, file_hash)
-                file_path_decoded_data = os.path.normpath(file_path)
-
-                file_data_encoded = open(file_path_encoded_data, 'r').read()
-                file_data_decoded = self.file_handler.decode_base64_file(
-                    file_data_encoded)
-
-                with open(file_path_decoded_data, 'wb') as file:
-                    file.write(file_data_decoded)
+            self.file_handler.update_worktree(index_files, self.content_dir)
+            self.stat_cache.save()
         except Exception as e:
-            print(f"Error decoding and writing file: {e}")
+            print(f"Error updating working directory: {e}")
 
-        self.file_handler.write_JSON_file(self.added_file, added_files)
-        self.file_handler.write_JSON_file(self.index_file, index_files)
+        with self.file_handler.journal() as journal:
+            self.file_handler.write_index(self.added_file, added_files, journal)
+            self.file_handler.write_index(self.index_file, index_files, journal)
 
     def push(self, push_dir_full_path):
         if self.notInitialized('.'):
@@ -785,73 +3285,234 @@ class VersionControlSystem:
         committed_files = self.file_handler.get_committed_files(
             self.commits_dir, last_commit, 'index')
 
-        try:
-            for relative_path, file_hash in committed_files.items():
-                file_path = os.path.join(push_dir_full_path, relative_path)
+        # the manifest records what the previous push wrote to this directory
+        manifest_file = os.path.join(
+            push_dir_full_path, self.PUSH_MANIFEST_NAME)
+        manifest = self.file_handler.read_JSON_file(
+            manifest_file) if os.path.exists(manifest_file) else {}
 
-                dir_name = os.path.dirname(file_path)
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
+        try:
+            files = []
+            for relative_path, file_hash in sorted(committed_files.items()):
+                entry = manifest.get(relative_path)
+                if entry and entry[0] == file_hash:
+                    try:
+                        st = os.stat(os.path.join(
+                            push_dir_full_path, relative_path))
+                        if [st.st_size, st.st_mtime_ns] == entry[1:]:
+                            continue
+                    except OSError:
+                        pass
+                files.append((relative_path, file_hash))
+
+            # only files an earlier push created are ever deleted, and never
+            # outside the push directory whatever the manifest says
+            push_root = os.path.realpath(push_dir_full_path)
+            removed_dirs = set()
+            removed_files = []
+            for relative_path in [relative_path for relative_path in manifest
+                                  if relative_path not in committed_files]:
+                manifest.pop(relative_path)
+                file_path = os.path.realpath(os.path.join(push_dir_full_path, relative_path))
+                if file_path == push_root or not self.file_handler.is_inside(push_root, file_path):
+                    print(f"Skipping {relative_path}: it is outside {push_dir_full_path}")
+                    continue
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+                removed_files.append(relative_path)
+                removed_dirs.add(os.path.dirname(os.path.relpath(file_path, push_root)))
+            self.file_handler.remove_empty_dirs(
+                push_dir_full_path, removed_dirs)
+
+            written = self.file_handler.materialize_files(
+                files, self.content_dir, push_dir_full_path)
+            for relative_path in written:
+                st = os.stat(os.path.join(push_dir_full_path, relative_path))
+                manifest[relative_path] = [
+                    committed_files[relative_path], st.st_size, st.st_mtime_ns]
+
+            self.file_handler.write_JSON_file_atomic(manifest_file, manifest)
+        except Exception as e:
+            print(f"Error in push: {e}")
+            return
 
-                self.file_handler.create_file(file_path)
+        print(f"Pushed successfully... ({len(written)} written, {len(removed_files)} removed, "
+              f"{len(committed_files) - len(files)} unchanged)")
 
-                file_path_encoded_data = os.path.join(
-                    self.content_dir, file_hash)
+    def ensure_commit_index(self):
+        if os.path.exists(self.commit_index_file):
+            return
 
-                file_data_encoded = open(file_path_encoded_data, 'r').read()
-                file_data_decoded = self.file_handler.decode_base64_file(
-                    file_data_encoded)
-                open(file_path, 'wb').write(file_data_decoded)
+        # one-time rebuild for repositories created before the commit index
+        entries = []
+        try:
+            for branch in sorted(os.listdir(self.branches_dir)):
+                parent = None
+                for commit_hash in self.file_handler.read_all_lines(os.path.join(self.branches_dir, branch, 'HEAD')):
+                    commit_data = self.file_handler.read_commit(
+                        self.commits_dir, commit_hash)
+                    entries.append(self.file_handler.commit_meta(
+                        commit_hash, commit_data, parent))
+                    parent = commit_hash
+
+            for commit_hash in sorted(os.listdir(self.rmcommits_dir)):
+                commit_data = self.file_handler.read_commit(
+                    self.rmcommits_dir, commit_hash)
+                entries.append(self.file_handler.commit_meta(
+                    commit_hash, commit_data))
+                entries.append({"op": "rmcommit", "hash": commit_hash})
         except Exception as e:
-            print(f"Error in push: {e}")
+            print(f"Error rebuilding commit index: {e}")
             return
 
-        print("Pushed successfully...")
+        self.file_handler.append_commit_meta(self.commit_index_file, entries)
 
-    def log(self):
-        if self.notInitialized('.'):
-            print("'.krups' folder is not initialized...")
-            print("Run: 'tico init' command to initialize tico repository")
-            return
+    def get_commit_meta(self, commit_index, commits_dir, commit_hash):
+        entry = commit_index.get(commit_hash)
+        if entry:
+            return entry
 
-        HEAD_path = os.path.join(self.branches_dir, self.branch, 'HEAD')
-        all_commits = self.file_handler.read_all_lines(HEAD_path)
-        removed_commits = os.listdir(self.rmcommits_dir)
+        # commits made by an older tico are indexed on first sight
+        try:
+            commit_data = self.file_handler.read_commit(
+                commits_dir, commit_hash)
+        except Exception as e:
+            print(f"Error reading commit {commit_hash}: {e}")
+            return None
 
-        if not all_commits and not removed_commits:
-            print("No logs available...")
+        entry = self.file_handler.commit_meta(commit_hash, commit_data)
+        self.file_handler.append_commit_meta(self.commit_index_file, [entry])
+        commit_index.commits[commit_hash] = entry
+        return entry
+
+    def parse_commit_time(self, meta):
+        return datetime.strptime(meta['timestamp'].rstrip('.'), "%d/%m/%Y %H:%M:%S")
+
+    def print_commit(self, label, commits_dir, commit_hash, meta, full=False, oneline=False, stat=False):
+        if oneline:
+            removed = " (removed)" if label == "Removed commit" else ""
+            print(f"{commit_hash}{removed} {meta['message']}")
             return
 
-        print()
-        print("*"*34, " Commits ", "*"*34)
-        print()
+        print(f"{label}: {commit_hash}")
+        print(f"Author: {meta['author']}")
+        print(f"Message: {meta['message']}")
+        print(f"Timestamp: {meta['timestamp']}")
+        print(f"Branch: {meta['branch']}")
+        print(f"Changed files: {meta['changed']}")
+
+        # the file maps are only decoded when asked for
+        if stat and not full:
+            commit_data = self.file_handler.read_commit(
+                commits_dir, commit_hash)
+            print("-"*60)
+            for file_path in commit_data['added']:
+                print(f"\t{file_path}")
+            print(f"{len(commit_data['added'])} file(s) changed")
 
-        for commit_file in all_commits:
-            commit_file_path = os.path.join(self.commits_dir, commit_file)
-            commit_file_encoded_data = open(commit_file_path, 'rb').read()
-            commit_file_decoded_data = base64.b64decode(
-                commit_file_encoded_data).decode('utf-8')
-            commit_file_decoded_data = json.loads(commit_file_decoded_data)
-
-            print(f"Commit: {commit_file}")
-            print(f"Author: {commit_file_decoded_data['author']}")
-            print(f"Message: {commit_file_decoded_data['message']}")
-            print(f"Timestamp: {commit_file_decoded_data['timestamp']}")
-            print(f"Branch: {commit_file_decoded_data['branch']}")
+        if full:
+            commit_data = self.file_handler.read_commit(
+                commits_dir, commit_hash)
             print("-"*60)
             print("Added / Modified files:")
-            for file_path, file_hash in commit_file_decoded_data['added'].items():
+            for file_path, file_hash in commit_data['added'].items():
                 print(f"\t{file_path}: {file_hash}")
             print("-"*60)
             print("All files:")
-            for file_path, file_hash in commit_file_decoded_data['index'].items():
+            for file_path, file_hash in self.file_handler.get_committed_files(
+                    commits_dir, commit_hash, 'index').items():
                 print(f"\t{file_path}: {file_hash}")
 
+        print()
+        print("*"*79)
+        print()
+
+    def log(self, limit=None, oneline=False, since=None, until=None, author=None, branch=None, stat=False, full=False):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        # removed commits are only filtered by branch when one is asked for
+        branch_filter = branch
+        branch = branch if branch else self.branch
+        HEAD_path = os.path.join(self.branches_dir, branch, 'HEAD')
+        if not os.path.exists(HEAD_path):
+            print(f"Branch {branch} does not exist...")
+            return
+
+        self.ensure_commit_index()
+        commit_index = CommitIndexReader(
+            self.file_handler, self.commit_index_file)
+
+        def matches(meta):
+            if author and meta['author'] != author:
+                return False
+            if branch_filter and meta['branch'] != branch_filter:
+                return False
+            commit_time = self.parse_commit_time(meta)
+            return not (since and commit_time < since) and not (until and commit_time > until)
+
+        # HEAD is read newest first so a limited log stops after a few lines
+        printed = 0
+        header_printed = False
+        try:
+            for commit_hash in self.file_handler.read_lines_reversed(HEAD_path):
+                if limit is not None and printed >= limit:
+                    break
+
+                meta = self.get_commit_meta(
+                    commit_index, self.commits_dir, commit_hash)
+                if not meta:
+                    continue
+                # HEAD is in commit order, nothing older can match --since
+                if since and self.parse_commit_time(meta) < since:
+                    break
+                if author and meta['author'] != author:
+                    continue
+                if until and self.parse_commit_time(meta) > until:
+                    continue
+
+                if not header_printed and not oneline:
+                    print()
+                    print("*"*34, " Commits ", "*"*34)
+                    print()
+                header_printed = True
+
+                self.print_commit("Commit", self.commits_dir,
+                                  commit_hash, meta, full, oneline, stat)
+                printed += 1
+        except Exception as e:
+            print(f"Error reading log: {e}")
+            return
+
+        if limit is not None and printed >= limit:
+            return
+
+        removed_commits = []
+        rmcommit_files = set(os.listdir(self.rmcommits_dir))
+        for commit_hash in commit_index.removed_commits() + sorted(rmcommit_files.difference(commit_index.removed)):
+            if commit_hash not in rmcommit_files:
+                continue
+            meta = self.get_commit_meta(
+                commit_index, self.rmcommits_dir, commit_hash)
+            if meta and matches(meta):
+                removed_commits.append((commit_hash, meta))
+
+        if not header_printed and not removed_commits:
+            print("No logs available...")
+            return
+
+        if oneline:
+            for commit_hash, meta in removed_commits[:None if limit is None else limit - printed]:
+                self.print_commit("Removed commit", self.rmcommits_dir,
+                                  commit_hash, meta, oneline=True)
+            return
+
+        if not header_printed:
             print()
-            print("*"*79)
+            print("*"*34, " Commits ", "*"*34)
             print()
-
-        if not all_commits:
             print("No commit data available......\n")
             print("*"*79)
             print()
@@ -860,36 +3521,561 @@ class VersionControlSystem:
         print("*"*30, " Removed commits ", "*"*30)
         print()
 
-        for rmcommit in removed_commits:
-            rmcommit_file_path = os.path.join(self.rmcommits_dir, rmcommit)
-            rmcommit_file_encoded_data = open(rmcommit_file_path, 'rb').read()
-            rmcommit_file_decoded_data = base64.b64decode(
-                rmcommit_file_encoded_data).decode('utf-8')
-            rmcommit_file_decoded_data = json.loads(rmcommit_file_decoded_data)
-
-            print(f"Removed commit: {rmcommit}")
-            print(f"Author: {rmcommit_file_decoded_data['author']}")
-            print(f"Message: {rmcommit_file_decoded_data['message']}")
-            print(f"Timestamp: {rmcommit_file_decoded_data['timestamp']}")
-            print(f"Branch: {rmcommit_file_decoded_data['branch']}")
-            print("-"*60)
-            print("Added / Modified files:")
-            for file_path, file_hash in rmcommit_file_decoded_data['added'].items():
-                print(f"\t{file_path}: {file_hash}")
-            print("-"*60)
-            print("All files:")
-            for file_path, file_hash in rmcommit_file_decoded_data['index'].items():
-                print(f"\t{file_path}: {file_hash}")
-
-            print()
-            print("*"*79)
-            print()
+        for commit_hash, meta in removed_commits[:None if limit is None else limit - printed]:
+            self.print_commit("Removed commit", self.rmcommits_dir,
+                              commit_hash, meta, full, stat=stat)
 
         if not removed_commits:
             print("No commits removed......\n")
             print("*"*79)
             print()
 
+    def migrate(self, hash_algorithm):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        if hash_algorithm not in HandleFile.HASH_ALGORITHMS:
+            print(f"Error: hash algorithm must be one of {', '.join(HandleFile.HASH_ALGORITHMS)}")
+            return
+
+        if hash_algorithm == self.file_handler.hash_algorithm:
+            print(f"Repository already uses {hash_algorithm}...")
+            return
+
+        try:
+            # packs are keyed by the old digests, spill them back to loose objects
+            self.packs.unpack(self.file_handler.new_hash().digest_size,
+                              self.content_dir, self.commits_dir, HandleFile.RAW_SUFFIX,
+                              lambda object_hash: self.file_handler.read_delta(
+                                  os.path.join(self.content_dir, object_hash)))
+
+            # content objects keep their bytes, only their names change
+            hash_map = {}
+            object_suffixes = {}
+            chunk_lists = {}
+            trees = {}
+            for object_name in os.listdir(self.content_dir):
+                object_hash, suffix = os.path.splitext(object_name)
+                tree = self.file_handler.read_tree(
+                    self.content_dir, object_hash)
+                if tree is not None:
+                    trees[object_hash] = tree
+                    continue
+                chunk_list = self.file_handler.read_chunk_list(
+                    os.path.join(self.content_dir, object_hash))
+                if chunk_list is not None:
+                    chunk_lists[object_hash] = chunk_list
+                hash = self.file_handler.new_hash(hash_algorithm)
+                for data in self.file_handler.iter_object(os.path.join(self.content_dir, object_hash)):
+                    hash.update(data)
+                hash_map[object_hash] = hash.hexdigest()
+                object_suffixes[object_hash] = suffix
+
+            def remap(files):
+                return {file_path: hash_map.get(file_hash, file_hash) for file_path, file_hash in files.items()}
+
+            # a tree is named by its listing, which names its children,
+            # so trees are rewritten bottom up once their children are
+            tree_listings = {}
+
+            def remap_tree(tree_hash):
+                if tree_hash not in trees:
+                    return tree_hash
+                if tree_hash not in tree_listings:
+                    files, dirs = trees[tree_hash]
+                    listing = self.file_handler.tree_listing(remap(files), {
+                        name: remap_tree(subtree_hash) for name, subtree_hash in dirs.items()})
+                    hash = self.file_handler.new_hash(hash_algorithm)
+                    hash.update(listing)
+                    hash_map[tree_hash] = hash.hexdigest()
+                    tree_listings[tree_hash] = listing
+                return hash_map[tree_hash]
+
+            for tree_hash in trees:
+                remap_tree(tree_hash)
+
+            # new commit objects are written next to the old ones first
+            commit_map = {}
+            old_commits = []
+            for commits_dir in (self.commits_dir, self.rmcommits_dir):
+                for commit_hash in os.listdir(commits_dir):
+                    commit_data = self.file_handler.read_commit(
+                        commits_dir, commit_hash)
+                    commit_data['added'] = remap(commit_data['added'])
+                    if 'tree' in commit_data:
+                        commit_data['tree'] = remap_tree(commit_data['tree'])
+                    else:
+                        commit_data['index'] = remap(commit_data['index'])
+                    new_commit_hash = self.file_handler.compute_MD5_str(
+                        commit_data, hash_algorithm)
+                    self.file_handler.write_commit(
+                        commits_dir, new_commit_hash, commit_data)
+                    commit_map[commit_hash] = new_commit_hash
+                    if new_commit_hash != commit_hash:
+                        old_commits.append(
+                            os.path.join(commits_dir, commit_hash))
+
+            # objects are linked (or copied) under their new names; the old
+            # names go only once the journal below has switched every
+            # reference, so a crash before that leaves the old repository
+            old_objects = []
+            for object_hash, new_object_hash in hash_map.items():
+                if object_hash in trees or new_object_hash == object_hash:
+                    continue
+                suffix = object_suffixes[object_hash]
+                object_path = os.path.join(self.content_dir, object_hash + suffix)
+                old_objects.append(object_path)
+                if object_hash in chunk_lists:
+                    continue
+                new_object_path = os.path.join(
+                    self.content_dir, new_object_hash + suffix)
+                try:
+                    os.link(object_path, new_object_path + '.tmp')
+                except OSError:
+                    shutil.copy(object_path, new_object_path + '.tmp')
+                os.replace(new_object_path + '.tmp', new_object_path)
+
+            # chunk lists name their chunks, write them with the new names
+            for object_hash, chunk_list in chunk_lists.items():
+                object_path = os.path.join(
+                    self.content_dir, hash_map[object_hash])
+                with open(object_path + '.tmp', 'wb') as object_file:
+                    object_file.write(self.file_handler.object_header(
+                        HandleFile.CODEC_CHUNKED))
+                    object_file.write(''.join(
+                        f"{hash_map.get(chunk_hash, chunk_hash)} {size}\n" for chunk_hash, size in chunk_list).encode())
+                os.replace(object_path + '.tmp', object_path)
+
+            for tree_hash, listing in tree_listings.items():
+                object_path = os.path.join(
+                    self.content_dir, hash_map[tree_hash])
+                with open(object_path + '.tmp', 'wb') as object_file:
+                    object_file.write(self.file_handler.object_header(
+                        HandleFile.CODEC_TREE))
+                    object_file.write(zlib.compress(listing))
+                os.replace(object_path + '.tmp', object_path)
+                if hash_map[tree_hash] != tree_hash:
+                    old_objects.append(os.path.join(self.content_dir, tree_hash))
+            self.file_handler.tree_cache.clear()
+            self.file_handler.index_cache = None
+
+            # every reference switches to the new names in one journal
+            journal = self.file_handler.journal()
+            for branch in os.listdir(self.branches_dir):
+                HEAD_path = os.path.join(self.branches_dir, branch, 'HEAD')
+                if not os.path.exists(HEAD_path):
+                    continue
+                lines = self.file_handler.read_all_lines(HEAD_path)
+                journal.write(HEAD_path, ''.join(
+                    commit_map.get(line, line) + '\n' for line in lines).encode())
+
+            if os.path.exists(self.commit_index_file):
+                entries = []
+                with open(self.commit_index_file, 'r') as file:
+                    for line in file:
+                        if line.strip():
+                            entry = json.loads(line)
+                            entry['hash'] = commit_map.get(
+                                entry['hash'], entry['hash'])
+                            if entry.get('parent'):
+                                entry['parent'] = commit_map.get(
+                                    entry['parent'], entry['parent'])
+                            entries.append(entry)
+                journal.write(self.commit_index_file, ''.join(
+                    json.dumps(entry) + '\n' for entry in entries).encode('utf-8'))
+
+            self.file_handler.write_index(
+                self.added_file, remap(self.file_handler.read_index(self.added_file)), journal)
+            self.file_handler.write_index(
+                self.index_file, remap(self.file_handler.read_index(self.index_file)), journal)
+            self.write_format(hash_algorithm, journal=journal)
+            journal.commit()
+
+            # cached digests belong to the old algorithm
+            if os.path.exists(self.stat_cache_file):
+                os.remove(self.stat_cache_file)
+            self.stat_cache.unload()
+
+            for commit_file_path in old_commits:
+                os.remove(commit_file_path)
+            new_objects = {new_object_hash + object_suffixes.get(object_hash, '')
+                           for object_hash, new_object_hash in hash_map.items()}
+            for object_path in old_objects:
+                if os.path.basename(object_path) not in new_objects:
+                    self.file_handler.remove_object_file(object_path)
+        except Exception as e:
+            print(f"Error in migrate: {e}")
+            return
+
+        print(f"Migrated {len(hash_map)} object(s) and {len(commit_map)} commit(s) to {hash_algorithm}.")
+
+    def stored_object_size(self, object_hash):
+        for suffix in ('', HandleFile.RAW_SUFFIX):
+            object_path = os.path.join(self.content_dir, object_hash + suffix)
+            if os.path.exists(object_path):
+                return os.path.getsize(object_path)
+        for kind in PackStore.CONTENT_KINDS:
+            size = self.packs.stored_size(object_hash, kind)
+            if size is not None:
+                return size
+        return None
+
+    def plan_deltas(self, depth):
+        # walk every branch oldest first; a blob's base is the previous
+        # version of the same path, decided before the blob itself
+        bases = {}
+        for branch in sorted(os.listdir(self.branches_dir)):
+            HEAD_path = os.path.join(self.branches_dir, branch, 'HEAD')
+            if not os.path.exists(HEAD_path):
+                continue
+            previous = {}
+            for commit_hash in self.file_handler.read_all_lines(HEAD_path):
+                files = self.file_handler.get_committed_files(
+                    self.commits_dir, commit_hash, 'index')
+                for file_path, file_hash in files.items():
+                    if file_hash not in bases:
+                        bases[file_hash] = previous.get(file_path)
+                previous = files
+
+        # sizes before and after cover only the blobs stored anew, blobs
+        # kept as they are stored do not count towards the ratio
+        replacements = {}
+        depths = {}
+        content_size = 0
+        packed_size = 0
+        for object_hash, base_hash in bases.items():
+            stored_size = self.stored_object_size(object_hash)
+            if stored_size is None:
+                continue
+            if self.file_handler.read_chunk_list(os.path.join(self.content_dir, object_hash)) is not None:
+                # chunked files already share their unchanged chunks
+                continue
+            depths[object_hash] = 0
+            packed_delta = self.packs.contains(
+                object_hash, PackStore.KIND_CONTENT_DELTA) and not self.file_handler.has_loose_object(
+                    os.path.join(self.content_dir, object_hash))
+
+            if base_hash in depths and base_hash != object_hash and depths[base_hash] < depth:
+                base = self.file_handler.read_object(
+                    os.path.join(self.content_dir, base_hash))
+                data = self.file_handler.read_object(
+                    os.path.join(self.content_dir, object_hash))
+                # tiny blobs and versions of very different size are not worth a delta
+                if base is not None and data is not None and len(data) >= self.DELTA_MIN_SIZE and \
+                        len(base) <= len(data) * self.DELTA_SIZE_RATIO and len(data) <= len(base) * self.DELTA_SIZE_RATIO:
+                    payload = self.packs.make_delta(base_hash, base, data)
+                    # an existing delta is measured against the whole blob
+                    if len(payload) < (len(data) if packed_delta else stored_size):
+                        depths[object_hash] = depths[base_hash] + 1
+                        if packed_delta and payload == self.packs.read(
+                                object_hash, PackStore.KIND_CONTENT_DELTA):
+                            continue
+                        replacements[object_hash] = (
+                            PackStore.KIND_CONTENT_DELTA, payload)
+                        content_size += stored_size
+                        packed_size += len(payload)
+                        continue
+
+            if packed_delta:
+                # too deep or no longer worth it, store the whole blob again
+                data = self.file_handler.read_object(
+                    os.path.join(self.content_dir, object_hash))
+                payload = self.file_handler.object_header(
+                    HandleFile.CODEC_ZLIB) + zlib.compress(data)
+                replacements[object_hash] = (PackStore.KIND_CONTENT, payload)
+                content_size += stored_size
+                packed_size += len(payload)
+
+        return replacements, content_size, packed_size
+
+    def pack(self, delta=False, depth=None):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        loose_objects = []
+        for object_name in os.listdir(self.content_dir):
+            object_hash, suffix = os.path.splitext(object_name)
+            if suffix not in ('', HandleFile.RAW_SUFFIX):
+                continue
+            kind = PackStore.KIND_CONTENT_RAW if suffix else PackStore.KIND_CONTENT
+            loose_objects.append(
+                (object_hash, kind, os.path.join(self.content_dir, object_name)))
+        for commit_hash in os.listdir(self.commits_dir):
+            loose_objects.append((commit_hash, PackStore.KIND_COMMIT,
+                                  os.path.join(self.commits_dir, commit_hash)))
+
+        if not delta and not loose_objects and len(self.packs.load()) <= 1:
+            print("Nothing to pack...")
+            return
+
+        try:
+            replacements, content_size, packed_size = self.plan_deltas(
+                self.DELTA_DEPTH if depth is None else depth) if delta else ({}, 0, 0)
+            pack_name, count = self.packs.write_pack(
+                loose_objects, self.file_handler.new_hash(), replacements)
+            # loose copies go only once the new pack and its index are in place
+            for object_hash, kind, object_path in loose_objects:
+                kinds = (kind,) if kind == PackStore.KIND_COMMIT else PackStore.CONTENT_KINDS
+                if any(self.packs.contains(object_hash, packed_kind) for packed_kind in kinds):
+                    self.file_handler.remove_object_file(object_path)
+        except Exception as e:
+            print(f"Error in pack: {e}")
+            return
+
+        print(f"Packed {count} object(s) into {pack_name}.")
+        if delta:
+            deltas = sum(1 for kind, payload in replacements.values()
+                         if kind == PackStore.KIND_CONTENT_DELTA)
+            whole = len(replacements) - deltas
+            if not replacements:
+                print("Every delta is already stored.")
+                return
+            print(f"Stored {deltas} delta(s) and {whole} whole object(s) anew: {content_size} -> "
+                  f"{packed_size} bytes ({content_size / packed_size:.2f}x).")
+
+    def gc(self, expire_days=None):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        expire_days = self.GC_EXPIRE_DAYS if expire_days is None else expire_days
+        cutoff = datetime.now().timestamp() - expire_days * 24 * 60 * 60
+
+        try:
+            # mark: every commit in a branch history, removed commits still
+            # inside the expiry window, and whatever is staged
+            roots = []
+            for branch in sorted(os.listdir(self.branches_dir)):
+                HEAD_path = os.path.join(self.branches_dir, branch, 'HEAD')
+                if os.path.exists(HEAD_path):
+                    roots.extend((self.commits_dir, commit_hash)
+                                 for commit_hash in self.file_handler.read_all_lines(HEAD_path))
+            expired_commits = []
+            for commit_hash in os.listdir(self.rmcommits_dir):
+                if os.path.getmtime(os.path.join(self.rmcommits_dir, commit_hash)) >= cutoff:
+                    roots.append((self.rmcommits_dir, commit_hash))
+                else:
+                    expired_commits.append(commit_hash)
+
+            # a staged hash may never have been written (the add failed or
+            # was undone), there is nothing to keep or warn about for it
+            staged = list(self.file_handler.read_index(self.added_file).values())
+            staged.extend(self.file_handler.read_index(self.index_file).values())
+            pending = [object_hash for object_hash in set(staged)
+                       if self.file_handler.has_object(os.path.join(self.content_dir, object_hash))]
+            reachable_commits = set()
+            for commits_dir, commit_hash in roots:
+                if commit_hash in reachable_commits:
+                    continue
+                reachable_commits.add(commit_hash)
+                commit_data = self.file_handler.read_commit(
+                    commits_dir, commit_hash)
+                if 'tree' in commit_data:
+                    pending.append(commit_data['tree'])
+                else:
+                    pending.extend(commit_data['index'].values())
+                pending.extend(commit_data['added'].values())
+
+            reachable = set()
+            while pending:
+                object_hash = pending.pop()
+                if object_hash in reachable:
+                    continue
+                reachable.add(object_hash)
+                try:
+                    pending.extend(self.file_handler.object_references(
+                        os.path.join(self.content_dir, object_hash)))
+                except FileNotFoundError:
+                    print(f"Warning: object {object_hash} is missing")
+
+            # sweep loose objects and commits, then anything left in packs
+            removed_objects = 0
+            removed_commits = set()
+            freed = 0
+            for object_name in os.listdir(self.content_dir):
+                object_hash, suffix = os.path.splitext(object_name)
+                if suffix in ('', HandleFile.RAW_SUFFIX) and object_hash not in reachable:
+                    object_path = os.path.join(self.content_dir, object_name)
+                    freed += os.path.getsize(object_path)
+                    self.file_handler.remove_object_file(object_path)
+                    removed_objects += 1
+
+            unreachable_commits = [os.path.join(self.rmcommits_dir, commit_hash)
+                                   for commit_hash in expired_commits]
+            unreachable_commits.extend(os.path.join(self.commits_dir, commit_hash)
+                                       for commit_hash in os.listdir(self.commits_dir)
+                                       if commit_hash not in reachable_commits)
+            for commit_file_path in unreachable_commits:
+                freed += os.path.getsize(commit_file_path)
+                os.remove(commit_file_path)
+                removed_commits.add(os.path.basename(commit_file_path))
+
+            digest_size = self.file_handler.new_hash().digest_size
+
+            def keep(key, kind):
+                object_hash = key[:digest_size].hex()
+                if kind == PackStore.KIND_COMMIT:
+                    return object_hash in reachable_commits
+                return object_hash in reachable
+
+            dropped = [(key, kind) for key, kind, pack_path, offset, length in self.packs.iter_packed()
+                       if not keep(key, kind)]
+            if dropped:
+                old_size = sum(os.path.getsize(pack_path) for pack_path, index, count in self.packs.load())
+                pack_name, count = self.packs.write_pack(
+                    [], self.file_handler.new_hash(), keep=keep)
+                freed += old_size - os.path.getsize(
+                    os.path.join(self.pack_dir, pack_name + '.pack'))
+                removed_objects += sum(1 for key, kind in dropped if kind != PackStore.KIND_COMMIT)
+                removed_commits.update(key[:digest_size].hex()
+                                       for key, kind in dropped if kind == PackStore.KIND_COMMIT)
+        except Exception as e:
+            print(f"Error in gc: {e}")
+            return
+
+        print(f"Removed {removed_objects} object(s) and {len(removed_commits)} commit(s), freed {freed} bytes.")
+
+    def read_diff_side(self, path, file_hash, worktree):
+        object_path = os.path.join(self.content_dir, file_hash)
+        if not worktree and not self.file_handler.has_object(object_path):
+            # staged files are stored only at commit, the file may still match
+            if self.file_handler.compute_MD5_file(path) != file_hash:
+                raise FileNotFoundError(
+                    f"staged content {file_hash} is no longer available")
+            worktree = True
+
+        if worktree:
+            with open(path, 'rb') as file:
+                return file.read()
+        return b''.join(self.file_handler.iter_object(object_path))
+
+    def diff(self, commits=None, paths=None, name_status=False, cached=False):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        commits_data = []
+        for commit_hash in commits or []:
+            try:
+                if any(char not in '0123456789abcdef' for char in commit_hash):
+                    raise ValueError(commit_hash)
+                commits_data.append(self.file_handler.read_commit(
+                    self.commits_dir, commit_hash))
+            except (OSError, ValueError):
+                print(f"Invalid commit hash {commit_hash}...")
+                return
+        paths = [os.path.normpath(path) for path in paths or []]
+
+        # two tree commits are compared tree by tree, skipping shared subtrees
+        if len(commits_data) == 2 and all('tree' in commit_data for commit_data in commits_data):
+            changes = self.file_handler.diff_tree_objects(
+                self.content_dir, commits_data[0]['tree'], commits_data[1]['tree'], paths)
+            self.print_diff(changes, name_status, False)
+            return
+
+        trees = [self.file_handler.get_committed_files(self.commits_dir, commit_hash, 'index')
+                 for commit_hash in commits or []]
+
+        # <a> <b>: two commits; --cached: a commit (HEAD) against the
+        # staged index; otherwise a commit (or the index) against the files
+        worktree = False
+        if len(trees) == 2:
+            old_files, new_files = trees
+        elif cached:
+            old_files = trees[0] if trees else self.file_handler.get_head_index(
+                self.branches_dir, self.branch, self.commits_dir)
+            new_files = self.file_handler.read_index(self.index_file)
+        else:
+            old_files = trees[0] if trees else self.file_handler.read_index(self.index_file)
+            scan = self.file_handler.scan_worktree(old_files)
+            # untracked files are not part of a diff
+            new_files = {rel_path: file_hash for rel_path, file_hash in scan['files'].items()
+                         if rel_path in old_files}
+            worktree = True
+            self.stat_cache.save()
+
+        old_files, new_files = old_files or {}, new_files or {}
+        changes = ((status, path, old_files.get(path), new_files.get(path))
+                   for status, path in self.file_handler.diff_trees(old_files, new_files, paths))
+        self.print_diff(changes, name_status, worktree)
+
+    def print_diff(self, changes, name_status, worktree):
+        for status, path, old_hash, new_hash in changes:
+            if name_status:
+                print(f"{status}\t{path}")
+                continue
+
+            try:
+                old_data = self.read_diff_side(
+                    path, old_hash, False) if status != 'A' else b''
+                new_data = self.read_diff_side(
+                    path, new_hash, worktree) if status != 'D' else b''
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+
+            print(f"diff --tico a/{path} b/{path}")
+            if self.file_handler.is_binary(old_data) or self.file_handler.is_binary(new_data):
+                print(f"Binary files a/{path} and b/{path} differ")
+                continue
+            print(f"--- {'a/' + path if status != 'A' else '/dev/null'}")
+            print(f"+++ {'b/' + path if status != 'D' else '/dev/null'}")
+            for line in self.file_handler.unified_diff(
+                    old_data.decode('utf-8', errors='replace').splitlines(keepends=True),
+                    new_data.decode('utf-8', errors='replace').splitlines(keepends=True)):
+                print(line)
+
+    def daemon(self, action):
+        if self.notInitialized('.'):
+            print("'.krups' folder is not initialized...")
+            print("Run: 'tico init' command to initialize tico repository")
+            return
+
+        client = self.file_handler.daemon
+        running = client.request({'op': 'ping'}, timeout=2)
+
+        if action == 'status':
+            if running:
+                print(f"Daemon running (pid {running['pid']}, {running['watches']} watched directories).")
+            else:
+                print("Daemon not running, status scans the working directory.")
+        elif action == 'stop':
+            if not running:
+                print("Daemon not running...")
+                return
+            client.request({'op': 'stop'})
+            print("Daemon stopped.")
+        elif action == 'start':
+            if running:
+                print(f"Daemon already running (pid {running['pid']})...")
+                return
+            if not sys.platform.startswith('linux') or not hasattr(socket, 'AF_UNIX'):
+                print("Error: the daemon needs Linux (inotify and Unix sockets)")
+                return
+
+            command = [sys.executable, '--daemon'] if getattr(sys, 'frozen', False) else [
+                sys.executable, os.path.abspath(__file__), '--daemon']
+            try:
+                with open(self.daemon_log, 'a') as log_file:
+                    subprocess.Popen(command, cwd=os.getcwd(), stdin=subprocess.DEVNULL,
+                                     stdout=log_file, stderr=log_file, start_new_session=True)
+            except Exception as e:
+                print(f"Error starting daemon: {e}")
+                return
+            print("Daemon started, it answers status and commit once its first scan is done.")
+
+    def run_daemon(self):
+        try:
+            StatusDaemon(self.daemon_socket, self.file_handler).serve()
+        except Exception as e:
+            print(f"Error in daemon: {e}")
+
     def user_set(self, newUsername):
         try:
             lines = self.file_handler.read_all_lines(self.users_file)
@@ -983,156 +4169,324 @@ class VersionControlSystem:
         print("tico rmadd <file> - remove a file from the index")
         print("tico rmcommit - remove last commit")
         print("tico log - Display commit log")
+        print("tico log [-n <count>] [--oneline] [--since <date>] [--until <date>] [--author <name>] [--branch <name>] [--stat] - Filter the commit log, newest first")
+        print("tico log --full - Display commit log with the files of every commit")
         print("tico checkout <commit> - Checkout a specific commit")
         print("tico help - to see this usage help")
+        print("tico init --hash <md5/sha256/blake2b> - Initialize with another content hash")
+        print("tico init --chunk-threshold <bytes> - Split files of this size or more into deduplicated chunks (off by default)")
+        print("tico migrate --hash <md5/sha256/blake2b> - Rewrite objects and commits to another content hash")
+        print("tico pack - Move loose objects and commits into a single indexed pack file")
+        print("tico pack --delta [--depth <n>] - Also store file versions as deltas against their previous version")
+        print("tico diff [--name-status] [--cached] [<commit> [<commit>]] [-- <path>...] - Show changes between the index or commits and the working directory")
+        print("tico daemon <start/stop/status> - Watch the working directory with inotify so status and commit skip the scan")
+        print("tico gc [--expire <days>] - Delete objects no branch, staged file or recent removed commit needs (default 14 days)")
         print("tico status - to see status")
+        print("tico <status/add/commit/checkout/push> --jobs <n> - to hash or write files on n threads")
         print("tico user show - to see present user")
         print("tico user set <username> - to change user")
         print("tico user add <username> - to add new user")
         print("tico user remove <username> - to remove user")
         print("tico user change <username> - to change user")
         print("tico push <path> - to push your file to another folder")
+        print("tico <checkout/push> --clone - to reflink or kernel-copy uncompressed files")
+        print("tico push <path> --link - to hardlink uncompressed files into a read-only export")
         print(
             "tico branch <branch_name> - to create a new branch or switch to another branch")
         print("Created by - Krupesh Parmar")
 
 
-vcs = VersionControlSystem('.krups')
-
-
-while True:
-    args = input(
-        "\nEnter command (enter 'exit' to exit the program): ").split()
-    command = args[0]
-
-    if command == "init":
-        if len(args) != 1:
-            print("Usage: init")
-            continue
-
-        if os.path.exists('.krups'):
-            print(f"'.krups' already initialized...")
-            continue
-
-        vcs.init()
-
-    elif command == "status":
-        if len(args) != 1:
-            print("Usage: status")
-            continue
-
-        vcs.status()
-
-    elif command == "add":
-        if len(args) < 2:
-            print("Usage: add <files>")
-            continue
-
-        for arg in args[1:]:
-            vcs.add_with_subdirs(arg)
-
-    elif command == "rmadd":
-        if len(args) < 2:
-            print("Usage: rmadd <files>")
-            continue
-
-        for arg in args[1:]:
-            vcs.rmadd_with_subdirs(arg)
-
-    elif command == "commit":
-        if len(args) == 1:
-            vcs.commit()
-        elif len(args) >= 3 and args[1] == '-m':
-            message = ' '.join(args[2:])[1:-1]
-            vcs.commit(message)
-        else:
-            print("Usage: commit -m \"<message>\"")
-
-    elif command == "rmcommit":
-        if len(args) != 1:
-            print("Usage: rmcommit")
-            continue
-
-        vcs.rmcommit()
-
-    elif command == "checkout":
-        if len(args) < 2:
-            print("Usage: checkout <commit hash>")
-            continue
-
-        hash = args[1]
-        vcs.checkout(hash)
-
-    elif command == "push":
-        if len(args) != 2:
-            print("Usage: push <dir_path>")
-            continue
-
-        vcs.push(args[1])
-
-    elif command == "branch":
-        if len(args) != 2:
-            print("Usage: branch <branch_name>")
-            continue
-
-        vcs.create_branch(args[1])
-
-    elif command == "log":
-        if len(args) != 1:
-            print("Usage: log")
+def pop_jobs_option(command, args):
+    # only commands that hash files take --jobs, and never from a message
+    if command not in ('status', 'add', 'commit', 'checkout', 'push'):
+        return None
+    options = args[:args.index('-m')] if '-m' in args else args
+    for option in ('--jobs', '-j'):
+        if option in options:
+            idx = options.index(option)
+            if idx + 1 >= len(args) or not args[idx + 1].isdigit() or int(args[idx + 1]) < 1:
+                raise ValueError(f"{option} expects a positive number")
+            jobs = int(args[idx + 1])
+            del args[idx:idx + 2]
+            return jobs
+    return None
+
+
+def parse_log_date(value):
+    for date_format in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"invalid date '{value}', use YYYY-MM-DD[THH:MM[:SS]]")
+
+
+def parse_log_options(args):
+    options = {}
+    flags = {'--oneline': 'oneline', '--stat': 'stat', '--full': 'full'}
+    values = {'-n': 'limit', '--limit': 'limit', '--since': 'since',
+              '--until': 'until', '--author': 'author', '--branch': 'branch'}
+
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        if arg in flags:
+            options[flags[arg]] = True
+            idx += 1
             continue
+        if arg not in values or idx + 1 >= len(args):
+            raise ValueError(f"unknown or incomplete option '{arg}'")
+
+        value = args[idx + 1]
+        if values[arg] == 'limit':
+            if not value.isdigit():
+                raise ValueError(f"{arg} expects a number")
+            value = int(value)
+        elif values[arg] in ('since', 'until'):
+            value = parse_log_date(value)
+        options[values[arg]] = value
+        idx += 2
+
+    return options
+
+
+def pop_materialize_option(command, args):
+    # hardlinks share bytes with the object store, so only exports may use them
+    mode = 'copy'
+    if command not in ('checkout', 'push'):
+        return mode
+    if '--clone' in args:
+        args.remove('--clone')
+        mode = 'clone'
+    if '--link' in args and command == 'push':
+        args.remove('--link')
+        mode = 'link'
+    if '--clone' in args or '--link' in args:
+        raise ValueError(
+            "--clone works with checkout and push, --link only with push")
+    return mode
+
+
+def main():
+    vcs = VersionControlSystem('.krups')
+
+    # background worktree watcher, started by the 'daemon start' command
+    if sys.argv[1:] == ['--daemon']:
+        vcs.run_daemon()
+        sys.exit()
 
-        vcs.log()
+    while True:
+        args = input(
+            "\nEnter command (enter 'exit' to exit the program): ").split()
+        command = args[0]
 
-    elif command == "user":
-        if vcs.notInitialized('.'):
-            print("'.krups' folder is not initialized...")
-            print("Run: 'tico init' command to initialize tico repository")
+        try:
+            vcs.file_handler.jobs = pop_jobs_option(
+                command, args) or HandleFile.DEFAULT_JOBS
+            vcs.file_handler.materialize_mode = pop_materialize_option(
+                command, args)
+        except ValueError as e:
+            print(f"Error: {e}")
             continue
 
-        if len(args) < 2:
-            print("Usage: user show")
-            print("Usage: user set <username>")
-            print("Usage: user add <username>")
-            print("Usage: user remove <username>")
-            print("Usage: user change <username>")
-            continue
+        if command == "init":
+            init_options = {}
+            options = {'--hash': 'hash_algorithm',
+                       '--chunk-threshold': 'chunk_threshold'}
+            idx = 1
+            while idx + 1 < len(args) and args[idx] in options:
+                init_options[options[args[idx]]] = args[idx + 1]
+                idx += 2
+            threshold = init_options.get('chunk_threshold', '0')
+            if idx != len(args) or not threshold.isdigit():
+                print("Usage: init [--hash <md5/sha256/blake2b>] [--chunk-threshold <bytes>]")
+                continue
+            if 'chunk_threshold' in init_options:
+                init_options['chunk_threshold'] = int(threshold)
+
+            if os.path.exists('.krups'):
+                print(f"'.krups' already initialized...")
+                continue
+
+            vcs.init(**init_options)
+
+        elif command == "status":
+            if len(args) != 1:
+                print("Usage: status")
+                continue
+
+            vcs.status()
+
+        elif command == "add":
+            if len(args) < 2:
+                print("Usage: add <files>")
+                continue
+
+            for arg in args[1:]:
+                vcs.add_with_subdirs(arg)
+
+        elif command == "rmadd":
+            if len(args) < 2:
+                print("Usage: rmadd <files>")
+                continue
+
+            for arg in args[1:]:
+                vcs.rmadd_with_subdirs(arg)
+
+        elif command == "commit":
+            if len(args) == 1:
+                vcs.commit()
+            elif len(args) >= 3 and args[1] == '-m':
+                message = ' '.join(args[2:])[1:-1]
+                vcs.commit(message)
+            else:
+                print("Usage: commit -m \"<message>\"")
+
+        elif command == "rmcommit":
+            if len(args) != 1:
+                print("Usage: rmcommit")
+                continue
+
+            vcs.rmcommit()
+
+        elif command == "checkout":
+            if len(args) < 2:
+                print("Usage: checkout <commit hash>")
+                continue
+
+            hash = args[1]
+            vcs.checkout(hash)
+
+        elif command == "push":
+            if len(args) != 2:
+                print("Usage: push <dir_path>")
+                continue
+
+            vcs.push(args[1])
+
+        elif command == "branch":
+            if len(args) != 2:
+                print("Usage: branch <branch_name>")
+                continue
+
+            vcs.create_branch(args[1])
+
+        elif command == "log":
+            try:
+                log_options = parse_log_options(args[1:])
+            except ValueError as e:
+                print(f"Error: {e}")
+                print("Usage: log [-n <count>] [--oneline] [--since <date>] [--until <date>] [--author <name>] [--branch <name>] [--stat] [--full]")
+                continue
+
+            vcs.log(**log_options)
+
+        elif command == "migrate":
+            if len(args) != 3 or args[1] != '--hash':
+                print("Usage: migrate --hash <md5/sha256/blake2b>")
+                continue
+
+            vcs.migrate(args[2])
+
+        elif command == "pack":
+            delta = '--delta' in args
+            if delta:
+                args.remove('--delta')
+            depth = None
+            if '--depth' in args:
+                idx = args.index('--depth')
+                if idx + 1 >= len(args) or not args[idx + 1].isdigit():
+                    print("Usage: pack [--delta [--depth <n>]]")
+                    continue
+                depth = int(args[idx + 1])
+                del args[idx:idx + 2]
+            if len(args) != 1:
+                print("Usage: pack [--delta [--depth <n>]]")
+                continue
+
+            vcs.pack(delta, depth)
+
+        elif command == "diff":
+            paths = args[args.index('--') + 1:] if '--' in args else []
+            options = args[1:args.index('--')] if '--' in args else args[1:]
+            name_status = '--name-status' in options
+            cached = '--cached' in options
+            commits = [option for option in options if option not in (
+                '--name-status', '--cached')]
+            if len(commits) > 2 or any(commit.startswith('-') for commit in commits) or (cached and len(commits) > 1):
+                print("Usage: diff [--name-status] [--cached] [<commit> [<commit>]] [-- <path>...]")
+                continue
+
+            vcs.diff(commits, paths, name_status, cached)
+
+        elif command == "daemon":
+            if len(args) != 2 or args[1] not in ('start', 'stop', 'status'):
+                print("Usage: daemon <start/stop/status>")
+                continue
+
+            vcs.daemon(args[1])
+
+        elif command == "gc":
+            if len(args) == 3 and args[1] == '--expire' and args[2].isdigit():
+                vcs.gc(int(args[2]))
+            elif len(args) == 1:
+                vcs.gc()
+            else:
+                print("Usage: gc [--expire <days>]")
+
+        elif command == "user":
+            if vcs.notInitialized('.'):
+                print("'.krups' folder is not initialized...")
+                print("Run: 'tico init' command to initialize tico repository")
+                continue
+
+            if len(args) < 2:
+                print("Usage: user show")
+                print("Usage: user set <username>")
+                print("Usage: user add <username>")
+                print("Usage: user remove <username>")
+                print("Usage: user change <username>")
+                continue
+
+            sub_command = args[1]
+            if sub_command == 'set':
+                vcs.user_set(args[2])
+            elif sub_command == 'show':
+                vcs.user_show()
+            elif sub_command == 'add':
+                vcs.user_add(args[2])
+            elif sub_command == 'remove':
+                vcs.user_remove(args[2])
+            elif sub_command == 'change':
+                vcs.user_change(args[2])
+            else:
+                print("Usage: user show")
+                print("Usage: user set <username>")
+                print("Usage: user add <username>")
+                print("Usage: user remove <username>")
+                print("Usage: user change <username>")
+                continue
+
+        elif command == 'help':
+            if len(args) != 1:
+                print("Usage: help")
+                continue
+
+            vcs.help()
+
+        elif command == 'exit':
+            if len(args) != 1:
+                print("Usage: exit")
+                continue
+
+            print("Exiting...")
+            # vcs.create_branch("main")
+            sys.exit()
 
-        sub_command = args[1]
-        if sub_command == 'set':
-            vcs.user_set(args[2])
-        elif sub_command == 'show':
-            vcs.user_show()
-        elif sub_command == 'add':
-            vcs.user_add(args[2])
-        elif sub_command == 'remove':
-            vcs.user_remove(args[2])
-        elif sub_command == 'change':
-            vcs.user_change(args[2])
         else:
-            print("Usage: user show")
-            print("Usage: user set <username>")
-            print("Usage: user add <username>")
-            print("Usage: user remove <username>")
-            print("Usage: user change <username>")
-            continue
-
-    elif command == 'help':
-        if len(args) != 1:
-            print("Usage: help")
+            print(f"krups: '{command}' is not a valid command. See 'help'")
             continue
 
-        vcs.help()
-
-    elif command == 'exit':
-        if len(args) != 1:
-            print("Usage: exit")
-            continue
-
-        print("Exiting...")
-        # vcs.create_branch("main")
-        sys.exit()
 
-    else:
-        print(f"krups: '{command}' is not a valid command. See 'help'")
-        continue
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# 'add' and 'rmadd' of a directory of N new files, each timed as the whole
+# command less a process that only starts and exits. The staging files are
+# written once per command, so the time per 1000 files should stay flat as
+# N grows.
+#
+#   python bench/bench_add.py [--counts 1000,4000,16000,32000] [--vcs VCS.py]
+import os
+
+from bench_util import (argument_parser, counts, new_repository, print_table, run_vcs,
+                        write_files)
+
+
+def main():
+    parser = argument_parser('Time add and rmadd of a directory of new files.')
+    parser.add_argument('--counts', type=counts, default=[1000, 4000, 16000, 32000])
+    options = parser.parse_args()
+
+    rows = []
+    for count in options.counts:
+        with new_repository(options.vcs) as repo_dir:
+            write_files(os.path.join(repo_dir, 'tree'), count)
+            startup_time, _ = run_vcs(repo_dir, vcs_path=options.vcs)
+            add_time, _ = run_vcs(repo_dir, 'add tree', vcs_path=options.vcs)
+            rmadd_time, _ = run_vcs(repo_dir, 'rmadd tree', vcs_path=options.vcs)
+        add_time -= startup_time
+        rmadd_time -= startup_time
+        rows.append([count, f'{add_time:.2f}s', f'{add_time / count * 1000:.2f}s',
+                     f'{rmadd_time:.2f}s', f'{rmadd_time / count * 1000:.2f}s'])
+    print_table(['files', 'add', 'per 1000', 'rmadd', 'per 1000'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Disk flushes per command. Every metadata write of a command goes through
+# one journal, so 'add', 'commit' and 'rmcommit' should flush the same
+# number of times whether they stage 10 files or thousands. The commands
+# run in a process that counts HandleFile.flush_to_disk calls.
+#
+# Then a journal of N file writes against the same N writes made durable
+# one by one, each through a temp file, fsync and rename.
+#
+#   python bench/bench_flush.py [--counts 10,1000,5000] [--writes 10,100,1000]
+import os
+import re
+import tempfile
+import time
+
+from bench_util import (VCS_DIR, argument_parser, counts, new_repository, print_table,
+                        run_vcs, write_files)
+
+from VCS import HandleFile
+
+DRIVER = f'''
+import atexit
+import sys
+sys.path.insert(0, {VCS_DIR!r})
+import VCS
+
+flushes = [0]
+flush_to_disk = VCS.HandleFile.flush_to_disk
+
+def counting_flush_to_disk(self, *args, **kwargs):
+    flushes[0] += 1
+    return flush_to_disk(self, *args, **kwargs)
+
+VCS.HandleFile.flush_to_disk = counting_flush_to_disk
+atexit.register(lambda: print(f"\\nflushes: {{flushes[0]}}"))
+VCS.main()
+'''
+
+
+def run_counted(repo_dir, command):
+    elapsed, output = run_vcs(repo_dir, command, driver=DRIVER)
+    return int(re.search(r'flushes: (\d+)', output).group(1)), elapsed
+
+
+def write_durably(file_path, data):
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def main():
+    parser = argument_parser('Count disk flushes per command.', vcs=False)
+    parser.add_argument('--counts', type=counts, default=[10, 1000, 5000])
+    parser.add_argument('--writes', type=counts, default=[10, 100, 1000])
+    options = parser.parse_args()
+
+    rows = []
+    for count in options.counts:
+        with new_repository() as repo_dir:
+            write_files(os.path.join(repo_dir, 'tree'), count)
+            row = [count]
+            for command in ('add .', 'commit -m bench', 'rmcommit'):
+                flushes, elapsed = run_counted(repo_dir, command)
+                row += [flushes, f'{elapsed:.2f}s']
+            rows.append(row)
+    print('flushes and wall time per command')
+    print_table(['files', 'add', 'time', 'commit', 'time', 'rmcommit', 'time'], rows)
+
+    file_handler = HandleFile()
+    flush_to_disk = file_handler.flush_to_disk
+    flushes = [0]
+
+    def counting_flush_to_disk(*args, **kwargs):
+        flushes[0] += 1
+        return flush_to_disk(*args, **kwargs)
+    file_handler.flush_to_disk = counting_flush_to_disk
+
+    rows = []
+    for count in options.writes:
+        with tempfile.TemporaryDirectory(prefix='krups-bench-') as temp_dir:
+            file_handler.journal_file = os.path.join(temp_dir, 'journal')
+            paths = [os.path.join(temp_dir, f'file{number}') for number in range(count)]
+
+            flushes[0] = 0
+            start = time.perf_counter()
+            with file_handler.journal() as journal:
+                for file_path in paths:
+                    journal.write(file_path, b'data\n')
+            journal_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for file_path in paths:
+                write_durably(file_path, b'data\n')
+            fsync_time = time.perf_counter() - start
+        rows.append([count, flushes[0], f'{journal_time:.3f}s', count, f'{fsync_time:.3f}s'])
+    print('\nN file writes: one journal against an fsync per file')
+    print_table(['writes', 'flushes', 'journal', 'fsyncs', 'fsync per file'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# 'status' over large untracked files with the stat cache dropped before
+# every run, so each file is hashed, for a range of --jobs values. The files
+# were just written and are read from the page cache: this times hashing,
+# not the disk. Throughput only scales with jobs up to the number of cores.
+#
+#   python bench/bench_hash.py [--files 64] [--size-mib 16] [--jobs 1,2,4,8]
+import os
+
+from bench_util import argument_parser, counts, new_repository, print_table, run_vcs
+
+
+def main():
+    parser = argument_parser('Time status with a cold stat cache for several job counts.')
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--size-mib', type=int, default=16)
+    parser.add_argument('--jobs', type=counts, default=[1, 2, 4, 8])
+    options = parser.parse_args()
+
+    total_mib = options.files * options.size_mib
+    rows = []
+    with new_repository(options.vcs) as repo_dir:
+        for number in range(options.files):
+            with open(os.path.join(repo_dir, f'big{number:03}.bin'), 'wb') as file:
+                for _ in range(options.size_mib):
+                    file.write(os.urandom(1024 * 1024))
+
+        for jobs in options.jobs:
+            for cache_file in ('stat_cache', 'stat_cache.json'):
+                cache_path = os.path.join(repo_dir, '.krups', cache_file)
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+            elapsed, _ = run_vcs(repo_dir, f'status --jobs {jobs}', vcs_path=options.vcs)
+            rows.append([jobs, f'{elapsed:.2f}s', f'{total_mib / elapsed:.0f} MiB/s'])
+
+    print(f'{options.files} files of {options.size_mib} MiB, {os.cpu_count()} CPU(s)')
+    print_table(['jobs', 'status', 'throughput'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Throughput of each content hash on one thread, fed in the 64 KiB reads
+# compute_MD5_file uses. Synthetic buffers of each size by default; --tree
+# hashes the files of a real directory instead, for its own size mix.
+#
+#   python bench/bench_hash_algorithms.py [--sizes 1024,65536,1048576,16777216]
+#   python bench/bench_hash_algorithms.py --tree ~/src/project
+import os
+import time
+
+from bench_util import argument_parser, counts, print_table
+
+from VCS import HandleFile
+
+BUF_SIZE = 65536
+REPEATS = 3
+
+
+def best_time(run):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def hash_buffers(file_handler, algorithm, data, rounds):
+    view = memoryview(data)
+    for _ in range(rounds):
+        digest = file_handler.new_hash(algorithm)
+        for offset in range(0, len(view), BUF_SIZE):
+            digest.update(view[offset:offset + BUF_SIZE])
+        digest.hexdigest()
+
+
+def hash_tree(file_handler, algorithm, file_paths):
+    file_handler.hash_algorithm = algorithm
+    for file_path in file_paths:
+        file_handler.compute_MD5_file(file_path)
+
+
+def main():
+    parser = argument_parser('Compare the content hash algorithms.', vcs=False)
+    parser.add_argument('--sizes', type=counts,
+                        default=[1024, 65536, 1024 * 1024, 16 * 1024 * 1024])
+    parser.add_argument('--tree', help='hash the files under this directory instead')
+    parser.add_argument('--mib', type=int, default=64,
+                        help='MiB hashed per synthetic size and algorithm')
+    options = parser.parse_args()
+    file_handler = HandleFile()
+    algorithms = HandleFile.HASH_ALGORITHMS
+
+    if options.tree:
+        file_paths = [os.path.join(dir_path, file_name)
+                      for dir_path, dir_names, file_names in os.walk(options.tree)
+                      for file_name in file_names
+                      if os.path.isfile(os.path.join(dir_path, file_name))]
+        total = sum(os.path.getsize(file_path) for file_path in file_paths)
+        # one untimed pass so every algorithm reads from the page cache
+        hash_tree(file_handler, 'md5', file_paths)
+        row = [f'{len(file_paths)} files, {total / 2 ** 20:.1f} MiB']
+        for algorithm in algorithms:
+            elapsed = best_time(lambda: hash_tree(file_handler, algorithm, file_paths))
+            row.append(f'{total / 2 ** 20 / elapsed:.0f}')
+        print_table(['tree'] + list(algorithms), [row])
+        return
+
+    rows = []
+    for size in options.sizes:
+        data = os.urandom(size)
+        rounds = max(1, options.mib * 2 ** 20 // size)
+        row = [size]
+        for algorithm in algorithms:
+            elapsed = best_time(lambda: hash_buffers(file_handler, algorithm, data, rounds))
+            row.append(f'{size * rounds / 2 ** 20 / elapsed:.0f}')
+        rows.append(row)
+    print('MiB/s on one thread')
+    print_table(['bytes'] + list(algorithms), rows)
+
+
+if __name__ == '__main__':
+    main()
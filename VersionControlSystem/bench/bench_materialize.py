@@ -0,0 +1,54 @@
+# 'push' into an empty directory and 'checkout' between two commits that
+# differ in every file, for a range of --jobs values. Both write every file
+# of a commit, so they time materialize_files on a tree of N small files.
+#
+#   python bench/bench_materialize.py [--files 100000] [--jobs 1,4,16]
+import os
+import shutil
+
+from bench_util import (argument_parser, counts, new_repository, print_table, run_vcs,
+                        write_files)
+
+
+def main():
+    parser = argument_parser('Time push and checkout of many small files.')
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--jobs', type=counts, default=[1, 4, 16])
+    options = parser.parse_args()
+
+    rows = []
+    with new_repository(options.vcs) as repo_dir:
+        commits = []
+        setup_time = 0
+        for version in ('one', 'two'):
+            # every file of the second commit differs from the first
+            write_files(os.path.join(repo_dir, 'tree'), options.files, prefix=version)
+            elapsed, _ = run_vcs(repo_dir, 'add .', f'commit -m {version}',
+                                 vcs_path=options.vcs)
+            setup_time += elapsed
+            with open(os.path.join(repo_dir, '.krups', 'branches', 'main', 'HEAD')) as file:
+                commits.append(file.read().split()[-1])
+        print(f'{options.files} files, {os.cpu_count()} CPU(s); '
+              f'two add + commit took {setup_time:.1f}s')
+
+        push_dir = repo_dir + '-push'
+        sample_file = os.path.join(repo_dir, 'tree', 'd00000', 'f000000.txt')
+        for jobs in options.jobs:
+            push_time, _ = run_vcs(repo_dir, f'push {push_dir} --jobs {jobs}',
+                                   vcs_path=options.vcs)
+            shutil.rmtree(push_dir)
+            checkout_times = []
+            for version, commit_hash in zip(('one', 'two'), commits):
+                elapsed, _ = run_vcs(repo_dir, f'checkout {commit_hash} --jobs {jobs}',
+                                     vcs_path=options.vcs)
+                with open(sample_file) as file:
+                    if not file.read().startswith(version):
+                        raise RuntimeError(f'checkout {commit_hash} left the old files')
+                checkout_times.append(f'{elapsed:.2f}s')
+            rows.append([jobs, f'{push_time:.2f}s'] + checkout_times)
+
+    print_table(['jobs', 'push', 'checkout one', 'checkout two'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+VCS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VCS_PATH = os.path.join(VCS_DIR, 'VCS.py')
+
+# the benchmarks that time the classes themselves import them from here
+sys.path.insert(0, VCS_DIR)
+
+
+def argument_parser(description, vcs=True):
+    # the benchmarks that run commands can time another VCS.py, e.g. one
+    # from an older commit: 'git show <commit>:VersionControlSystem/VCS.py'
+    parser = argparse.ArgumentParser(description=description)
+    if vcs:
+        parser.add_argument('--vcs', default=VCS_PATH,
+                            help='the VCS.py to benchmark (default: this tree\'s)')
+    return parser
+
+
+def counts(value):
+    return [int(count) for count in value.split(',')]
+
+
+def run_vcs(repo_dir, *commands, vcs_path=VCS_PATH, driver=None):
+    # (seconds, output) of one VCS.py process running the commands, the
+    # interpreter start included like a user would see it
+    program = ['-c', driver] if driver else [vcs_path]
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + program, cwd=repo_dir,
+                            input='\n'.join(commands + ('exit',)) + '\n',
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - start
+    if 'Traceback' in result.stdout or 'Error' in result.stdout:
+        raise RuntimeError(f"{' / '.join(commands)} failed:\n{result.stdout}")
+    return elapsed, result.stdout
+
+
+def new_repository(vcs_path=VCS_PATH):
+    # a TemporaryDirectory holding an initialized repository
+    temp_dir = tempfile.TemporaryDirectory(prefix='krups-bench-')
+    run_vcs(temp_dir.name, 'init', 'bench', vcs_path=vcs_path)
+    return temp_dir
+
+
+def write_files(root, count, per_dir=100, size=64, prefix=''):
+    # count small files, per_dir to a directory, each with distinct content
+    for number in range(count):
+        dir_path = os.path.join(root, f'd{number // per_dir:05}')
+        if number % per_dir == 0:
+            os.makedirs(dir_path, exist_ok=True)
+        line = f'{prefix}file {number}\n'.encode()
+        with open(os.path.join(dir_path, f'f{number:06}.txt'), 'wb') as file:
+            file.write((line * (size // len(line) + 1))[:size])
+
+
+def print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
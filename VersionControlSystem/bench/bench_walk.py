@@ -0,0 +1,161 @@
+# Walking a tree of N files: os.walk with relpath and lstat per file, the
+# way the walks were written before, against HandleFile.walk_worktree with
+# the DirEntry's stat, and a full status scan against a warm stat cache.
+#
+# Besides the wall time it counts the directory listings and stats made
+# through the os module: os.scandir/os.listdir, os.stat/os.lstat and the
+# first DirEntry.stat of each entry, which is one syscall each on Linux.
+# The getdents batches of a listing are not counted; strace -c counts
+# those where it is installed.
+#
+#   python bench/bench_walk.py [--files 200000] [--dirs 2000]
+import collections
+import os
+import tempfile
+import time
+
+from bench_util import argument_parser, print_table, write_files
+
+from VCS import HandleFile, StatCache
+
+REPEATS = 3
+
+
+class CountingEntry:
+    def __init__(self, dir_entry, counts):
+        self.dir_entry = dir_entry
+        self.counts = counts
+        self.stated = set()
+
+    def __getattr__(self, name):
+        return getattr(self.dir_entry, name)
+
+    def __fspath__(self):
+        return self.dir_entry.path
+
+    def stat(self, *, follow_symlinks=True):
+        # a DirEntry stats once and keeps the result
+        if follow_symlinks not in self.stated:
+            self.stated.add(follow_symlinks)
+            self.counts['stat'] += 1
+        return self.dir_entry.stat(follow_symlinks=follow_symlinks)
+
+
+class CountingScandir:
+    def __init__(self, scanner, counts):
+        self.scanner = scanner
+        self.counts = counts
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return CountingEntry(next(self.scanner), self.counts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.scanner.close()
+
+    def close(self):
+        self.scanner.close()
+
+
+class CallCounter:
+    # the os functions are swapped for counting ones while in the with block
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.originals = {}
+
+    def counting(self, name, kind):
+        original = self.originals[name] = getattr(os, name)
+
+        def call(*args, **kwargs):
+            self.counts[kind] += 1
+            result = original(*args, **kwargs)
+            return CountingScandir(result, self.counts) if name == 'scandir' else result
+        return call
+
+    def __enter__(self):
+        for name, kind in (('scandir', 'listing'), ('listdir', 'listing'),
+                           ('stat', 'stat'), ('lstat', 'stat')):
+            setattr(os, name, self.counting(name, kind))
+        return self.counts
+
+    def __exit__(self, *exc_info):
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+
+
+def old_walk(root):
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name not in HandleFile.IGNORED_DIRS]
+        for file_name in file_names:
+            if file_name in HandleFile.IGNORED_FILES:
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            files.append((file_path, os.path.relpath(file_path, root), os.lstat(file_path)))
+    return files
+
+
+def new_walk(root):
+    return [(file_path, rel_path, dir_entry.stat())
+            for file_path, rel_path, dir_entry in HandleFile().walk_worktree(root=root)]
+
+
+def warm_scan(cache_file):
+    file_handler = HandleFile(StatCache(cache_file))
+    return file_handler.scan_worktree()['files']
+
+
+def measure(run, expected):
+    run()
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        count = len(run())
+        times.append(time.perf_counter() - start)
+        if count != expected:
+            raise RuntimeError(f'walked {count} files, expected {expected}')
+    with CallCounter() as counts:
+        run()
+    return [f'{min(times):.2f}s', counts['listing'], counts['stat']]
+
+
+def main():
+    parser = argument_parser('Compare the worktree walks.', vcs=False)
+    parser.add_argument('--files', type=int, default=200000)
+    parser.add_argument('--dirs', type=int, default=2000)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='krups-bench-') as temp_dir:
+        root = os.path.join(temp_dir, 'tree')
+        write_files(root, options.files, per_dir=-(-options.files // options.dirs), size=0)
+        # the scan walks the current directory, like every command does
+        cwd = os.getcwd()
+        os.chdir(root)
+        cache_file = os.path.join(temp_dir, 'stat_cache')
+        stat_cache = StatCache(cache_file)
+        HandleFile(stat_cache).scan_worktree()
+        stat_cache.save()
+        # files written in the cache's own second are hashed again (racy),
+        # so the cache is dated a little later than the files
+        later = time.time_ns() + 2 * 10 ** 9
+        os.utime(cache_file, ns=(later, later))
+
+        rows = [
+            ['os.walk + relpath + lstat'] + measure(lambda: old_walk(root), options.files),
+            ['walk_worktree + DirEntry.stat'] + measure(lambda: new_walk(root), options.files),
+            ['scan_worktree, warm stat cache'] + measure(
+                lambda: warm_scan(cache_file), options.files),
+        ]
+        os.chdir(cwd)
+
+    print(f'{options.files} files in {options.dirs} directories, best of {REPEATS}')
+    print_table(['', 'time', 'listings', 'stats'], rows)
+
+
+if __name__ == '__main__':
+    main()
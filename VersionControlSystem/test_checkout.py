@@ -0,0 +1,94 @@
+import os
+import shutil
+import unittest
+
+from vcs_testing import RepositoryTestCase
+
+
+class CheckoutTest(RepositoryTestCase):
+    # checkout rewrites only the paths that differ from the target commit
+
+    def setUp(self):
+        super().setUp()
+        self.write_file('keep.txt', 'keep\n')
+        self.write_file('x/y', 'nested\n')
+        self.dir_commit = self.commit('dir')
+
+        # deletions are not staged by add, x/y leaves the index by rmadd
+        self.run_vcs('rmadd x')
+        shutil.rmtree(self.path('x'))
+        self.write_file('x', 'flat\n')
+        self.file_commit = self.commit('file')
+
+    def test_directory_becomes_file(self):
+        os.remove(self.path('x'))
+        self.write_file('x/y', 'nested\n')
+
+        self.run_vcs(f'checkout {self.file_commit}')
+        self.assertEqual(self.read_file('x'), b'flat\n')
+        self.assertEqual(self.read_file('keep.txt'), b'keep\n')
+
+    def test_file_becomes_directory(self):
+        self.run_vcs(f'checkout {self.dir_commit}')
+        self.assertEqual(self.read_file('x/y'), b'nested\n')
+        self.assertEqual(self.read_file('keep.txt'), b'keep\n')
+
+    def test_unreadable_commit_leaves_worktree(self):
+        # a commit whose tree cannot be read is not an empty commit
+        content_dir = self.path('.krups/objects/content')
+        for object_name in os.listdir(content_dir):
+            object_path = os.path.join(content_dir, object_name)
+            os.chmod(object_path, 0o644)
+            with open(object_path, 'w') as file:
+                file.write('garbage')
+
+        output = self.run_vcs(f'checkout {self.dir_commit}')
+        self.assertIn('Error reading commit', output)
+        self.assertEqual(self.read_file('x'), b'flat\n')
+        self.assertEqual(self.read_file('keep.txt'), b'keep\n')
+
+
+class CommitMembershipTest(RepositoryTestCase):
+    # only commits listed in the current branch's HEAD can be checked out
+
+    def setUp(self):
+        super().setUp()
+        self.commits = []
+        for version in range(3):
+            self.write_file('a.txt', f'v{version}\n')
+            self.commits.append(self.commit(f'v{version}'))
+
+    def test_any_commit_of_the_branch(self):
+        for version, commit_hash in enumerate(self.commits):
+            self.run_vcs(f'checkout {commit_hash}')
+            self.assertEqual(self.read_file('a.txt'), f'v{version}\n'.encode())
+
+    def test_stored_commit_missing_from_head(self):
+        # as a crash between writing the commit and appending it to HEAD leaves it
+        self.write_file('.krups/branches/main/HEAD', ''.join(
+            commit_hash + '\n' for commit_hash in self.commits[:-1]))
+
+        output = self.run_vcs(f'checkout {self.commits[-1]}')
+        self.assertIn('Invalid commit hash', output)
+        self.assertEqual(self.read_file('a.txt'), b'v2\n')
+        self.run_vcs(f'checkout {self.commits[0]}')
+        self.assertEqual(self.read_file('a.txt'), b'v0\n')
+
+    def test_unknown_hashes(self):
+        for commit_hash in ('0' * 32, self.commits[0][:8], '../../etc/passwd', 'ZZ'):
+            with self.subTest(commit_hash):
+                self.assertIn('Invalid commit hash', self.run_vcs(f'checkout {commit_hash}'))
+        self.assertEqual(self.read_file('a.txt'), b'v2\n')
+
+    def test_removed_commit(self):
+        self.run_vcs('rmcommit')
+        self.assertIn('Invalid commit hash', self.run_vcs(f'checkout {self.commits[-1]}'))
+
+    def test_commit_of_another_branch(self):
+        # the current branch lasts for one session
+        output = self.run_vcs('branch feature', f'checkout {self.commits[0]}')
+        self.assertIn('Invalid commit hash', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
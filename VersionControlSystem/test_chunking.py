@@ -0,0 +1,37 @@
+import os
+import unittest
+
+from vcs_testing import RepositoryTestCase
+
+
+class ChunkingTest(RepositoryTestCase):
+    # files at or above the threshold are stored as content-defined chunks
+    init_commands = ('init --chunk-threshold 100000', 'tester')
+
+    def assert_round_trip(self, files):
+        for rel_path, data in files.items():
+            self.write_file(rel_path, data)
+        commit_hash = self.commit()
+
+        for rel_path in files:
+            os.remove(self.path(rel_path))
+        self.run_vcs(f'checkout {commit_hash}')
+
+        for rel_path, data in files.items():
+            self.assertEqual(self.read_file(rel_path), data)
+
+    def test_single_chunk_files(self):
+        # shorter than the smallest chunk, so each file is one chunk whose
+        # hash is the file's own, stored raw and compressed
+        self.assert_round_trip({
+            'random.bin': os.urandom(200 * 1024),
+            'text.txt': b'a line of text\n' * 14000,
+        })
+
+    def test_multi_chunk_file(self):
+        # longer than the largest chunk, so there are at least two
+        self.assert_round_trip({'big.bin': os.urandom(5 * 1024 * 1024)})
+
+
+if __name__ == '__main__':
+    unittest.main()
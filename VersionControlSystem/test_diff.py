@@ -0,0 +1,170 @@
+import random
+import unittest
+
+from VCS import HandleFile
+from vcs_testing import RepositoryTestCase
+
+
+def numbered_lines(count):
+    return [f'l{number}\n' for number in range(count)]
+
+
+def longest_common_subsequence(a, b):
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            lengths[i][j] = (lengths[i + 1][j + 1] + 1 if a[i] == b[j]
+                             else max(lengths[i + 1][j], lengths[i][j + 1]))
+    return lengths[0][0]
+
+
+def apply_hunks(a, diff_lines):
+    # the unified diff applied to a, the way patch would
+    result = []
+    position = 0
+    for line in diff_lines:
+        if line.startswith('@@'):
+            old_start, old_count = line.split()[1][1:].split(',')
+            start = int(old_start) - 1 if int(old_count) else int(old_start)
+            result += a[position:start]
+            position = start
+        elif line.startswith('\\'):
+            result[-1] = result[-1].rstrip('\n')
+        elif line.startswith(' '):
+            result.append(a[position])
+            position += 1
+        elif line.startswith('-'):
+            position += 1
+        else:
+            result.append(line[1:] + '\n')
+    return result + a[position:]
+
+
+class DiffLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file_handler = HandleFile()
+
+    def assert_opcodes(self, a, b, opcodes):
+        # the opcodes cover a and b end to end and turn one into the other
+        result = []
+        i = j = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i1, j1), (i, j))
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+            result += b[j1:j2] if tag == 'insert' else a[i1:i2] if tag == 'equal' else []
+            i, j = i2, j2
+        self.assertEqual((i, j), (len(a), len(b)))
+        self.assertEqual(result, b)
+
+    def test_empty_sides(self):
+        self.assertEqual(self.file_handler.diff_lines([], []), [])
+        self.assertEqual(self.file_handler.diff_lines([], ['x']), [('insert', 0, 0, 0, 1)])
+        self.assertEqual(self.file_handler.diff_lines(['x'], []), [('delete', 0, 1, 0, 0)])
+        self.assertEqual(self.file_handler.diff_lines(['x'], ['x']), [('equal', 0, 1, 0, 1)])
+
+    def test_edits_are_minimal(self):
+        rng = random.Random(3)
+        for case in range(300):
+            a = [rng.choice('abc') for _ in range(rng.randrange(12))]
+            b = [rng.choice('abc') for _ in range(rng.randrange(12))]
+            with self.subTest(a=''.join(a), b=''.join(b)):
+                opcodes = self.file_handler.diff_lines(a, b)
+                self.assert_opcodes(a, b, opcodes)
+                changed = sum(i2 - i1 + j2 - j1 for tag, i1, i2, j1, j2 in opcodes
+                              if tag != 'equal')
+                self.assertEqual(changed, len(a) + len(b) - 2 * longest_common_subsequence(a, b))
+
+    def test_too_many_edits_replace_the_middle(self):
+        self.file_handler.DIFF_MAX_EDITS = 3
+        a = ['head'] + list('abcdef') + ['tail']
+        b = ['head'] + list('fedcba') + ['tail']
+        opcodes = self.file_handler.diff_lines(a, b)
+        self.assertEqual(opcodes, [('equal', 0, 1, 0, 1), ('delete', 1, 7, 1, 1),
+                                   ('insert', 7, 7, 1, 7), ('equal', 7, 8, 7, 8)])
+        self.assert_opcodes(a, b, opcodes)
+
+
+class UnifiedDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file_handler = HandleFile()
+
+    def diff(self, a, b, context=3):
+        return list(self.file_handler.unified_diff(a, b, context))
+
+    def test_empty_files(self):
+        self.assertEqual(self.diff([], []), [])
+        self.assertEqual(self.diff([], ['x\n', 'y\n']), ['@@ -0,0 +1,2 @@', '+x', '+y'])
+        self.assertEqual(self.diff(['x\n', 'y\n'], []), ['@@ -1,2 +0,0 @@', '-x', '-y'])
+
+    def test_identical_files(self):
+        self.assertEqual(self.diff(numbered_lines(10), numbered_lines(10)), [])
+
+    def test_no_trailing_newline(self):
+        self.assertEqual(self.diff(['a\n', 'b'], ['a\n', 'b\n']),
+                         ['@@ -1,2 +1,2 @@', ' a', '-b', '\\ No newline at end of file', '+b'])
+        self.assertEqual(self.diff(['a\n', 'b\n'], ['a\n', 'b']),
+                         ['@@ -1,2 +1,2 @@', ' a', '-b', '+b', '\\ No newline at end of file'])
+        # as an unchanged context line
+        self.assertEqual(self.diff(['a\n', 'b'], ['x\n', 'b']),
+                         ['@@ -1,2 +1,2 @@', '-a', '+x', ' b', '\\ No newline at end of file'])
+        self.assertEqual(self.diff(['a\r\n', 'b'], ['a\r\n', 'c']),
+                         ['@@ -1,2 +1,2 @@', ' a', '-b', '\\ No newline at end of file',
+                          '+c', '\\ No newline at end of file'])
+
+    def test_close_changes_share_a_hunk(self):
+        a = numbered_lines(20)
+        b = list(a)
+        b[2], b[9] = 'x\n', 'y\n'
+        # six equal lines between them, two contexts' worth
+        self.assertEqual(self.diff(a, b), [
+            '@@ -1,13 +1,13 @@', ' l0', ' l1', '-l2', '+x', ' l3', ' l4', ' l5', ' l6',
+            ' l7', ' l8', '-l9', '+y', ' l10', ' l11', ' l12'])
+
+    def test_distant_changes_get_their_own_hunks(self):
+        a = numbered_lines(20)
+        b = list(a)
+        b[2], b[10] = 'x\n', 'y\n'
+        self.assertEqual(self.diff(a, b), [
+            '@@ -1,6 +1,6 @@', ' l0', ' l1', '-l2', '+x', ' l3', ' l4', ' l5',
+            '@@ -8,7 +8,7 @@', ' l7', ' l8', ' l9', '-l10', '+y', ' l11', ' l12', ' l13'])
+
+    def test_headers_without_context(self):
+        a = ['a\n', 'b\n']
+        # an empty side starts at the line before the change
+        self.assertEqual(self.diff(a, ['a\n', 'x\n', 'b\n'], 0), ['@@ -1,0 +2,1 @@', '+x'])
+        self.assertEqual(self.diff(a, ['b\n'], 0), ['@@ -1,1 +0,0 @@', '-a'])
+
+    def test_hunks_apply(self):
+        rng = random.Random(4)
+        for case in range(200):
+            a = [f'{rng.randrange(6)}\n' for _ in range(rng.randrange(40))]
+            b = list(a)
+            for _ in range(rng.randrange(6)):
+                position = rng.randrange(len(b) + 1)
+                if rng.random() < 0.5 and position < len(b):
+                    del b[position]
+                else:
+                    b.insert(position, f'{rng.randrange(6)}\n')
+            if b and rng.random() < 0.3:
+                b[-1] = b[-1].rstrip('\n')
+            context = rng.choice((0, 1, 3))
+            with self.subTest(case=case, context=context):
+                self.assertEqual(apply_hunks(a, self.diff(a, b, context)), b)
+
+
+class DiffCommandTest(RepositoryTestCase):
+
+    def test_missing_final_newline_is_shown(self):
+        self.write_file('a.txt', 'one\ntwo\n')
+        self.commit()
+        self.write_file('a.txt', 'one\ntwo')
+        output = self.run_vcs('diff')
+        self.assertIn('@@ -1,2 +1,2 @@\n one\n-two\n+two\n\\ No newline at end of file\n',
+                      output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+
+from VCS import IgnoreRules
+
+
+class IgnoreRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, rel_path):
+        return os.path.join(self.root, *rel_path.split('/'))
+
+    def write_rules(self, lines, rel_dir=''):
+        dir_path = self.path(rel_dir) if rel_dir else self.root
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, IgnoreRules.FILE_NAME), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def rules(self):
+        return IgnoreRules(self.root, {})
+
+    def assert_ignored(self, rules, ignored, kept, is_dir=False):
+        for rel_path in ignored:
+            with self.subTest(ignored=rel_path):
+                self.assertTrue(rules.is_ignored_path(os.path.join(*rel_path.split('/')), is_dir))
+        for rel_path in kept:
+            with self.subTest(kept=rel_path):
+                self.assertFalse(rules.is_ignored_path(os.path.join(*rel_path.split('/')), is_dir))
+
+    def test_built_in_names(self):
+        self.assert_ignored(self.rules(), ['VCS.py', 'sub/.gitignore'], ['vcs.py', 'sub/VCS.py.bak'])
+        self.assert_ignored(self.rules(), ['.krups', 'sub/__pycache__', '.git'], ['krups'],
+                            is_dir=True)
+
+    def test_wildcards(self):
+        self.write_rules(['# a comment', '', '*.log  ', 'cache?.bin', 'img[0-9].png',
+                          'tmp[!a-z].txt', '\\#hash', '**/deep/*.o', 'a/**/z.txt'])
+        self.assert_ignored(
+            self.rules(),
+            ['x.log', 'sub/x.log', 'cache1.bin', 'img7.png', 'tmp1.txt', '#hash',
+             'deep/x.o', 'sub/deep/x.o', 'a/z.txt', 'a/b/c/z.txt'],
+            ['x.log.txt', 'cache12.bin', 'imgx.png', 'tmpa.txt', '# a comment',
+             'deep/sub/x.o', 'b/a/z.txt'])
+
+    def test_anchored_patterns(self):
+        # a '/' anywhere but at the end ties the pattern to its file's directory
+        self.write_rules(['/build', 'doc/*.txt'])
+        self.write_rules(['/local.cfg'], 'sub')
+        self.assert_ignored(self.rules(), ['build', 'doc/a.txt', 'sub/local.cfg'],
+                            ['src/build', 'doc/sub/a.txt', 'sub/doc/a.txt', 'local.cfg',
+                             'sub/deeper/local.cfg'])
+
+    def test_unanchored_pattern_matches_at_any_depth(self):
+        self.write_rules(['build'])
+        self.assert_ignored(self.rules(), ['build', 'src/build', 'a/b/build'], ['builder'])
+
+    def test_directory_only_patterns(self):
+        self.write_rules(['tmp/', 'out/'])
+        rules = self.rules()
+        self.assert_ignored(rules, ['tmp', 'sub/tmp', 'out'], [], is_dir=True)
+        # files of the same name are kept, files inside are not
+        self.assert_ignored(rules, ['tmp/a.txt', 'sub/out/b.txt'], ['tmp', 'sub/out'])
+
+    def test_negation(self):
+        self.write_rules(['*.log', '!keep.log'])
+        self.assert_ignored(self.rules(), ['a.log', 'sub/b.log'], ['keep.log', 'sub/keep.log'])
+
+    def test_last_matching_line_wins(self):
+        # the alternation is built in reverse, so its first match is the last line
+        self.write_rules(['!keep.log', '*.log'])
+        self.assert_ignored(self.rules(), ['a.log', 'keep.log'], [])
+
+        self.write_rules(['*.txt', '!*.txt', 'x*.txt'])
+        self.assert_ignored(self.rules(), ['x1.txt'], ['a.txt'])
+
+    def test_many_alternatives(self):
+        # every alternative keeps its own negation flag through the group numbers
+        lines = []
+        for number in range(200):
+            lines.append(f'f{number}.txt' if number % 2 else f'!f{number}.txt')
+        lines += ['*.dat', '!*7.dat']
+        self.write_rules(['*.txt'] + lines)
+        rules = self.rules()
+        self.assert_ignored(rules, [f'f{number}.txt' for number in range(1, 200, 2)] + ['a.txt'],
+                            [f'f{number}.txt' for number in range(0, 200, 2)])
+        self.assert_ignored(rules, ['6.dat', 'x.dat'], ['7.dat', 'x17.dat'])
+
+    def test_directory_rules_do_not_shift_file_negations(self):
+        # file paths skip the dir-only lines, the negation flags must follow
+        self.write_rules(['*.txt', 'build/', '!keep.txt', 'cache/', '!also.txt'])
+        rules = self.rules()
+        self.assert_ignored(rules, ['a.txt'], ['keep.txt', 'also.txt'])
+        self.assert_ignored(rules, ['build', 'cache', 'b.txt'], ['keep.txt'], is_dir=True)
+
+    def test_deeper_file_wins(self):
+        self.write_rules(['*.log'])
+        self.write_rules(['!*.log'], 'sub')
+        self.write_rules(['debug.log'], 'sub/deeper')
+        self.assert_ignored(self.rules(), ['a.log', 'other/a.log', 'sub/deeper/debug.log'],
+                            ['sub/a.log', 'sub/deeper/a.log'])
+
+    def test_no_reinclusion_inside_an_ignored_directory(self):
+        self.write_rules(['tmp/', '!tmp/keep.txt'])
+        self.write_rules(['!*.txt'], 'tmp')
+        self.assert_ignored(self.rules(), ['tmp/keep.txt', 'tmp/other.txt'], [])
+
+    def test_walk_prunes_ignored_directories(self):
+        self.write_rules(['build/', '*.log', '!keep.log'])
+        for rel_path in ('a.txt', 'a.log', 'keep.log', 'build/out.bin', 'src/b.txt',
+                         'src/b.log', 'src/build/x', '.krups/objects/o'):
+            os.makedirs(os.path.dirname(self.path(rel_path)), exist_ok=True)
+            with open(self.path(rel_path), 'w') as file:
+                file.write(rel_path)
+
+        listed = []
+        rules = self.rules()
+        walked = sorted(rel_path for file_path, rel_path, dir_entry in rules.walk(
+            on_dir=lambda rel_dir, dir_path: listed.append(rel_dir)))
+        self.assertEqual(walked, sorted([IgnoreRules.FILE_NAME, 'a.txt', 'keep.log',
+                                         os.path.join('src', 'b.txt')]))
+        self.assertEqual(sorted(listed), ['', 'src'])
+
+    def test_changed_rules_are_reloaded(self):
+        cache = {}
+        self.write_rules(['*.log'])
+        self.assertTrue(IgnoreRules(self.root, cache).is_ignored('a.log', False))
+        self.write_rules(['*.tmp', '# longer, so the size changes'])
+        rules = IgnoreRules(self.root, cache)
+        self.assertFalse(rules.is_ignored('a.log', False))
+        self.assertTrue(rules.is_ignored('a.tmp', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
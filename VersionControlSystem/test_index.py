@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+from VCS import HandleFile, IndexFile
+from vcs_testing import RepositoryTestCase
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class IndexFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_file = os.path.join(self.temp_dir.name, 'index')
+        self.file_handler = HandleFile()
+        self.files = {
+            'top.txt': md5(b'top'),
+            os.path.join('d', 'b.txt'): md5(b'b'),
+            os.path.join('d', 'a.txt'): md5(b'a'),
+            os.path.join('d', 'e', 'deep.txt'): md5(b'deep'),
+            os.path.join('dd', 'x'): md5(b'x'),
+            'd-sibling': md5(b'sibling'),
+            'unicodé ✓.txt': md5(b'unicode'),
+            'unhashable.bin': None,
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        self.file_handler.write_index(self.index_file, self.files)
+        index = IndexFile(self.index_file)
+
+        self.assertEqual(dict(index.items()), self.files)
+        self.assertEqual(len(index), len(self.files))
+        for path, file_hash in self.files.items():
+            self.assertIn(path, index)
+            self.assertEqual(index[path], file_hash)
+        for path in ('d', os.path.join('d', 'c.txt'), 'zzz', '', os.path.join('e', 'deep.txt')):
+            self.assertNotIn(path, index)
+            self.assertIsNone(index.get(path))
+
+    def test_empty_index(self):
+        self.file_handler.write_index(self.index_file, {})
+        index = IndexFile(self.index_file)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(dict(index.items()), {})
+        self.assertNotIn('a.txt', index)
+
+    def test_update_index(self):
+        self.file_handler.write_index(self.index_file, self.files)
+        updates = {os.path.join('d', 'a.txt'): md5(b'a2'), os.path.join('new', 'n.txt'): md5(b'n')}
+        removals = [os.path.join('d', 'e', 'deep.txt'), 'top.txt']
+        self.file_handler.update_index(
+            self.index_file, IndexFile(self.index_file), updates, removals)
+
+        expected = dict(self.files, **updates)
+        for path in removals:
+            expected.pop(path)
+        self.assertEqual(dict(IndexFile(self.index_file).items()), expected)
+
+    def test_corrupt_index_is_rejected(self):
+        self.file_handler.write_index(self.index_file, self.files)
+        with open(self.index_file, 'rb') as file:
+            data = bytearray(file.read())
+
+        flipped = bytearray(data)
+        flipped[len(data) // 2] ^= 0xFF
+        for name, broken in (('flipped', flipped), ('truncated', data[:len(data) - 1]),
+                             ('header only', data[:IndexFile.HEADER.size])):
+            with self.subTest(name):
+                with open(self.index_file, 'wb') as file:
+                    file.write(broken)
+                with self.assertRaises(ValueError):
+                    IndexFile(self.index_file)
+
+    def test_legacy_json_index_is_converted(self):
+        with open(self.index_file + '.json', 'w') as file:
+            json.dump(self.files, file, indent=4)
+
+        index = self.file_handler.read_index(self.index_file)
+        self.assertEqual(dict(index.items()), self.files)
+        self.assertTrue(os.path.exists(self.index_file))
+        self.assertFalse(os.path.exists(self.index_file + '.json'))
+
+
+class LegacyRepositoryTest(RepositoryTestCase):
+    # a repository written by the first version: JSON staging files,
+    # base64 objects and base64 JSON commits that embed the whole index
+    init_commands = ()
+
+    def write_legacy_commit(self, message, added, index):
+        commit_data = {"message": message, "timestamp": "01/01/2024 10:00:00.",
+                       "added": added, "index": index, "branch": "main", "author": "tester"}
+        commit_hash = md5(json.dumps(commit_data).encode())
+        self.write_file(f'.krups/objects/commits/{commit_hash}',
+                        base64.b64encode(json.dumps(commit_data).encode()).decode())
+        return commit_hash
+
+    def setUp(self):
+        super().setUp()
+        contents = {'a.txt': b'a\n', 'd/b.txt': b'b\n', 'a2': b'a2\n'}
+        hashes = {name: md5(data) for name, data in contents.items()}
+        for data in contents.values():
+            self.write_file(f'.krups/objects/content/{md5(data)}',
+                            base64.b64encode(data).decode())
+        os.makedirs(self.path('.krups/objects/rmcommits'))
+        self.write_file('.krups/users.txt', '2024-01-01 10:00:00 tester\n')
+
+        first_index = {'a.txt': hashes['a.txt'], os.path.join('d', 'b.txt'): hashes['d/b.txt']}
+        second_index = dict(first_index, **{'a.txt': hashes['a2']})
+        self.first_commit = self.write_legacy_commit('one', first_index, first_index)
+        self.second_commit = self.write_legacy_commit(
+            'two', {'a.txt': hashes['a2']}, second_index)
+        self.write_file('.krups/branches/main/HEAD',
+                        f'{self.first_commit}\n{self.second_commit}\n')
+        self.write_file('.krups/index.json', json.dumps(second_index, indent=4))
+        self.write_file('.krups/added.json', '{}')
+
+        self.write_file('a.txt', b'a2\n')
+        self.write_file('d/b.txt', b'b\n')
+
+    def test_upgrade(self):
+        output = self.run_vcs('status')
+        self.assertNotIn('Error', output)
+        self.assertNotIn('Untracked', output)
+
+        self.run_vcs(f'checkout {self.first_commit}')
+        self.assertEqual(self.read_file('a.txt'), b'a\n')
+        self.run_vcs(f'checkout {self.second_commit}')
+        self.assertEqual(self.read_file('a.txt'), b'a2\n')
+
+        # new commits are written as trees on top of the legacy history
+        self.write_file('c.txt', b'c\n')
+        third_commit = self.commit('three')
+        self.assertEqual(self.head_commits(), [self.first_commit, self.second_commit, third_commit])
+        self.assertIn('two', self.run_vcs('log'))
+        # the JSON staging files were converted on first use
+        self.assertFalse(os.path.exists(self.path('.krups/index.json')))
+        self.assertFalse(os.path.exists(self.path('.krups/added.json')))
+
+        os.remove(self.path('c.txt'))
+        self.run_vcs(f'checkout {self.first_commit}')
+        self.run_vcs(f'checkout {third_commit}')
+        self.assertEqual(self.read_file('c.txt'), b'c\n')
+        self.assertEqual(self.read_file('a.txt'), b'a2\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
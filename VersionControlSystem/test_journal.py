@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+from VCS import HandleFile, Journal
+
+
+class JournalTest(unittest.TestCase):
+    # a log cut off anywhere is dropped whole, a complete one is replayed
+    # whole, however often
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_handler = HandleFile()
+        self.file_handler.journal_file = self.path('journal')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, rel_path):
+        return os.path.join(self.temp_dir.name, rel_path)
+
+    def write_before_state(self):
+        for rel_path, data in (('HEAD', b'one\n'), ('log', b'abcdef'), ('old', b'old')):
+            with open(self.path(rel_path), 'wb') as file:
+                file.write(data)
+
+    def state(self):
+        files = {}
+        for dir_path, dir_names, file_names in os.walk(self.temp_dir.name):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                with open(file_path, 'rb') as file:
+                    files[os.path.relpath(file_path, self.temp_dir.name)] = file.read()
+        files.pop('journal', None)
+        return files
+
+    def logged_journal(self):
+        journal = self.file_handler.journal()
+        journal.append(self.path('HEAD'), b'two\n')
+        journal.write(self.path(os.path.join('branches', 'main', 'HEAD')), b'two\n')
+        journal.truncate(self.path('log'), 3)
+        journal.append(self.path('log'), b'XY')
+        journal.remove(self.path('old'))
+        return journal
+
+    def record_boundaries(self, journal):
+        offset = Journal.HEADER.size
+        boundaries = [0, offset]
+        for operation, position, path, data in journal.operations:
+            offset += Journal.RECORD.size + len(os.fsencode(path)) + len(data)
+            boundaries.append(offset)
+        return boundaries
+
+    def expected_state(self):
+        return {'HEAD': b'one\ntwo\n', os.path.join('branches', 'main', 'HEAD'): b'two\n',
+                'log': b'abcXY'}
+
+    def test_commit_applies_and_removes_the_log(self):
+        self.write_before_state()
+        self.logged_journal().commit()
+        self.assertEqual(self.state(), self.expected_state())
+        self.assertFalse(os.path.exists(self.path('journal')))
+
+    def test_truncated_log_is_dropped(self):
+        self.write_before_state()
+        before = self.state()
+        journal = self.logged_journal()
+        data = journal.encode()
+
+        # every record boundary, and the complete log without its trailer
+        for size in self.record_boundaries(journal) + [len(data) - 1]:
+            with self.subTest(size=size):
+                with open(self.path('journal'), 'wb') as file:
+                    file.write(data[:size])
+                self.assertFalse(self.file_handler.journal().recover())
+                self.assertEqual(self.state(), before)
+                self.assertFalse(os.path.exists(self.path('journal')))
+
+    def test_complete_log_is_replayed_once_or_twice(self):
+        # a crash after the writes, before the log is removed, replays a
+        # log that was already applied
+        self.write_before_state()
+        data = self.logged_journal().encode()
+
+        for replays in (1, 2):
+            with self.subTest(replays=replays):
+                self.write_before_state()
+                for _ in range(replays):
+                    with open(self.path('journal'), 'wb') as file:
+                        file.write(data)
+                    self.assertTrue(self.file_handler.journal().recover())
+                self.assertEqual(self.state(), self.expected_state())
+
+    def test_log_that_cannot_be_applied_is_moved_aside(self):
+        # a file where the log expects a directory
+        with open(self.path('branches'), 'wb') as file:
+            file.write(b'not a directory')
+        journal = self.file_handler.journal()
+        journal.write(self.path(os.path.join('branches', 'main', 'HEAD')), b'two\n')
+        with open(self.path('journal'), 'wb') as file:
+            file.write(journal.encode())
+
+        with self.assertRaises(OSError):
+            self.file_handler.journal().recover()
+        self.assertFalse(os.path.exists(self.path('journal')))
+        self.assertTrue(os.path.exists(self.path('journal.failed')))
+
+        # the next start has nothing left to replay
+        self.assertFalse(self.file_handler.journal().recover())
+
+
+if __name__ == '__main__':
+    unittest.main()
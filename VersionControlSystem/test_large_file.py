@@ -0,0 +1,52 @@
+import hashlib
+import os
+import unittest
+
+from vcs_testing import RepositoryTestCase
+
+CHUNK_SIZE = 1024 * 1024  # HandleFile.CHUNK_SIZE
+FILE_SIZE = 64 * CHUNK_SIZE
+
+
+@unittest.skipUnless(hasattr(os, 'wait4'), "peak memory is read with os.wait4")
+class LargeFileTest(RepositoryTestCase):
+    # a file many times CHUNK_SIZE is streamed through add, commit and
+    # checkout, so the process never holds it whole
+
+    def setUp(self):
+        super().setUp()
+        self.big_file = self.path('big.bin')
+
+        # random data does not compress, the object is as large as the file
+        digest = hashlib.md5()
+        with open(self.big_file, 'wb') as file:
+            for _ in range(FILE_SIZE // CHUNK_SIZE):
+                data = os.urandom(CHUNK_SIZE)
+                digest.update(data)
+                file.write(data)
+        self.digest = digest.hexdigest()
+
+    def test_commit_and_checkout_stream_the_file(self):
+        self.run_vcs('help')
+        baseline = self.peak_memory
+        self.run_vcs('add big.bin', 'commit -m big')
+        commit_peak = self.peak_memory
+        commit_hash = self.head_commits()[-1]
+
+        os.remove(self.big_file)
+        self.run_vcs(f'checkout {commit_hash}')
+        checkout_peak = self.peak_memory
+
+        digest = hashlib.md5()
+        with open(self.big_file, 'rb') as file:
+            for data in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(data)
+        self.assertEqual(digest.hexdigest(), self.digest)
+
+        # a few chunks in flight on top of what the interpreter needs anyway
+        self.assertLess(commit_peak - baseline, FILE_SIZE // 4)
+        self.assertLess(checkout_peak - baseline, FILE_SIZE // 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
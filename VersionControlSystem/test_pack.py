@@ -0,0 +1,158 @@
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+
+from VCS import PackStore
+from vcs_testing import RepositoryTestCase
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packs = PackStore(None)
+        self.base = bytes(random.Random(1).getrandbits(8) for _ in range(20000))
+
+    def assert_round_trip(self, base, target):
+        base_hash = hashlib.md5(base).hexdigest()
+        delta_base_hash, delta = self.packs.parse_delta(
+            self.packs.make_delta(base_hash, base, target))
+        self.assertEqual(delta_base_hash, base_hash)
+        self.assertEqual(self.packs.apply_delta(base, delta), target)
+
+    def test_round_trip(self):
+        base = self.base
+        cases = [
+            ('same', base, base),
+            ('appended', base, base + b'tail'),
+            ('prefixed', base, b'head' + base),
+            ('edited', base, base[:5000] + b'edit' + base[5004:]),
+            ('moved', base, base[10000:] + base[:10000]),
+            ('truncated', base, base[:100]),
+            ('empty target', base, b''),
+            ('empty base', b'', base),
+            ('unrelated', base, bytes(reversed(base))),
+        ]
+        for name, case_base, target in cases:
+            with self.subTest(name):
+                self.assert_round_trip(case_base, target)
+
+
+class PackIndexTest(unittest.TestCase):
+    # the .idx is mapped and binary searched by (hash, kind)
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pack_dir = os.path.join(self.temp_dir.name, 'pack')
+        self.packs = PackStore(self.pack_dir)
+
+        self.objects = {}
+        for number in range(300):
+            data = f'object {number}\n'.encode() * (number + 1)
+            object_hash = hashlib.md5(data).hexdigest()
+            kind = (PackStore.KIND_CONTENT, PackStore.KIND_CONTENT_RAW,
+                    PackStore.KIND_COMMIT)[number % 3]
+            path = os.path.join(self.temp_dir.name, f'{object_hash}.{kind}')
+            with open(path, 'wb') as file:
+                file.write(data)
+            self.objects[object_hash, kind] = (data, path)
+
+    def tearDown(self):
+        self.packs.close()
+        self.temp_dir.cleanup()
+
+    def write_pack(self, objects, keep=None):
+        return self.packs.write_pack(
+            [(object_hash, kind, path) for (object_hash, kind), (data, path) in objects],
+            hashlib.md5(), keep=keep)
+
+    def assert_packed(self, objects):
+        for (object_hash, kind), (data, path) in objects.items():
+            self.assertEqual(self.packs.read(object_hash, kind), data)
+            self.assertEqual(self.packs.stored_size(object_hash, kind), len(data))
+            # the same hash under another kind is a different entry
+            other_kind = PackStore.KIND_CONTENT_DELTA
+            self.assertFalse(self.packs.contains(object_hash, other_kind))
+        for missing in ('0' * 32, 'f' * 32, 'not a hash'):
+            self.assertIsNone(self.packs.find(missing, PackStore.KIND_CONTENT))
+
+    def test_lookup(self):
+        pack_name, count = self.write_pack(self.objects.items())
+        self.assertEqual(count, len(self.objects))
+        self.assert_packed(self.objects)
+
+    def test_repack_merges_packs(self):
+        items = sorted(self.objects.items())
+        self.write_pack(items[:100])
+        self.write_pack(items[100:])
+        self.assertEqual(len(self.packs.load()), 1)
+        self.assert_packed(self.objects)
+
+        # and drops what keep rejects
+        kept = dict(items[:150])
+        digests = {bytes.fromhex(object_hash) for object_hash, kind in kept}
+        self.write_pack([], keep=lambda key, kind: key[:16] in digests)
+        self.assert_packed(kept)
+        for object_hash, kind in dict(items[150:]):
+            self.assertFalse(self.packs.contains(object_hash, kind))
+
+
+class DeltaPackTest(RepositoryTestCase):
+    # versions of one file, deltified in the pack against their predecessor
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(2)
+        lines = [f'line {number} {rng.random()}\n' for number in range(3000)]
+        self.versions = []
+        for version in range(12):
+            lines[version * 100] = f'changed in version {version}\n'
+            data = ''.join(lines).encode()
+            self.write_file('f.txt', data)
+            self.versions.append((self.commit(f'v{version}'), data))
+
+    def delta_depths(self):
+        # the chain length of every deltified object in the pack
+        packs = PackStore(self.path('.krups/objects/pack'))
+        bases = {}
+        for key, kind, pack_path, offset, length in packs.iter_packed():
+            if kind == PackStore.KIND_CONTENT_DELTA:
+                object_hash = key[:16].hex()
+                bases[object_hash] = packs.parse_delta(
+                    packs.read(object_hash, kind))[0]
+        packs.close()
+
+        def depth(object_hash):
+            return 1 + depth(bases[object_hash]) if object_hash in bases else 0
+        return [depth(object_hash) for object_hash in bases]
+
+    def assert_versions(self):
+        for commit_hash, data in self.versions:
+            self.run_vcs(f'checkout {commit_hash}')
+            self.assertEqual(self.read_file('f.txt'), data)
+
+    def test_chains_stop_at_the_depth_limit(self):
+        output = self.run_vcs('pack --delta --depth 4')
+        self.assertIn('Stored 9 delta(s) and 0 whole object(s) anew', output)
+        depths = self.delta_depths()
+        self.assertEqual(len(depths), 9)
+        self.assertEqual(max(depths), 4)
+        self.assert_versions()
+
+    def test_repack(self):
+        self.run_vcs('pack --delta --depth 4')
+        self.assertIn('Every delta is already stored', self.run_vcs('pack --delta --depth 4'))
+        self.assertEqual(max(self.delta_depths()), 4)
+
+        # a lower limit stores the blobs past it whole again
+        output = self.run_vcs('pack --delta --depth 2')
+        self.assertNotIn('Error', output)
+        self.assertEqual(max(self.delta_depths()), 2)
+        self.run_vcs('pack')
+        self.assertEqual(max(self.delta_depths()), 2)
+        self.assert_versions()
+
+
+if __name__ == '__main__':
+    unittest.main()
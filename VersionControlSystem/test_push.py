@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+
+from vcs_testing import RepositoryTestCase
+
+
+class PushTest(RepositoryTestCase):
+    # push exports HEAD and deletes only files an earlier push wrote there
+
+    def setUp(self):
+        super().setUp()
+        self.outside_dir = tempfile.TemporaryDirectory()
+        self.push_dir = os.path.join(self.outside_dir.name, 'export')
+        self.write_file('a.txt', 'a\n')
+        self.commit()
+        self.run_vcs(f'push {self.push_dir}')
+
+    def tearDown(self):
+        self.outside_dir.cleanup()
+        super().tearDown()
+
+    def add_to_manifest(self, *relative_paths):
+        manifest_file = os.path.join(self.push_dir, '.krups_push.json')
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+        for relative_path in relative_paths:
+            manifest[relative_path] = ['0' * 32, 0, 0]
+        with open(manifest_file, 'w') as file:
+            json.dump(manifest, file)
+
+    def test_push_writes_head(self):
+        with open(os.path.join(self.push_dir, 'a.txt'), 'rb') as file:
+            self.assertEqual(file.read(), b'a\n')
+
+    def test_stale_file_is_removed(self):
+        os.makedirs(os.path.join(self.push_dir, 'old'))
+        stale_file = os.path.join(self.push_dir, 'old', 'stale.txt')
+        with open(stale_file, 'w') as file:
+            file.write('stale\n')
+        self.add_to_manifest(os.path.join('old', 'stale.txt'))
+
+        self.run_vcs(f'push {self.push_dir}')
+        self.assertFalse(os.path.exists(stale_file))
+        self.assertFalse(os.path.exists(os.path.dirname(stale_file)))
+
+    def test_manifest_cannot_reach_outside(self):
+        victims = [os.path.join(self.outside_dir.name, 'victim.txt'),
+                   os.path.join(self.outside_dir.name, 'absolute.txt')]
+        for victim in victims:
+            with open(victim, 'w') as file:
+                file.write('keep\n')
+        self.add_to_manifest(os.path.join('..', 'victim.txt'), victims[1], '.')
+
+        output = self.run_vcs(f'push {self.push_dir}')
+        self.assertIn('is outside', output)
+        for victim in victims:
+            self.assertTrue(os.path.exists(victim))
+        self.assertTrue(os.path.isdir(self.push_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from VCS import StatCache
+
+SECOND = 1000 * 1000 * 1000
+
+
+class StatCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, 'stat_cache')
+        self.hashed = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, rel_path):
+        return os.path.join(self.temp_dir.name, rel_path)
+
+    def write_file(self, rel_path, data, mtime_ns):
+        file_path = self.path(rel_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as file:
+            file.write(data)
+        os.utime(file_path, ns=(mtime_ns, mtime_ns))
+
+    def compute_hash(self, file_path):
+        self.hashed.append(file_path)
+        with open(file_path, 'rb') as file:
+            return hashlib.md5(file.read()).hexdigest()
+
+    def get_hash(self, cache, rel_path):
+        return cache.get_hash(self.path(rel_path), rel_path, self.compute_hash)
+
+    def cached_files(self):
+        cache = StatCache(self.cache_file)
+        cache.load()
+        return cache.entries()
+
+    def test_round_trip(self):
+        # files older than the cache are answered from it, unread
+        paths = ['top.txt', os.path.join('d', 'a.txt'), os.path.join('d', 'e', 'b.txt'),
+                 os.path.join('dd', 'c.txt'), 'unicodé.txt']
+        for rel_path in paths:
+            self.write_file(rel_path, rel_path.encode(), 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        hashes = {rel_path: self.get_hash(cache, rel_path) for rel_path in paths}
+        cache.save()
+        self.assertEqual(len(self.hashed), len(paths))
+
+        self.hashed = []
+        cache = StatCache(self.cache_file)
+        for rel_path in reversed(paths):
+            self.assertEqual(self.get_hash(cache, rel_path), hashes[rel_path])
+        self.assertEqual(self.hashed, [])
+        self.assertEqual({rel_path: entry[4] for rel_path, entry in self.cached_files().items()},
+                         hashes)
+
+    def test_changed_file_is_hashed_again(self):
+        self.write_file('a.txt', b'one', 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.save()
+
+        self.write_file('a.txt', b'two!', 20 * SECOND)
+        self.assertEqual(self.get_hash(StatCache(self.cache_file), 'a.txt'),
+                         hashlib.md5(b'two!').hexdigest())
+        self.assertEqual(len(self.hashed), 2)
+
+    def test_racy_file_is_hashed_again(self):
+        # a file modified in the same tick the cache was written may have
+        # changed again since, with the same size and mtime
+        self.write_file('a.txt', b'one', 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.save()
+
+        self.write_file('a.txt', b'two', 10 * SECOND)
+        os.utime(self.cache_file, ns=(10 * SECOND, 10 * SECOND))
+        self.assertEqual(self.get_hash(StatCache(self.cache_file), 'a.txt'),
+                         hashlib.md5(b'two').hexdigest())
+        self.assertEqual(len(self.hashed), 2)
+
+    def test_prune_and_forget(self):
+        for rel_path in ('a.txt', 'b.txt', os.path.join('d', 'c.txt')):
+            self.write_file(rel_path, b'x', 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        for rel_path in ('a.txt', 'b.txt', os.path.join('d', 'c.txt')):
+            self.get_hash(cache, rel_path)
+        cache.save()
+
+        # a full scan that saw only a.txt and d/c.txt, then d/c.txt removed
+        cache = StatCache(self.cache_file)
+        for rel_path in ('a.txt', os.path.join('d', 'c.txt')):
+            self.get_hash(cache, rel_path)
+        cache.prune({'a.txt', os.path.join('d', 'c.txt')})
+        cache.forget(os.path.join('d', 'c.txt'))
+        cache.save()
+        self.assertEqual(list(self.cached_files()), ['a.txt'])
+
+    def test_nothing_to_prune_leaves_the_file(self):
+        self.write_file('a.txt', b'x', 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.save()
+        mtime_ns = os.stat(self.cache_file).st_mtime_ns
+
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.prune({'a.txt'})
+        self.assertFalse(cache.dirty)
+        cache.save()
+        self.assertEqual(os.stat(self.cache_file).st_mtime_ns, mtime_ns)
+
+    def test_corrupt_cache_is_ignored(self):
+        self.write_file('a.txt', b'x', 10 * SECOND)
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.save()
+        with open(self.cache_file, 'rb') as file:
+            data = bytearray(file.read())
+
+        flipped = bytearray(data)
+        flipped[len(data) // 2] ^= 0xFF
+        for name, broken in (('flipped', flipped), ('truncated', data[:len(data) - 1]),
+                             ('empty', b'')):
+            with self.subTest(name):
+                with open(self.cache_file, 'wb') as file:
+                    file.write(broken)
+                self.hashed = []
+                self.assertEqual(self.get_hash(StatCache(self.cache_file), 'a.txt'),
+                                 hashlib.md5(b'x').hexdigest())
+                self.assertEqual(len(self.hashed), 1)
+
+    def test_legacy_json_cache_is_dropped(self):
+        with open(self.cache_file + '.json', 'w') as file:
+            file.write('{"a.txt": [1, 2, 3, 4, "00"]}')
+        self.write_file('a.txt', b'x', 10 * SECOND)
+
+        cache = StatCache(self.cache_file)
+        self.get_hash(cache, 'a.txt')
+        cache.save()
+        self.assertFalse(os.path.exists(self.cache_file + '.json'))
+        self.assertEqual(list(self.cached_files()), ['a.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
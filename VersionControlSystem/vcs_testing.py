@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+VCS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VCS.py')
+
+
+class RepositoryTestCase(unittest.TestCase):
+    # every test gets a fresh repository in a temporary directory and drives
+    # VCS.py through its prompt, the way a user would
+    init_commands = ('init', 'tester')
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo_dir = self.temp_dir.name
+        self.peak_memory = None
+        if self.init_commands:
+            self.run_vcs(*self.init_commands)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_vcs(self, *commands):
+        # the commands' output; the peak memory of the process running them
+        # is kept in self.peak_memory where os.wait4 can report it
+        process = subprocess.Popen([sys.executable, VCS_PATH], cwd=self.repo_dir,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True)
+        process.stdin.write('\n'.join(commands + ('exit',)) + '\n')
+        process.stdin.close()
+        output = process.stdout.read()
+        process.stdout.close()
+        if hasattr(os, 'wait4'):
+            # reaped here rather than by Popen.wait, which drops the rusage
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak = usage.ru_maxrss
+            self.peak_memory = peak if sys.platform == 'darwin' else peak * 1024
+        else:
+            process.wait()
+        self.assertNotIn('Traceback', output)
+        return output
+
+    def path(self, rel_path):
+        return os.path.join(self.repo_dir, *rel_path.split('/'))
+
+    def write_file(self, rel_path, data):
+        file_path = self.path(rel_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+
+    def read_file(self, rel_path):
+        with open(self.path(rel_path), 'rb') as file:
+            return file.read()
+
+    def commit(self, message='commit'):
+        # the new HEAD commit's hash
+        self.run_vcs('add .', f'commit -m {message}')
+        return self.head_commits()[-1]
+
+    def head_commits(self, branch='main'):
+        with open(self.path(f'.krups/branches/{branch}/HEAD')) as file:
+            return file.read().split()
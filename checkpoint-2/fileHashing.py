@@ -3,6 +3,7 @@ import sys
 import hashlib
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 
 def compute_MD5(file_path):
@@ -41,7 +42,16 @@ def handle_copying():
     print(f"Files copied to {os.path.abspath(new_directory_path)}")
 
 
-def organize_directory(directory_path):
+def compute_MD5_files(file_paths, jobs):
+    if jobs <= 1:
+        return [compute_MD5(file_path) for file_path in file_paths]
+
+    # results come back in the same order as file_paths
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(compute_MD5, file_paths))
+
+
+def organize_directory(directory_path, jobs=1):
     directory_path = os.path.abspath(directory_path)
     if not os.path.exists(directory_path):
         print(f"The specified directory path does not exist: {directory_path}")
@@ -51,11 +61,12 @@ def organize_directory(directory_path):
         os.path.join(directory_path, f))]
     # print(files)
 
-    for file in files:
+    file_paths = [os.path.join(directory_path, file) for file in files]
+    file_hashes = compute_MD5_files(file_paths, jobs)
+
+    for file, file_path, file_hash_MD5 in zip(files, file_paths, file_hashes):
         # print(file)
-        file_path = os.path.join(directory_path, file)
         file_size = os.path.getsize(file_path)
-        file_hash_MD5 = compute_MD5(file_path)
         # print(file_path, file_size, file_hash_MD5)
 
         files_info_JSON[file] = {
@@ -78,10 +89,11 @@ def organize_directory(directory_path):
         handle_copying()
 
 
-if len(sys.argv) < 2:
-    print("Usage: python fileHashing.py <directory_path>")
+if len(sys.argv) not in (2, 4) or (len(sys.argv) == 4 and (sys.argv[2] != '--jobs' or not sys.argv[3].isdigit())):
+    print("Usage: python fileHashing.py <directory_path> [--jobs <n>]")
     sys.exit(1)
 
 directory_path = sys.argv[1]
+jobs = int(sys.argv[3]) if len(sys.argv) == 4 else os.cpu_count() or 1
 
-organize_directory(directory_path)
+organize_directory(directory_path, jobs)